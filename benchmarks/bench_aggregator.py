@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# CPU an aggregator needs for many hosts pushing 1 s samples. The aggregator
+# runs as its own process (python3 -m src.aggregator serve) and simulated
+# hosts send it batches in real time, each on its own connection.
+#
+#   python3 -m benchmarks.bench_aggregator --hosts 2000 --seconds 30
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from src.push import encode_hello, encode_frame, BATCH, BATCH_HEADER
+from src.system_metrics_collector import COLUMNS, BINARY_TYPES
+
+RECORDS = {metric: struct.Struct('<' + BINARY_TYPES[metric]) for metric in COLUMNS}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def batch(start, seconds, rng):
+    # One host's rows for `seconds` ticks starting at `start`, as PushClient packs them
+    payload = bytearray()
+    for index, metric in enumerate(COLUMNS):
+        payload += BATCH_HEADER.pack(index, seconds)
+        for tick in range(seconds):
+            values = [rng.random() * 100 for _ in COLUMNS[metric][1:]] if metric == 'cpu' else \
+                [int(rng.random() * 1e9) for _ in COLUMNS[metric][1:]]
+            payload += RECORDS[metric].pack(start + tick, *values)
+    return encode_frame(BATCH, bytes(payload))
+
+
+async def host(index, port, batch_interval, stop, counters):
+    rng = random.Random(index)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(encode_hello(f'sim-{index:05d}', COLUMNS, BINARY_TYPES))
+    # Spread the hosts' send times over the interval, as real collectors are
+    await asyncio.sleep(rng.random() * batch_interval)
+    timestamp = int(time.time())
+    while time.monotonic() < stop:
+        frame = batch(timestamp, batch_interval, rng)
+        writer.write(frame)
+        await writer.drain()
+        counters['frames'] += 1
+        counters['bytes'] += len(frame)
+        counters['rows'] += batch_interval * len(COLUMNS)
+        timestamp += batch_interval
+        await asyncio.sleep(batch_interval)
+    writer.close()
+
+
+async def simulate(hosts, port, batch_interval, seconds, counters):
+    stop = time.monotonic() + seconds
+    await asyncio.gather(*[host(i, port, batch_interval, stop, counters) for i in range(hosts)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the push aggregator with many simulated hosts')
+    parser.add_argument('--hosts', type=int, default=2000)
+    parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--batch-interval', type=int, default=5, help='Seconds of samples per batch')
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as output_dir:
+        server = subprocess.Popen([sys.executable, '-m', 'src.aggregator', 'serve', '--output-dir', output_dir,
+                                   '--host', '127.0.0.1', '--port', str(port), '--duration', str(args.seconds + 30)],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), 1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            process = psutil.Process(server.pid)
+            counters = {'frames': 0, 'bytes': 0, 'rows': 0}
+            cpu_start = sum(process.cpu_times()[:2])
+            wall_start = time.perf_counter()
+            asyncio.run(simulate(args.hosts, port, args.batch_interval, args.seconds, counters))
+            wall = time.perf_counter() - wall_start
+            cpu = sum(process.cpu_times()[:2]) - cpu_start
+            rss = process.memory_info().rss
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{args.hosts} hosts, 1 s samples in {args.batch_interval} s batches, {wall:.1f} s")
+    print(f"received {counters['rows'] / wall:.0f} rows/s in {counters['frames'] / wall:.0f} batches/s, "
+          f"{counters['bytes'] / wall / 1024:.0f} KiB/s on the wire ({counters['bytes'] / counters['rows']:.1f} B/row)")
+    print(f"aggregator CPU {cpu / wall * 100:.1f}% of one core, RSS {rss / 1024 / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
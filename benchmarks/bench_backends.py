@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Per-sample CPU cost of the psutil and procfs collection backends.
+#
+#   python3 -m benchmarks.bench_backends --samples 2000
+
+import argparse
+import time
+
+from src.system_metrics_collector import create_backend
+
+SOURCES = ['cpu', 'memory', 'io', 'network']
+
+
+def measure(backend, samples):
+    results = {}
+    for source in SOURCES + ['all']:
+        functions = [getattr(backend, s) for s in SOURCES] if source == 'all' else [getattr(backend, source)]
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(samples):
+            for function in functions:
+                function()
+        results[source] = (
+            (time.process_time() - cpu_start) / samples * 1e6,
+            (time.perf_counter() - wall_start) / samples * 1e6
+        )
+    return results
+
+
+def compare_fields(backends):
+    # Counters move between calls, so only print them side by side
+    for source in SOURCES[1:]:
+        print(f"{source:8}", '  '.join(f"{b.name}={getattr(b, source)()}" for b in backends))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark system collection backends')
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    backends = [create_backend('psutil'), create_backend('procfs')]
+    compare_fields(backends)
+    print()
+
+    print(f"{'backend':8} {'source':8} {'cpu us/sample':>14} {'wall us/sample':>15}")
+    for backend in backends:
+        for source, (cpu_us, wall_us) in measure(backend, args.samples).items():
+            print(f"{backend.name:8} {source:8} {cpu_us:14.1f} {wall_us:15.1f}")
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# JFR lock event extraction on a synthetic recording, end to end through the
+# interned lock tables.
+#
+#   python3 -m benchmarks.bench_jfr_reader --events 200000
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.generators import generate_jfr_recording
+from src.jfr_reader import iter_lock_batches, iter_lock_events, LockWaitRecorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JFR lock event reader')
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--locks', type=int, default=50)
+    parser.add_argument('--chunk-events', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data = generate_jfr_recording(args.events, args.threads, args.locks, chunk_events=args.chunk_events)
+    size_mb = len(data) / (1024 * 1024)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'recording.jfr')
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            events = sum(len(batch['timestamp']) for batch in iter_lock_batches(path))
+            timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sum(1 for _ in iter_lock_events(path))
+        as_dicts = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recorder = LockWaitRecorder(tmp)
+        for batch in iter_lock_batches(path):
+            recorder.add_batch(batch)
+        recorder.close()
+        recorded = time.perf_counter() - start
+
+    best = min(timings)
+    print(f"recording: {args.events} events, {size_mb:.1f} MB, {events} lock events")
+    print(f"read: best {best * 1000:.1f} ms, {events / best:,.0f} events/s, {size_mb / best:.1f} MB/s")
+    print(f"read as dicts: {as_dicts * 1000:.1f} ms, {events / as_dicts:,.0f} events/s")
+    print(f"read + record: {recorded * 1000:.1f} ms, {events / recorded:,.0f} events/s, "
+          f"{size_mb / recorded:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
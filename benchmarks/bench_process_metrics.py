@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Per-tick cost of the top-N process tracker with many processes running, and
+# sampler lateness while the HTTP exporter is scraped by many clients at once.
+#
+#   python3 -m benchmarks.bench_process_metrics --processes 1000 --clients 300
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from src.exporter import MetricsExporter
+from src.process_metrics import ProcessTracker, PROCESS_COLUMNS
+from src.system_metrics_collector import MetricsCollector, COLUMNS
+
+
+def measure_tracker(ticks):
+    tracker = ProcessTracker()
+    tracker.sample(time.time())
+    durations = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        rows = tracker.sample(time.time())
+        durations.append((time.perf_counter() - start) * 1e3)
+    tracked = len(tracker.handles)
+    tracker.close()
+    return tracked, len(rows), durations
+
+
+def naive_tick():
+    # Every process through psutil, for comparison
+    start = time.perf_counter()
+    for process in psutil.process_iter():
+        try:
+            with process.oneshot():
+                process.cpu_times()
+                process.memory_info()
+                process.num_threads()
+                process.num_ctx_switches()
+                process.io_counters()
+        except psutil.Error:
+            pass
+    return (time.perf_counter() - start) * 1e3
+
+
+async def scrape(port, path, stop):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode()
+    count = 0
+    while time.monotonic() < stop:
+        writer.write(request)
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = next(int(line.split(b':')[1]) for line in head.split(b'\r\n')
+                      if line.lower().startswith(b'content-length'))
+        await reader.readexactly(length)
+        count += 1
+    writer.close()
+    return count
+
+
+async def load(port, clients, seconds):
+    stop = time.monotonic() + seconds
+    paths = ['/metrics', '/api/latest', '/api/range?metric=cpu&seconds=60']
+    counts = await asyncio.gather(*[scrape(port, paths[i % len(paths)], stop) for i in range(clients)])
+    return sum(counts)
+
+
+def measure_exporter(clients, seconds):
+    exporter = MetricsExporter(COLUMNS, port=0, process_columns=PROCESS_COLUMNS)
+    exporter.start()
+    with tempfile.TemporaryDirectory() as output_dir:
+        collector = MetricsCollector(output_dir, 1, ['cpu', 'memory', 'io', 'network', 'process'], {},
+                                     exporter=exporter)
+        collector.start_collection()
+        time.sleep(2)
+        before = collector.scheduler.stats()
+        start = time.perf_counter()
+        requests = asyncio.run(load(exporter.port, clients, seconds))
+        elapsed = time.perf_counter() - start
+        after = collector.scheduler.stats()
+        collector.stop_collection()
+    return requests / elapsed, before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process tracking and the HTTP exporter')
+    parser.add_argument('--processes', type=int, default=1000, help='Idle processes to start first')
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    sleepers = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+                for _ in range(args.processes)]
+    try:
+        time.sleep(1)
+        tracked, rows, durations = measure_tracker(args.ticks)
+        print(f"tracker: {tracked} processes, {rows} rows/tick, "
+              f"median {statistics.median(durations):.1f} ms, max {max(durations):.1f} ms per tick")
+        print(f"psutil oneshot over every process: {naive_tick():.1f} ms")
+    finally:
+        for sleeper in sleepers:
+            sleeper.kill()
+        for sleeper in sleepers:
+            sleeper.wait()
+
+    rate, before, after = measure_exporter(args.clients, args.seconds)
+    print(f"exporter: {args.clients} clients, {rate:.0f} requests/s")
+    print(f"sampler under load: {after['ticks'] - before['ticks']} ticks, "
+          f"{after['missed_ticks'] - before['missed_ticks']} missed, "
+          f"{after['late_ticks'] - before['late_ticks']} late, max lateness {after['max_lateness_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
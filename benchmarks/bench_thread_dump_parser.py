@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Thread dump parsing cost on synthetic jstack dumps, including lock summary
+# and deadlock detection.
+#
+#   python3 -m benchmarks.bench_thread_dump_parser --threads 10000 --locks 50
+
+import argparse
+import io
+import time
+
+from benchmarks.generators import generate_thread_dump
+from src.thread_dump_parser import parse_thread_dump, summarize_locks, find_deadlocks
+
+
+def run(dump, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Feed it as a stream, the way the collector reads jstack's stdout
+        threads_info, lock_info = parse_thread_dump(io.StringIO(dump))
+        summary = summarize_locks(lock_info)
+        deadlocks = find_deadlocks(lock_info)
+        timings.append(time.perf_counter() - start)
+    return timings, threads_info, lock_info, summary, deadlocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the thread dump parser')
+    parser.add_argument('--threads', type=int, default=10000)
+    parser.add_argument('--locks', type=int, default=50)
+    parser.add_argument('--depth', type=int, default=20)
+    parser.add_argument('--deadlocks', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    dump = generate_thread_dump(args.threads, args.locks, args.depth, args.deadlocks)
+    timings, threads_info, lock_info, summary, deadlocks = run(dump, args.repeat)
+
+    best = min(timings)
+    size_mb = len(dump) / (1024 * 1024)
+    print(f"dump: {args.threads} threads, {dump.count(chr(10))} lines, {size_mb:.1f} MB")
+    print(f"parsed: {len(threads_info)} threads, {len(lock_info)} waiting, "
+          f"{len(summary)} contended locks, {len(deadlocks)} deadlocks")
+    print(f"best {best * 1000:.1f} ms, median {sorted(timings)[len(timings) // 2] * 1000:.1f} ms, "
+          f"{len(threads_info) / best:,.0f} threads/s, {size_mb / best:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# Deterministic synthetic inputs for the benchmarks. Everything is derived
+# from a seeded random.Random, so the same arguments always produce the same
+# bytes.
+
+import math
+import random
+
+from src.sinks import open_sink
+from src.system_metrics_collector import COLUMNS, BINARY_TYPES
+
+PACKAGES = ['com.example.service', 'com.example.db', 'com.example.http', 'io.netty.channel', 'org.apache.kafka.clients']
+CLASSES = ['OrderHandler', 'ConnectionPool', 'RequestRouter', 'EventLoop', 'Consumer', 'Cache', 'Scheduler']
+METHODS = ['handle', 'process', 'acquire', 'poll', 'dispatch', 'run', 'get', 'update', 'flush']
+
+DUMP_HEADER = '''2024-01-01 00:00:00
+Full thread dump OpenJDK 64-Bit Server VM (21.0.2+13-58, mixed mode, sharing):
+
+'''
+
+
+def _frames(rng, depth):
+    frames = []
+    for _ in range(depth):
+        package = rng.choice(PACKAGES)
+        cls = rng.choice(CLASSES)
+        frames.append(f'\tat {package}.{cls}.{rng.choice(METHODS)}({cls}.java:{rng.randint(10, 900)})')
+    return frames
+
+
+def _thread_header(index, name, status):
+    # JDK 21 layout: thread number, [OS thread id], decimal nid
+    return (f'"{name}" #{index + 20} [{index + 4096}] daemon prio=5 os_prio=0 cpu=12.34ms elapsed=100.00s '
+            f'tid=0x00007f{index:010x} nid={index + 4096} {status}  [0x00007f{index:010x}]')
+
+
+# A `jstack -l` style dump with `threads` Java threads. `contended_locks`
+# monitors and as many ReentrantLocks each have one owner and a share of the
+# blocked/parked threads; `deadlocks` pairs of threads are deadlocked on each
+# other's monitor. The remaining threads are runnable, sleeping or in wait().
+def generate_thread_dump(threads=1000, contended_locks=10, depth=20, deadlocks=0, seed=0):
+    rng = random.Random(seed)
+    monitors = [f'0x{0x71a000000 + i * 0x40:016x}' for i in range(contended_locks)]
+    sync_locks = [f'0x{0x72b000000 + i * 0x40:016x}' for i in range(contended_locks)]
+    parts = [DUMP_HEADER]
+
+    def emit(index, name, status, state, body, synchronizers=()):
+        lines = [_thread_header(index, name, status), f'   java.lang.Thread.State: {state}']
+        lines.extend(body)
+        lines.append('')
+        lines.append('   Locked ownable synchronizers:')
+        lines.extend(f'\t- <{lock}> (a java.util.concurrent.locks.ReentrantLock$NonfairSync)' for lock in synchronizers)
+        if not synchronizers:
+            lines.append('\t- None')
+        lines.append('')
+        parts.append('\n'.join(lines) + '\n')
+
+    index = 0
+    for lock in monitors:
+        frames = _frames(rng, depth)
+        emit(index, f'monitor-owner-{index}', 'waiting on condition', 'TIMED_WAITING (sleeping)',
+             ['\tat java.lang.Thread.sleep(java.base@21.0.2/Native Method)', frames[0],
+              f'\t- locked <{lock}> (a java.lang.Object)'] + frames[1:])
+        index += 1
+    for lock in sync_locks:
+        emit(index, f'lock-owner-{index}', 'waiting on condition', 'TIMED_WAITING (sleeping)',
+             ['\tat java.lang.Thread.sleep(java.base@21.0.2/Native Method)'] + _frames(rng, depth), [lock])
+        index += 1
+
+    for pair in range(deadlocks):
+        a = f'0x{0x73c000000 + pair * 0x80:016x}'
+        b = f'0x{0x73c000040 + pair * 0x80:016x}'
+        for first, second, suffix in ((a, b, 'a'), (b, a, 'b')):
+            frames = _frames(rng, depth)
+            emit(index, f'deadlock-{pair}-{suffix}', 'waiting for monitor entry', 'BLOCKED (on object monitor)',
+                 [frames[0], f'\t- waiting to lock <{second}> (a java.lang.Object)',
+                  frames[1], f'\t- locked <{first}> (a java.lang.Object)'] + frames[2:])
+            index += 1
+
+    while index < threads:
+        kind = rng.random()
+        frames = _frames(rng, depth)
+        name = f'worker-{index}'
+        if kind < 0.3 and monitors:
+            lock = rng.choice(monitors)
+            emit(index, name, 'waiting for monitor entry', 'BLOCKED (on object monitor)',
+                 [frames[0], f'\t- waiting to lock <{lock}> (a java.lang.Object)'] + frames[1:])
+        elif kind < 0.5 and sync_locks:
+            lock = rng.choice(sync_locks)
+            emit(index, name, 'waiting on condition', 'WAITING (parking)',
+                 ['\tat jdk.internal.misc.Unsafe.park(java.base@21.0.2/Native Method)',
+                  f'\t- parking to wait for  <{lock}> (a java.util.concurrent.locks.ReentrantLock$NonfairSync)'] + frames)
+        elif kind < 0.6:
+            lock = f'0x{0x74d000000 + index * 0x40:016x}'
+            emit(index, name, 'in Object.wait()', 'WAITING (on object monitor)',
+                 ['\tat java.lang.Object.wait(java.base@21.0.2/Native Method)',
+                  f'\t- waiting on <{lock}> (a java.lang.Object)', frames[0],
+                  f'\t- locked <{lock}> (a java.lang.Object)'] + frames[1:])
+        else:
+            emit(index, name, 'runnable', 'RUNNABLE', frames)
+        index += 1
+
+    parts.append('"VM Thread" os_prio=0 cpu=100.00ms elapsed=100.00s tid=0x00007f0000000001 nid=16 runnable\n\n')
+    parts.append('JNI global refs: 20, weak refs: 0\n')
+    return ''.join(parts)
+
+
+def _varint(value):
+    # JFR compressed integer: 7 bits per byte, the 9th byte carries 8
+    value &= 0xffffffffffffffff
+    out = bytearray()
+    for _ in range(8):
+        if value < 0x80:
+            out.append(value)
+            return bytes(out)
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _jfr_string(value):
+    data = value.encode()
+    return b'\x03' + _varint(len(data)) + data
+
+
+def _jfr_event(payload):
+    # Size prefix padded to 4 bytes so it can count itself, like the JDK writes it
+    size = len(payload) + 4
+    return bytes([(size & 0x7f) | 0x80, ((size >> 7) & 0x7f) | 0x80, ((size >> 14) & 0x7f) | 0x80,
+                  (size >> 21) & 0x7f]) + payload
+
+
+JFR_TYPES = [
+    # id, name, [(field, type id, constant pool, array)]
+    (1, 'long', []), (2, 'int', []), (3, 'boolean', []), (4, 'java.lang.String', []),
+    (5, 'java.lang.Thread', [('osName', 4, False, False), ('osThreadId', 1, False, False),
+                             ('javaName', 4, False, False), ('javaThreadId', 1, False, False)]),
+    (6, 'java.lang.Class', [('name', 7, True, False), ('modifiers', 2, False, False)]),
+    (7, 'jdk.types.Symbol', [('string', 4, False, False)]),
+    (8, 'jdk.types.Method', [('type', 6, True, False), ('name', 7, True, False), ('descriptor', 7, True, False)]),
+    (9, 'jdk.types.StackFrame', [('method', 8, True, False), ('lineNumber', 2, False, False),
+                                 ('bytecodeIndex', 2, False, False)]),
+    (10, 'jdk.types.StackTrace', [('truncated', 3, False, False), ('frames', 9, False, True)]),
+    (20, 'jdk.JavaMonitorEnter', [('startTime', 1, False, False), ('duration', 1, False, False),
+                                  ('eventThread', 5, True, False), ('stackTrace', 10, True, False),
+                                  ('monitorClass', 6, True, False), ('previousOwner', 5, True, False),
+                                  ('address', 1, False, False)]),
+    (21, 'jdk.ThreadPark', [('startTime', 1, False, False), ('duration', 1, False, False),
+                            ('eventThread', 5, True, False), ('stackTrace', 10, True, False),
+                            ('parkedClass', 6, True, False), ('timeout', 1, False, False),
+                            ('until', 1, False, False), ('address', 1, False, False)]),
+    (22, 'jdk.ExecutionSample', [('startTime', 1, False, False), ('sampledThread', 5, True, False),
+                                 ('stackTrace', 10, True, False)])
+]
+
+
+def _jfr_metadata():
+    strings = []
+
+    def ref(value):
+        if value not in strings:
+            strings.append(value)
+        return _varint(strings.index(value))
+
+    def element(name, attributes, children=()):
+        out = ref(name) + _varint(len(attributes))
+        for key, value in attributes.items():
+            out += ref(key) + ref(value)
+        return out + _varint(len(children)) + b''.join(children)
+
+    classes = []
+    for type_id, name, fields in JFR_TYPES:
+        field_elements = []
+        for field, field_type, pooled, is_array in fields:
+            attributes = {'name': field, 'class': str(field_type)}
+            if pooled:
+                attributes['constantPool'] = 'true'
+            if is_array:
+                attributes['dimension'] = '1'
+            field_elements.append(element('field', attributes))
+        attributes = {'name': name, 'id': str(type_id)}
+        if type_id >= 20:
+            attributes['superType'] = 'jdk.jfr.Event'
+        classes.append(element('class', attributes, field_elements))
+    root = element('root', {}, [element('metadata', {}, classes), element('region', {'locale': 'en_US'})])
+    header = _varint(0) + _varint(0) + _varint(0) + _varint(1)
+    return _jfr_event(header + _varint(len(strings)) + b''.join(_jfr_string(s) for s in strings) + root)
+
+
+def _jfr_pool_event(pools, delta):
+    body = _varint(1) + _varint(0) + _varint(0) + _varint(delta) + b'\x00' + _varint(len(pools))
+    for type_id, entries in pools:
+        body += _varint(type_id) + _varint(len(entries))
+        for key, value in entries:
+            body += _varint(key) + value
+    return _jfr_event(body)
+
+
+# A JDK 11+ style recording (compressed integers) of contended monitor enters
+# and parks, with unrelated execution samples mixed in. Each chunk carries its
+# own metadata and constant pools, split over two chained pool events.
+# Durations are lognormal in milliseconds; every event's wait is a whole
+# number of microseconds so readers can be checked exactly.
+def generate_jfr_recording(events=10000, threads=50, locks=10, stacks=100, depth=20,
+                           chunk_events=5000, seed=0):
+    rng = random.Random(seed)
+    ticks_per_second = 1000000000
+    start_nanos = 1700000000 * 1000000000
+    lock_addresses = [0x71a000000 + i * 0x40 for i in range(locks)]
+    lock_classes = ['java.lang.Object', 'java.util.concurrent.locks.ReentrantLock$NonfairSync']
+    app_classes = [f'{p}.{c}'.replace('.', '/') for p in PACKAGES for c in CLASSES]
+    class_names = app_classes + [c.replace('.', '/') for c in lock_classes]
+    symbol_ids = {s: i + 1 for i, s in enumerate(class_names + METHODS + ['()V'])}
+    class_ids = {c: i + 1 for i, c in enumerate(class_names)}
+    methods = [(class_ids[rng.choice(app_classes)], symbol_ids[rng.choice(METHODS)]) for _ in range(200)]
+    traces = [[(rng.randrange(len(methods)) + 1, rng.randint(10, 900)) for _ in range(depth)]
+              for _ in range(stacks)]
+
+    chunks = []
+    ticks = 0
+    for chunk_start in range(0, events, chunk_events):
+        body = bytearray()
+        for _ in range(min(chunk_events, events - chunk_start)):
+            ticks += rng.randint(1000, 100000)
+            thread = rng.randrange(threads) + 1
+            trace = rng.randrange(stacks) + 1
+            if rng.random() < 0.2:
+                body += _jfr_event(_varint(22) + _varint(ticks) + _varint(thread) + _varint(trace))
+                continue
+            lock = rng.randrange(locks)
+            duration = int(rng.lognormvariate(0, 1.5) * 1000) * 1000
+            if lock % 2 == 0:
+                owner = rng.randrange(threads) + 1
+                body += _jfr_event(_varint(20) + _varint(ticks) + _varint(duration) + _varint(thread)
+                                   + _varint(trace) + _varint(class_ids['java/lang/Object'])
+                                   + _varint(owner) + _varint(lock_addresses[lock]))
+            else:
+                body += _jfr_event(_varint(21) + _varint(ticks) + _varint(duration) + _varint(thread)
+                                   + _varint(trace) + _varint(class_ids['java/util/concurrent/locks/ReentrantLock$NonfairSync'])
+                                   + _varint(-1) + _varint(-9223372036854775808) + _varint(lock_addresses[lock]))
+
+        thread_entries = [(i + 1, _jfr_string(f'os-{i}') + _varint(i + 100) + _jfr_string(f'worker-{i}')
+                           + _varint(i + 20)) for i in range(threads)]
+        first = _jfr_pool_event([(7, [(i, _jfr_string(s)) for s, i in symbol_ids.items()]),
+                                 (5, thread_entries)], 0)
+        class_entries = [(i, _varint(symbol_ids[c]) + _varint(1)) for c, i in class_ids.items()]
+        method_entries = [(i + 1, _varint(c) + _varint(m) + _varint(symbol_ids['()V']))
+                          for i, (c, m) in enumerate(methods)]
+        trace_entries = [(i + 1, b'\x00' + _varint(len(t)) + b''.join(_varint(m) + _varint(line) + _varint(0)
+                                                                       for m, line in t))
+                         for i, t in enumerate(traces)]
+        second = _jfr_pool_event([(6, class_entries), (8, method_entries), (10, trace_entries)], -len(first))
+
+        constant_pool_offset = 68 + len(body) + len(first)
+        metadata_offset = constant_pool_offset + len(second)
+        metadata = _jfr_metadata()
+        size = metadata_offset + len(metadata)
+        header = (b'FLR\x00' + (2).to_bytes(2, 'big') + (1).to_bytes(2, 'big')
+                  + b''.join(v.to_bytes(8, 'big', signed=True) for v in
+                             (size, constant_pool_offset, metadata_offset, start_nanos, ticks,
+                              0, ticks_per_second))
+                  + (1).to_bytes(4, 'big'))
+        chunks.append(header + bytes(body) + first + second + metadata)
+    return b''.join(chunks)
+
+
+# `days` of system metrics at one row per `interval` seconds, written with the
+# collector's own sinks as <output_dir>/{cpu,memory,io,network}_metrics in
+# `fmt` ('csv' or 'binary'). CPU follows a daily cycle with noise and short
+# bursts, memory climbs and is reclaimed every few hours, and the I/O and
+# network counters grow at a rate that follows the load. The CSV datetime
+# column is local time, as the collector writes it. Returns rows per table.
+def generate_system_metrics(output_dir, days=2, interval=1, fmt='csv', start=1704067200, seed=0):
+    rng = random.Random(seed)
+    output_config = {'format': fmt, 'flush_rows': 10000, 'flush_interval': 3600}
+    sinks = {metric: open_sink(f'{output_dir}/{metric}_metrics', COLUMNS[metric], output_config,
+                               BINARY_TYPES[metric]) for metric in ('cpu', 'memory', 'io', 'network')}
+    total = 16 * 1024 ** 3
+    used = 4 * 1024 ** 3
+    io = [0] * 6
+    network = [0] * 6
+    burst = 0
+    rows = int(days * 86400 / interval)
+    for i in range(rows):
+        timestamp = start + i * interval
+        if burst:
+            burst -= 1
+        elif rng.random() < 0.0005:
+            burst = rng.randint(5, 120)
+        day = math.sin(2 * math.pi * ((timestamp % 86400) / 86400 - 0.3))
+        cpu = min(max(35 + 25 * day + rng.gauss(0, 4) + (45 if burst else 0), 0.0), 100.0)
+        iowait = min(abs(rng.gauss(1, 1)), cpu)
+        sinks['cpu'].write([timestamp, round(cpu, 1), round(cpu * 0.7, 1), round(max(cpu * 0.3 - iowait / 2, 0.0), 1),
+                            round(iowait, 1)])
+
+        used += int(rng.gauss(2, 1) * 1024 * 1024 * interval)
+        if used > 12 * 1024 ** 3 or (i and timestamp % 14400 == 0):
+            used = 4 * 1024 ** 3 + rng.randint(0, 1024 ** 3)
+        cached = min(total - used, 2 * 1024 ** 3)
+        sinks['memory'].write([timestamp, total, total - used, used, total - used - cached, cached,
+                               256 * 1024 * 1024])
+
+        load = cpu / 100 * interval
+        io[0] += int(rng.expovariate(1 / 4e6) * load)
+        io[1] += int(rng.expovariate(1 / 8e6) * load)
+        io[2] += int(rng.expovariate(1 / 200) * load)
+        io[3] += int(rng.expovariate(1 / 400) * load)
+        io[4] += int(rng.expovariate(1 / 300) * load)
+        io[5] += int(rng.expovariate(1 / 600) * load)
+        sinks['io'].write([timestamp] + io)
+
+        network[0] += int(rng.expovariate(1 / 2e6) * load)
+        network[1] += int(rng.expovariate(1 / 6e6) * load)
+        network[2] += int(rng.expovariate(1 / 1500) * load)
+        network[3] += int(rng.expovariate(1 / 4000) * load)
+        network[5] += rng.random() < 0.001
+        sinks['network'].write([timestamp] + network)
+    for sink in sinks.values():
+        sink.close()
+    return rows
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# The main stages end to end on deterministic synthetic data, for spotting
+# regressions between commits: one collector tick (sample), jstack parsing
+# (parse_thread_dump), loading days of CSVs without and with the parse cache
+# (load_data) and drawing the overview (plot_all_metrics). For every stage it
+# reports latency percentiles over the repeats, throughput and peak traced
+# memory, and writes them as JSON. Run it on a baseline and then on a change:
+#
+#   python3 -m benchmarks.suite --output baseline.json
+#   python3 -m benchmarks.suite --output change.json --compare baseline.json
+#
+# --compare exits with status 1 when a stage's median time or peak memory is
+# more than --threshold percent worse. Sampling reads the live system; every
+# other input comes from benchmarks.generators and needs no JVM or network.
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from benchmarks.generators import generate_system_metrics, generate_thread_dump
+from src.plot_system_metrices import MetricsAnalyzer
+from src.system_metrics_collector import MetricsCollector
+from src.thread_dump_parser import parse_thread_dump
+
+STAGES = ['sample', 'parse_thread_dump', 'load_data', 'load_data_cached', 'plot_all_metrics']
+
+# Compared against the baseline; larger is worse for both
+COMPARED = ['p50_ms', 'peak_mib']
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q / 100 * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def measure(run, repeat):
+    # Seconds per call over `repeat` calls, then peak traced memory of one more
+    # call: tracemalloc slows allocation down, so it is kept out of the timings
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return timings, peak
+
+
+def summarize(timings, peak, units, unit):
+    timings = sorted(timings)
+    return {
+        'repeat': len(timings),
+        'min_ms': round(timings[0] * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'throughput': round(units / percentile(timings, 50), 1),
+        'unit': f'{unit}/s',
+        'peak_mib': round(peak / 1024 / 1024, 2)
+    }
+
+
+def bench_sample(output_dir, ticks, backend):
+    collector = MetricsCollector(output_dir, metrics=['cpu', 'memory', 'io', 'network'], backend=backend)
+    timestamp = [time.time()]
+
+    def tick():
+        timestamp[0] += 1
+        collector.sample(timestamp[0])
+
+    # Warm up the backend: the first CPU percentages are measured from here
+    tick()
+    timings, peak = measure(tick, ticks)
+    for sink in collector.writers():
+        sink.close()
+    collector.backend.close()
+    return summarize(timings, peak, 1, 'ticks')
+
+
+def bench_parse(dump, threads, repeat):
+    timings, peak = measure(lambda: parse_thread_dump(io.StringIO(dump)), repeat)
+    result = summarize(timings, peak, threads, 'threads')
+    result['mb_per_s'] = round(len(dump) / 1024 / 1024 / percentile(sorted(timings), 50), 1)
+    return result
+
+
+def bench_load(data_dir, rows, repeat, cache):
+    # A new analyzer for every load, as a fresh plotting process would be:
+    # one analyzer keeps the tables it has loaded in memory
+    if cache:
+        # Build the on-disk cache once; the timed loads only read it
+        MetricsAnalyzer(data_dir).load_data()
+    timings, peak = measure(lambda: MetricsAnalyzer(data_dir, cache=cache).load_data(), repeat)
+    return summarize(timings, peak, rows * 4, 'rows')
+
+
+def bench_plot(data_dir, repeat):
+    analyzer = MetricsAnalyzer(data_dir)
+    analyzer.load_data()
+
+    def plot():
+        fig = analyzer.plot_all_metrics()
+        fig.canvas.draw()
+        plt.close(fig)
+
+    timings, peak = measure(plot, repeat)
+    return summarize(timings, peak, 1, 'plots')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Prints each compared value against the baseline; returns the regressions
+    if baseline['parameters'] != results['parameters']:
+        print(f"Warning: baseline was run with {baseline['parameters']}")
+    regressions = []
+    print(f"\n{'stage':20} {'value':10} {'baseline':>12} {'now':>12} {'change':>8}")
+    for stage, result in results['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            continue
+        for key in COMPARED:
+            if not before.get(key):
+                continue
+            change = (result[key] - before[key]) / before[key] * 100
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append((stage, key, change))
+            print(f"{stage:20} {key:10} {before[key]:12.2f} {result[key]:12.2f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sampling, parsing, loading and plotting')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--days', type=float, default=2, help='Days of 1 s samples to load and plot')
+    parser.add_argument('--threads', type=int, default=2000, help='Threads in the synthetic thread dump')
+    parser.add_argument('--locks', type=int, default=20, help='Contended locks in the synthetic thread dump')
+    parser.add_argument('--ticks', type=int, default=1000, help='Collector ticks to time')
+    parser.add_argument('--backend', default='psutil', choices=['psutil', 'procfs'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier --output')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percent slower or larger than the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+        'parameters': {'days': args.days, 'threads': args.threads, 'locks': args.locks, 'ticks': args.ticks,
+                       'backend': args.backend, 'repeat': args.repeat, 'seed': args.seed},
+        'stages': {}
+    }
+    stages = results['stages']
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'sample' in args.stages:
+            stages['sample'] = bench_sample(f'{tmp}/collector', args.ticks, args.backend)
+
+        if 'parse_thread_dump' in args.stages:
+            dump = generate_thread_dump(args.threads, args.locks, seed=args.seed)
+            stages['parse_thread_dump'] = bench_parse(dump, args.threads, args.repeat)
+
+        if {'load_data', 'load_data_cached', 'plot_all_metrics'} & set(args.stages):
+            data_dir = f'{tmp}/metrics'
+            os.makedirs(data_dir)
+            start = time.perf_counter()
+            rows = generate_system_metrics(data_dir, args.days, seed=args.seed)
+            print(f"Generated {rows} rows per table in {time.perf_counter() - start:.1f} s")
+            if 'load_data' in args.stages:
+                stages['load_data'] = bench_load(data_dir, rows, args.repeat, cache=False)
+            if 'load_data_cached' in args.stages:
+                stages['load_data_cached'] = bench_load(data_dir, rows, args.repeat, cache=True)
+            if 'plot_all_metrics' in args.stages:
+                stages['plot_all_metrics'] = bench_plot(data_dir, args.repeat)
+
+    print(f"{'stage':20} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10} {'throughput':>22} "
+          f"{'peak MiB':>9}")
+    for stage, result in stages.items():
+        print(f"{stage:20} {result['p50_ms']:10.2f} {result['p95_ms']:10.2f} {result['p99_ms']:10.2f} "
+              f"{result['max_ms']:10.2f} {result['throughput']:>14,.{0 if result['throughput'] >= 100 else 2}f} "
+              f"{result['unit']:7} "
+              f"{result['peak_mib']:9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved as {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:g}%")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:g}%")
+
+
+if __name__ == "__main__":
+    main()
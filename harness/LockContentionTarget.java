@@ -0,0 +1,108 @@
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.locks.ReentrantLock;
+
+// Small JVM target for exercising the Java collectors locally: monitor and
+// ReentrantLock contention, Object.wait() waiters, allocation churn for GC and,
+// with --deadlock, a pair of threads deadlocked on two monitors.
+//
+//   java LockContentionTarget [--threads N] [--deadlock]
+public class LockContentionTarget {
+    private static final Object MONITOR = new Object();
+    private static final Object WAIT_MONITOR = new Object();
+    private static final ReentrantLock LOCK = new ReentrantLock();
+    private static volatile List<byte[]> retained = new ArrayList<>();
+
+    public static void main(String[] args) throws Exception {
+        int threads = 8;
+        boolean deadlock = false;
+        for (int i = 0; i < args.length; i++) {
+            if (args[i].equals("--threads")) {
+                threads = Integer.parseInt(args[++i]);
+            } else if (args[i].equals("--deadlock")) {
+                deadlock = true;
+            }
+        }
+
+        for (int i = 0; i < threads; i++) {
+            start("monitor-worker-" + i, LockContentionTarget::monitorWorker);
+            start("lock-worker-" + i, LockContentionTarget::lockWorker);
+        }
+        start("waiter", LockContentionTarget::waiter);
+        start("allocator", LockContentionTarget::allocator);
+        if (deadlock) {
+            Object a = new Object();
+            Object b = new Object();
+            start("deadlock-a", () -> lockBoth(a, b));
+            start("deadlock-b", () -> lockBoth(b, a));
+        }
+
+        System.out.println("pid " + ProcessHandle.current().pid());
+        Thread.currentThread().join();
+    }
+
+    private static void start(String name, Runnable body) {
+        Thread thread = new Thread(body, name);
+        thread.setDaemon(true);
+        thread.start();
+    }
+
+    private static void monitorWorker() {
+        while (true) {
+            synchronized (MONITOR) {
+                sleep(5);
+            }
+        }
+    }
+
+    private static void lockWorker() {
+        while (true) {
+            LOCK.lock();
+            try {
+                sleep(5);
+            } finally {
+                LOCK.unlock();
+            }
+        }
+    }
+
+    private static void waiter() {
+        synchronized (WAIT_MONITOR) {
+            while (true) {
+                try {
+                    WAIT_MONITOR.wait();
+                } catch (InterruptedException e) {
+                    return;
+                }
+            }
+        }
+    }
+
+    private static void allocator() {
+        while (true) {
+            List<byte[]> batch = new ArrayList<>();
+            for (int i = 0; i < 1000; i++) {
+                batch.add(new byte[16 * 1024]);
+            }
+            retained = batch;
+            sleep(10);
+        }
+    }
+
+    private static void lockBoth(Object first, Object second) {
+        synchronized (first) {
+            sleep(100);
+            synchronized (second) {
+                sleep(100);
+            }
+        }
+    }
+
+    private static void sleep(long millis) {
+        try {
+            Thread.sleep(millis);
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+        }
+    }
+}
@@ -0,0 +1,35 @@
+#!/bin/bash
+
+# Compile and start LockContentionTarget, run the Java collector against it
+# and print what was collected.
+#
+#   ./harness/run_java_collector.sh [OUTPUT_DIR] [DURATION] [CONNECTION] [-- TARGET_ARGS...]
+
+set -e
+
+HARNESS_DIR=$(cd "$(dirname "$0")" && pwd)
+REPO_DIR=$(dirname "$HARNESS_DIR")
+OUTPUT_DIR=${1:-$(mktemp -d)}
+DURATION=${2:-10}
+CONNECTION=${3:-auto}
+shift $(( $# < 3 ? $# : 3 ))
+[ "$1" = "--" ] && shift
+
+mkdir -p "$OUTPUT_DIR"
+BUILD_DIR=$(mktemp -d)
+javac -d "$BUILD_DIR" "$HARNESS_DIR/LockContentionTarget.java"
+
+java -Xmx256m -Xlog:gc*,safepoint:file="$OUTPUT_DIR/jvm_gc.log":time,uptime,level,tags \
+    -cp "$BUILD_DIR" LockContentionTarget "$@" &
+JAVA_PID=$!
+trap 'kill $JAVA_PID 2>/dev/null; rm -rf "$BUILD_DIR"' EXIT
+
+# Give the target time to start its threads
+sleep 2
+
+cd "$REPO_DIR"
+python3 -m src.java_lock_metrics_collector --pid $JAVA_PID --output-dir "$OUTPUT_DIR" \
+    --interval 0.5 --duration "$DURATION" --connection "$CONNECTION"
+
+echo "Collected into $OUTPUT_DIR:"
+wc -l "$OUTPUT_DIR"/*.csv
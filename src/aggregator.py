@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from src.procfs import raise_open_file_limit
+from src.push import FRAME_HEADER, MAX_FRAME, HELLO, BATCH, ACK, decode_frame, decode_batch
+from src.sinks import newest_timestamp, open_sink
+from src.system_metrics_collector import COLUMNS, BINARY_TYPES
+
+HOST_PREFIX = 'host-'
+
+
+def host_dir_name(host):
+    # Host names become directory names; anything unusual is replaced
+    return HOST_PREFIX + re.sub(r'[^A-Za-z0-9_.-]', '_', host)
+
+
+def check_hello(hello):
+    # The hello is unauthenticated and its metric names become file names:
+    # only the collector's own metrics, with their own layouts, are accepted
+    host = hello['host']
+    if not isinstance(host, str) or not 0 < len(host) <= 200:
+        raise ValueError("bad host name")
+    if not isinstance(hello['columns'], dict) or not isinstance(hello['types'], dict):
+        raise ValueError("bad layout")
+    for metric, columns in hello['columns'].items():
+        if metric not in COLUMNS:
+            raise ValueError(f"unknown metric {metric[:64]!r}")
+        if columns != COLUMNS[metric] or hello['types'].get(metric) != BINARY_TYPES[metric]:
+            raise ValueError(f"unexpected layout of {metric}")
+    return host, list(hello['columns'])
+
+
+# The tables of one host under output_dir/host-<name>/, written with the same
+# sinks and names as a local collector so each partition opens with
+# MetricsAnalyzer. Rows not newer than the last one written for a metric are
+# dropped: a spool segment resent after a broken connection repeats rows the
+# aggregator already has, possibly before it was restarted, so the last
+# timestamp starts from what the table already holds.
+class HostPartition:
+    def __init__(self, output_dir, host, output_config=None):
+        self.host = host
+        self.path = f'{output_dir}/{host_dir_name(host)}'
+        self.output_config = output_config
+        self.sinks = {}
+        self.last = {}
+        self.rows = 0
+        self.duplicates = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def sink(self, metric, columns, types):
+        sink = self.sinks.get(metric)
+        if sink is None:
+            sink = open_sink(f'{self.path}/{metric}_metrics', columns, self.output_config, types)
+            self.sinks[metric] = sink
+            newest = newest_timestamp(sink)
+            if newest is not None:
+                self.last[metric] = max(newest, self.last.get(metric, newest))
+        return sink
+
+    def write(self, metric, columns, types, rows):
+        sink = self.sink(metric, columns, types)
+        last = self.last.get(metric, float('-inf'))
+        for row in rows:
+            if row[0] <= last:
+                self.duplicates += 1
+                continue
+            sink.write(row)
+            last = row[0]
+            self.rows += 1
+        self.last[metric] = last
+
+    def flush(self, durable=False):
+        for sink in self.sinks.values():
+            sink.flush(durable)
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks = {}
+
+
+# Receives the batches PushClients send and writes them into one HostPartition
+# per host. Connections are served by an asyncio loop in its own thread; each
+# frame is decompressed and unpacked with struct.iter_unpack, so the cost per
+# host is a few tens of microseconds per batch however many rows it holds.
+# Partitions are flushed every flush_interval seconds so queries see recent
+# rows, and closed when the aggregator stops.
+class Aggregator:
+    def __init__(self, output_dir, host='127.0.0.1', port=9106, output_config=None):
+        self.output_dir = output_dir
+        self.host = host
+        self.port = port
+        self.output_config = output_config or {}
+        self.flush_interval = self.output_config.get('flush_interval', 5.0)
+        self.partitions = {}
+        self.connections = 0
+        self.frames = 0
+        self.bytes_received = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.error = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), name='aggregator', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error:
+            raise self.error
+        print(f"Aggregating pushed metrics on {self.host}:{self.port} into {self.output_dir}/")
+
+    def _run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port, backlog=4096))
+        except OSError as e:
+            self.error = e
+            ready.set()
+            return
+        if not self.port:
+            self.port = self.server.sockets[0].getsockname()[1]
+        self.loop.call_later(self.flush_interval, self._periodic_flush)
+        ready.set()
+        self.loop.run_forever()
+
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def _periodic_flush(self):
+        self.flush()
+        self.loop.call_later(self.flush_interval, self._periodic_flush)
+
+    def flush(self, durable=False):
+        for partition in list(self.partitions.values()):
+            partition.flush(durable)
+
+    def stop(self):
+        if self.loop and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(10)
+        for partition in self.partitions.values():
+            partition.close()
+        print(f"Received {self.frames} batches from {len(self.partitions)} hosts "
+              f"({sum(p.rows for p in self.partitions.values())} rows)")
+
+    def partition(self, host):
+        partition = self.partitions.get(host)
+        if partition is None:
+            partition = self.partitions[host] = HostPartition(self.output_dir, host, self.output_config)
+        return partition
+
+    async def read_frame(self, reader):
+        length, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes")
+        data = await reader.readexactly(length)
+        self.bytes_received += FRAME_HEADER.size + length
+        return decode_frame(data)
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        self.connections += 1
+        try:
+            kind, payload = await self.read_frame(reader)
+            if kind != HELLO:
+                raise ValueError("expected hello")
+            hello = json.loads(bytes(payload))
+            host, metrics = check_hello(hello)
+            partition = self.partition(host)
+            layouts = [(metric, hello['columns'][metric], hello['types'][metric]) for metric in metrics]
+            records = [struct.Struct('<' + types) for _, _, types in layouts]
+            taken = 0
+            while True:
+                kind, payload = await self.read_frame(reader)
+                if kind != BATCH:
+                    raise ValueError(f"unexpected frame {kind!r}")
+                self.frames += 1
+                for index, rows in decode_batch(payload, records):
+                    metric, columns, types = layouts[index]
+                    partition.write(metric, columns, types, rows)
+                taken += 1
+                writer.write(ACK.pack(taken))
+        except asyncio.IncompleteReadError:
+            # Collector closed the connection
+            pass
+        except (ValueError, KeyError, IndexError, TypeError, struct.error, zlib.error) as e:
+            print(f"Dropping connection from {peer}: bad stream ({e})")
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+
+def host_dirs(data_dir, match=None):
+    # (host, directory) of every host partition, optionally filtered by a regex
+    pattern = re.compile(match) if match else None
+    dirs = []
+    for name in sorted(os.listdir(data_dir)):
+        if name.startswith(HOST_PREFIX) and os.path.isdir(f'{data_dir}/{name}'):
+            host = name[len(HOST_PREFIX):]
+            if pattern is None or pattern.search(host):
+                dirs.append((host, f'{data_dir}/{name}'))
+    return dirs
+
+
+def fleet_frame(data_dir, series_name, start=None, end=None, resolution=1.0, match=None):
+    # One series of every host (named as in SYSTEM_SERIES) on a common time
+    # grid indexed by timestamp, one column per host
+    from src.anomaly import SYSTEM_SERIES
+    from src.correlation import Series, align
+    from src.plot_system_metrices import MetricsAnalyzer
+
+    metric, (_, column, rate, divisor) = next((metric, spec) for metric, specs in SYSTEM_SERIES.items()
+                                              for spec in specs if spec[0] == series_name)
+
+    host_series = []
+    for host, path in host_dirs(data_dir, match):
+        df = MetricsAnalyzer(path).load_range(metric, start, end, [column])
+        if df is None or df.empty:
+            continue
+        values = df[column].to_numpy(dtype=np.float64)
+        if rate:
+            values = np.diff(values, prepend=np.nan) / df['timestamp'].diff().to_numpy()
+        host_series.append(Series(host, host, df['timestamp'], values / divisor))
+    if not host_series:
+        return None
+    return align(host_series, resolution, start=start, end=end).drop(columns='datetime').set_index('timestamp')
+
+
+def fleet_summary(frame):
+    # Per-host statistics of a fleet_frame, highest mean first
+    values = frame.to_numpy(dtype=np.float64)
+    with np.errstate(all='ignore'):
+        summary = pd.DataFrame({
+            'host': frame.columns,
+            'mean': np.nanmean(values, axis=0),
+            'p95': np.nanpercentile(values, 95, axis=0),
+            'max': np.nanmax(values, axis=0),
+            'samples': np.count_nonzero(~np.isnan(values), axis=0)
+        })
+    return summary.sort_values('mean', ascending=False, ignore_index=True)
+
+
+def serve(args, config):
+    # Two descriptors or more per host
+    if (config.get('aggregator') or {}).get('raise_open_files'):
+        raise_open_file_limit()
+    aggregator = Aggregator(args.output_dir, args.host, args.port, config.get('output'))
+    aggregator.start()
+    stopped = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGUSR1, lambda signum, frame: aggregator.loop.call_soon_threadsafe(aggregator.flush, True))
+    print("Press Ctrl+C to stop")
+    deadline = time.monotonic() + args.duration if args.duration > 0 else None
+    while not stopped.wait(1):
+        if deadline and time.monotonic() >= deadline:
+            break
+    aggregator.stop()
+
+
+def query(args):
+    from src.wallclock_profiler import parse_time
+
+    start, end = parse_time(args.start), parse_time(args.end)
+    frame = fleet_frame(args.data_dir, args.series, start, end, args.resolution, args.hosts)
+    if frame is None:
+        print(f"No host has {args.series} in range")
+        return
+    summary = fleet_summary(frame)
+    print(f"{args.series} across {len(summary)} hosts, {len(frame)} steps of {args.resolution:g}s")
+    print(summary.head(args.top).to_string(index=False, float_format=lambda v: f'{v:.2f}'))
+
+    with np.errstate(all='ignore'):
+        values = frame.to_numpy(dtype=np.float64)
+        fleet = pd.DataFrame({'mean': np.nanmean(values, axis=1), 'max': np.nanmax(values, axis=1),
+                              'hosts': np.count_nonzero(~np.isnan(values), axis=1)}, index=frame.index)
+    print(f"Fleet mean {np.nanmean(fleet['mean']):.2f}, busiest step {np.nanmax(fleet['max']):.2f}")
+    if args.output:
+        frame.join(fleet.add_prefix('fleet_')).to_csv(args.output, index_label='timestamp')
+        print(f"Per-host series written to {args.output}")
+
+
+def main():
+    from src.anomaly import SYSTEM_SERIES
+    from src.system_metrics_collector import load_config
+
+    config = load_config()
+    aggregator_config = config.get('aggregator') or {}
+    parser = argparse.ArgumentParser(description='Aggregate metrics pushed by collectors on many hosts')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='Receive pushed batches into per-host partitions')
+    serve_parser.add_argument('--output-dir', default=aggregator_config.get('output_dir', 'fleet_data'))
+    serve_parser.add_argument('--host', default=aggregator_config.get('host', '127.0.0.1'),
+                              help='Address to listen on; 0.0.0.0 for collectors on other hosts')
+    serve_parser.add_argument('--port', type=int, default=aggregator_config.get('port', 9106))
+    serve_parser.add_argument('--duration', type=int, default=0, help='Seconds to run, 0 until interrupted')
+
+    query_parser = commands.add_parser('query', help='Compare one series across hosts')
+    query_parser.add_argument('--data-dir', default=aggregator_config.get('output_dir', 'fleet_data'))
+    query_parser.add_argument('--series', default='cpu.cpu_percent',
+                              choices=[spec[0] for specs in SYSTEM_SERIES.values() for spec in specs])
+    query_parser.add_argument('--hosts', help='Regex over host names')
+    query_parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    query_parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    query_parser.add_argument('--resolution', type=float, default=1.0)
+    query_parser.add_argument('--top', type=int, default=10)
+    query_parser.add_argument('--output', help='CSV of the per-host series and fleet mean/max per step')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args, config)
+    else:
+        query(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import math
+from collections import deque
+
+from src.sinks import open_sink
+
+ALERT_COLUMNS = ['timestamp', 'rule', 'state', 'value', 'threshold', 'metric', 'field', 'aggregate', 'window']
+
+
+# Mean of the values in the last `window` seconds: a running sum over a queue
+class RollingMean:
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+
+    def add(self, timestamp, value):
+        self.values.append((timestamp, value))
+        self.total += value
+        while self.values[0][0] <= timestamp - self.window:
+            self.total -= self.values.popleft()[1]
+
+    def value(self):
+        return self.total / len(self.values)
+
+
+# Max of the last `window` seconds. The queue only holds values that can
+# still become the max (decreasing), so each value is pushed and popped once.
+class RollingMax:
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+
+    def add(self, timestamp, value):
+        while self.values and self.values[-1][1] <= value:
+            self.values.pop()
+        self.values.append((timestamp, value))
+        while self.values[0][0] <= timestamp - self.window:
+            self.values.popleft()
+
+    def value(self):
+        return self.values[0][1]
+
+
+# Change per second between the oldest and newest value of the window
+class RollingRate:
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+
+    def add(self, timestamp, value):
+        self.values.append((timestamp, value))
+        while self.values[0][0] < timestamp - self.window:
+            self.values.popleft()
+
+    def value(self):
+        (first_time, first), (last_time, last) = self.values[0], self.values[-1]
+        if last_time <= first_time:
+            return None
+        return (last - first) / (last_time - first_time)
+
+
+# Quantile of the last `window` seconds from a sketch of log-spaced buckets
+# (each within `accuracy` relative error of the values in it); values <= 0
+# share one bucket. Adding and expiring a value is O(1); a query walks the
+# buckets in use, which are bounded by the range of the values, not by how
+# many there are.
+class RollingQuantile:
+    def __init__(self, window, quantile, accuracy=0.01):
+        self.window = window
+        self.quantile = quantile
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.values = deque()
+        self.counts = {}
+
+    def _bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma) if value > 0 else None
+
+    def add(self, timestamp, value):
+        bucket = self._bucket(value)
+        self.values.append((timestamp, bucket))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        while self.values[0][0] <= timestamp - self.window:
+            bucket = self.values.popleft()[1]
+            self.counts[bucket] -= 1
+            if not self.counts[bucket]:
+                del self.counts[bucket]
+
+    def value(self):
+        rank = self.quantile * (len(self.values) - 1)
+        seen = self.counts.get(None, 0)
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(key for key in self.counts if key is not None):
+            seen += self.counts[bucket]
+            if seen > rank:
+                return 2 * self.gamma ** bucket / (self.gamma + 1)
+        return None
+
+
+def rolling_aggregate(aggregate, window):
+    if aggregate == 'mean':
+        return RollingMean(window)
+    if aggregate == 'max':
+        return RollingMax(window)
+    if aggregate == 'rate':
+        return RollingRate(window)
+    if aggregate.startswith('p'):
+        return RollingQuantile(window, float(aggregate[1:]) / 100)
+    raise ValueError(f"Unknown aggregate: {aggregate}")
+
+
+# One alert condition: `aggregate` of metric.field over the last `window`
+# seconds above `threshold`. Once firing it resolves only when the aggregate
+# is back at or below `clear`, so a value hovering around the threshold does
+# not flap. With `per`, the field is taken as a percentage of that column.
+class Rule:
+    def __init__(self, name, metric, field, threshold, aggregate='mean', window=30, clear=None, per=None):
+        rolling_aggregate(aggregate, window)
+        self.name = name
+        self.metric = metric
+        self.field = field
+        self.threshold = threshold
+        self.aggregate = aggregate
+        self.window = window
+        self.clear = threshold if clear is None else clear
+        self.per = per
+
+
+def build_rules(config):
+    # Rules from the alerts section, each named after the entry of
+    # `thresholds` it checks
+    alert_config = config.get('alerts') or {}
+    if not alert_config.get('enabled', True):
+        return []
+    thresholds = config.get('thresholds') or {}
+    clear_ratio = alert_config.get('clear_ratio', 1.0)
+    rules = []
+    for name, spec in (alert_config.get('rules') or {}).items():
+        if name not in thresholds:
+            print(f"Alert rule {name} has no threshold, skipping it")
+            continue
+        threshold = thresholds[name]
+        rules.append(Rule(name, spec['metric'], spec['field'], threshold, spec.get('aggregate', 'mean'),
+                          spec.get('window', 30), spec.get('clear', threshold * clear_ratio), spec.get('per')))
+    return rules
+
+
+# Evaluates rules against samples as the collector takes them, so a breach is
+# reported at the sample that causes it instead of by re-reading tables later.
+# Each rule keeps its own rolling aggregate (O(1) per sample) and state; an
+# event is written to the alerts table only when a rule starts firing or
+# resolves. Rules on metrics the owner does not collect are ignored.
+class AlertEngine:
+    def __init__(self, rules, columns, output_dir, output_config=None, table='alerts'):
+        self.states = {}
+        for rule in rules:
+            if rule.metric not in columns or rule.field not in columns[rule.metric]:
+                continue
+            metric_columns = columns[rule.metric]
+            self.states.setdefault(rule.metric, []).append({
+                'rule': rule,
+                'index': metric_columns.index(rule.field),
+                'per_index': metric_columns.index(rule.per) if rule.per else None,
+                'rolling': rolling_aggregate(rule.aggregate, rule.window),
+                'firing': False
+            })
+
+        self.sink = None
+        if self.states:
+            # Alerts are rare and wanted right away, write each one through
+            sink_config = dict(output_config or {}, format='csv', flush_rows=1)
+            self.sink = open_sink(f'{output_dir}/{table}', ALERT_COLUMNS, sink_config)
+
+    def observe(self, metric, row):
+        # row is [timestamp] + values in the metric's column order
+        for state in self.states.get(metric, ()):
+            value = row[state['index']]
+            if state['per_index'] is not None:
+                total = row[state['per_index']]
+                if not total:
+                    continue
+                value = value * 100 / total
+            rolling = state['rolling']
+            rolling.add(row[0], value)
+            current = rolling.value()
+            if current is None:
+                continue
+
+            rule = state['rule']
+            if not state['firing'] and current > rule.threshold:
+                state['firing'] = True
+                self.emit(row[0], rule, 'firing', current)
+            elif state['firing'] and current <= rule.clear:
+                state['firing'] = False
+                self.emit(row[0], rule, 'resolved', current)
+
+    def emit(self, timestamp, rule, event, value):
+        print(f"ALERT {rule.name} {event}: {rule.aggregate}({rule.metric}.{rule.field}) over {rule.window}s "
+              f"= {value:.2f} (threshold {rule.threshold})")
+        self.sink.write([timestamp, rule.name, event, round(value, 4), rule.threshold, rule.metric, rule.field,
+                         rule.aggregate, rule.window])
+
+    def firing(self):
+        return [state['rule'].name for states in self.states.values() for state in states if state['firing']]
+
+    def flush(self, durable=False):
+        if self.sink:
+            self.sink.flush(durable)
+
+    def close(self):
+        if self.sink:
+            self.sink.close()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import numpy as np
+
+from src.sinks import open_sink
+
+ANOMALY_COLUMNS = ['timestamp', 'end', 'series', 'kind', 'value', 'baseline', 'score']
+
+# Series derived from the system tables, per table: (name, column, per-second
+# rate of a counter, divisor). Shared by the collector, batch detection and
+# src.correlation so events and rankings use the same names.
+SYSTEM_SERIES = {
+    'cpu': [('cpu.cpu_percent', 'cpu_percent', False, 1), ('cpu.user', 'user', False, 1),
+            ('cpu.system', 'system', False, 1), ('cpu.iowait', 'iowait', False, 1)],
+    'memory': [('memory.used', 'used', False, 1)],
+    'io': [('io.read_mb_s', 'read_bytes', True, 1024 * 1024), ('io.write_mb_s', 'write_bytes', True, 1024 * 1024)],
+    'network': [('network.sent_mb_s', 'bytes_sent', True, 1024 * 1024),
+                ('network.recv_mb_s', 'bytes_recv', True, 1024 * 1024)]
+}
+
+# Per-sample thread state totals and GC time of the intervals with a
+# collection, as the Java collector feeds them to its detector
+JAVA_SERIES = {
+    'threads': [('threads.blocked', 'blocked', False, 1), ('threads.waiting', 'waiting', False, 1),
+                ('threads.timed_waiting', 'timed_waiting', False, 1)],
+    'gc': [('gc.time_ms', 'duration_ms', False, 1)]
+}
+JAVA_SERIES_COLUMNS = {
+    'threads': ['timestamp', 'blocked', 'waiting', 'timed_waiting'],
+    'gc': ['timestamp', 'duration_ms']
+}
+
+# Smallest deviation worth scoring, in the series' unit. Many series sit at 0
+# or barely move (idle CPU, flat memory, no blocked threads), so their spread
+# would shrink towards nothing and the first change of one unit would score in
+# the millions. Series of other JVMs ('pid-N:' prefix) use the same floors.
+NOISE_FLOORS = {
+    'cpu.cpu_percent': 1.0, 'cpu.user': 1.0, 'cpu.system': 1.0, 'cpu.iowait': 1.0,
+    'memory.used': 64 * 1024 * 1024,
+    'io.read_mb_s': 0.1, 'io.write_mb_s': 0.1, 'network.sent_mb_s': 0.1, 'network.recv_mb_s': 0.1,
+    'threads.blocked': 1.0, 'threads.waiting': 1.0, 'threads.timed_waiting': 1.0, 'locks.waiters': 1.0,
+    'gc.time_ms': 5.0, 'gc.pause_ms': 5.0, 'gc.ttsp_ms': 1.0, 'safepoint.ms': 1.0, 'jfr.lock_wait_ms': 1.0
+}
+
+
+def anomaly_params(config):
+    # SeriesDetector keyword arguments from the anomalies section, None when
+    # detection is off
+    anomaly_config = dict(config.get('anomalies') or {})
+    if not anomaly_config.pop('enabled', True):
+        return None
+    return anomaly_config
+
+
+
+# Anomalies and level shifts in one series, with a few numbers of state.
+#
+# The baseline is an exponentially weighted mean and variance (alpha per
+# sample, plain running averages for the first `warmup` samples) giving a
+# z-score per sample, against a standard deviation of at least `floor`.
+# Samples more than `threshold` deviations away are anomalous, consecutive ones
+# forming one 'anomaly' event. Once warm, a sample moves the mean at most as
+# far as one `cap` deviations away would, so neither a spike nor the start of
+# a level shift drags it along, and the variance at most as far as one at the
+# threshold, so a series with regular bursts learns how large they get.
+#
+# A two-sided CUSUM over the z-scores (also capped at `cap`, minus `drift`
+# per sample) accumulates smaller but sustained deviations; crossing `limit`
+# emits a 'change' event from where the excursion began, and the baseline
+# jumps to the mean of the excursion. An anomaly that the change explains is
+# dropped. Nothing is flagged during the warmup.
+class SeriesDetector:
+    def __init__(self, name, alpha=0.01, threshold=6.0, drift=0.5, cap=3.0, limit=30.0, warmup=60, floor=None):
+        self.name = name
+        self.floor = NOISE_FLOORS.get(name.rsplit(':', 1)[-1], 0.0) if floor is None else floor
+        self.alpha = alpha
+        self.threshold = threshold
+        self.drift = drift
+        self.cap = cap
+        self.limit = limit
+        self.warmup = warmup
+
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        # CUSUM statistics, and start time, sum and length of their excursions
+        self.upper = 0.0
+        self.lower = 0.0
+        self.upper_start = self.lower_start = None
+        self.upper_sum = self.lower_sum = 0.0
+        self.upper_count = self.lower_count = 0
+        # The anomaly in progress
+        self.open_start = None
+        self.open_end = None
+        self.peak_value = None
+        self.peak_score = 0.0
+        self.open_baseline = None
+
+    def scale(self, mean, variance):
+        # Standard deviation, floored so flat series do not divide by 0
+        return np.maximum(np.sqrt(variance), self.floor + 1e-6 * np.abs(mean) + 1e-12)
+
+    def update(self, timestamp, value):
+        # Returns the events finished by this sample, as ANOMALY_COLUMNS rows
+        events = []
+        warm = self.count >= self.warmup
+        residual = value - self.mean
+        scale = float(self.scale(self.mean, self.variance))
+        z = residual / scale
+
+        if warm and abs(z) > self.threshold:
+            if self.open_start is None:
+                self.open_start = timestamp
+                self.open_baseline = self.mean
+                self.peak_score = 0.0
+            self.open_end = timestamp
+            if abs(z) > abs(self.peak_score):
+                self.peak_score = z
+                self.peak_value = value
+        elif self.open_start is not None:
+            events.append(self.close_anomaly())
+        rate = max(self.alpha, 1 / (self.count + 1))
+        if warm:
+            spread = min(abs(residual), self.threshold * scale)
+            residual = min(max(residual, -self.cap * scale), self.cap * scale)
+        else:
+            spread = abs(residual)
+        self.mean += rate * residual
+        self.variance += rate * (spread * spread - self.variance)
+        self.count += 1
+
+        if warm:
+            if self.upper == 0:
+                self.upper_start, self.upper_sum, self.upper_count = timestamp, 0.0, 0
+            if self.lower == 0:
+                self.lower_start, self.lower_sum, self.lower_count = timestamp, 0.0, 0
+            capped = min(max(z, -self.cap), self.cap)
+            self.upper = max(self.upper + capped - self.drift, 0.0)
+            self.lower = max(self.lower - capped - self.drift, 0.0)
+            self.upper_sum += value
+            self.upper_count += 1
+            self.lower_sum += value
+            self.lower_count += 1
+            if self.upper > self.limit or self.lower > self.limit:
+                events.append(self.change(timestamp))
+        return events
+
+    def change(self, timestamp):
+        if self.upper > self.limit:
+            start, level, score = self.upper_start, self.upper_sum / self.upper_count, self.upper
+        else:
+            start, level, score = self.lower_start, self.lower_sum / self.lower_count, -self.lower
+        event = [start, timestamp, self.name, 'change', level, self.mean, round(score, 2)]
+        if self.open_start is not None and self.open_start >= start:
+            self.open_start = None
+        self.mean = level
+        self.upper = self.lower = 0.0
+        return event
+
+    def close_anomaly(self):
+        event = [self.open_start, self.open_end, self.name, 'anomaly', self.peak_value, self.open_baseline,
+                 round(self.peak_score, 2)]
+        self.open_start = None
+        return event
+
+    def close(self):
+        return [self.close_anomaly()] if self.open_start is not None else []
+
+
+def _cusum(start, steps):
+    # Lindley recursion S = max(0, S + step) over an array, closed form
+    totals = start + np.cumsum(steps)
+    return totals - np.minimum(np.minimum.accumulate(totals), 0)
+
+
+def _ewma_before(initial, inputs, alpha, weights, powers):
+    # EWMA value before each input (and after the last), for a fixed alpha
+    sums = np.concatenate(([0.0], np.cumsum(inputs * weights)))
+    return powers * (initial + alpha * sums)
+
+
+# Batch equivalent of SeriesDetector.update over a whole series. Runs of
+# samples within `cap` deviations that are not a change point follow linear
+# recursions, so they are computed in closed form a block at a time (cumulative
+# sums for the EWMAs, running minimum for the CUSUM); the first exceptional
+# sample of a block goes through update() and the next block starts after it.
+# Blocks shrink after an exception and grow back while the series is quiet.
+def detect_series(detector, timestamps, values, max_block=4096):
+    keep = ~np.isnan(values)
+    timestamps, values = timestamps[keep], values[keep]
+    n = len(values)
+    events = []
+    position = 0
+    # Step by step until the baseline rate has settled to alpha
+    while position < n and (detector.count < detector.warmup or detector.count + 1 < 1 / detector.alpha):
+        events += detector.update(timestamps[position], values[position])
+        position += 1
+
+    q = 1 - detector.alpha
+    # Keep q ** -block representable
+    max_block = max(min(max_block, int(300 / -np.log(q))), 1)
+    block = 64
+    while position < n:
+        length = min(block, n - position)
+        x = values[position:position + length]
+        steps = np.arange(length + 1)
+        powers = q ** steps
+        weights = q ** -(steps[1:])
+
+        mean = _ewma_before(detector.mean, x, detector.alpha, weights, powers)
+        residual = x - mean[:-1]
+        variance = _ewma_before(detector.variance, residual * residual, detector.alpha, weights, powers)
+        z = residual / detector.scale(mean[:-1], variance[:-1])
+        capped = np.clip(z, -detector.cap, detector.cap)
+        upper = _cusum(detector.upper, capped - detector.drift)
+        lower = _cusum(detector.lower, -capped - detector.drift)
+
+        exceptional = (np.abs(z) > detector.cap) | (upper > detector.limit) | (lower > detector.limit)
+        hits = np.flatnonzero(exceptional)
+        accepted = hits[0] if len(hits) else length
+
+        if accepted:
+            if detector.open_start is not None:
+                events.append(detector.close_anomaly())
+            ts = timestamps[position:position + accepted]
+            for side in ('upper', 'lower'):
+                stat = upper if side == 'upper' else lower
+                before = np.concatenate(([getattr(detector, side)], stat[:accepted - 1]))
+                restarts = np.flatnonzero(before == 0)
+                if len(restarts):
+                    # Excursion restarted inside the block, at its last zero
+                    first = restarts[-1]
+                    setattr(detector, f'{side}_start', ts[first])
+                    setattr(detector, f'{side}_sum', float(x[first:accepted].sum()))
+                    setattr(detector, f'{side}_count', int(accepted - first))
+                else:
+                    setattr(detector, f'{side}_sum', getattr(detector, f'{side}_sum') + float(x[:accepted].sum()))
+                    setattr(detector, f'{side}_count', getattr(detector, f'{side}_count') + int(accepted))
+                setattr(detector, side, float(stat[accepted - 1]))
+            detector.mean = float(mean[accepted])
+            detector.variance = float(variance[accepted])
+            detector.count += int(accepted)
+            position += int(accepted)
+
+        if accepted < length:
+            events += detector.update(timestamps[position], values[position])
+            position += 1
+            block = 64
+        else:
+            block = min(block * 2, max_block)
+    return events + detector.close()
+
+
+# Runs a SeriesDetector per series inside a collector: observe() takes the
+# rows the collector writes, turns counters into per-second rates and writes
+# finished events to the anomalies table.
+class AnomalyMonitor:
+    def __init__(self, series, columns, output_dir, output_config=None, table='anomalies', params=None):
+        self.series = {}
+        self.detectors = {}
+        self.previous = {}
+        for metric, specs in series.items():
+            if metric not in columns:
+                continue
+            self.series[metric] = [(columns[metric].index(column), rate, divisor)
+                                   for _, column, rate, divisor in specs]
+            self.detectors[metric] = [SeriesDetector(name, **(params or {})) for name, _, _, _ in specs]
+        sink_config = dict(output_config or {}, format='csv', flush_rows=1)
+        self.sink = open_sink(f'{output_dir}/{table}', ANOMALY_COLUMNS, sink_config) if self.detectors else None
+
+    def observe(self, metric, row):
+        if metric not in self.detectors:
+            return
+        previous = self.previous.get(metric)
+        self.previous[metric] = row
+        for detector, (index, rate, divisor) in zip(self.detectors[metric], self.series[metric]):
+            if not rate:
+                value = row[index] / divisor
+            elif previous is not None and row[0] > previous[0]:
+                value = (row[index] - previous[index]) / (row[0] - previous[0]) / divisor
+            else:
+                continue
+            self.write(detector.update(row[0], value))
+
+    def write(self, events):
+        for event in events:
+            print(f"Anomaly: {event[2]} {event[3]} at {time.strftime('%H:%M:%S', time.localtime(event[0]))}, "
+                  f"{event[4]:.4g} vs baseline {event[5]:.4g} (score {event[6]})")
+            self.sink.write(event)
+
+    def flush(self, durable=False):
+        if self.sink:
+            self.sink.flush(durable)
+
+    def close(self):
+        for detectors in self.detectors.values():
+            for detector in detectors:
+                self.write(detector.close())
+        if self.sink:
+            self.sink.close()
+
+
+def detect_all(series, params=None):
+    # Batch detection over src.correlation Series; event series (GC pauses,
+    # lock waits) are judged by the events, not the zeros in between
+    events = []
+    for s in series:
+        keep = s.values != 0 if s.events else slice(None)
+        events += detect_series(SeriesDetector(s.name, **(params or {})), s.timestamps[keep], s.values[keep])
+    return events
+
+
+def main():
+    from src.correlation import load_all_series
+    from src.system_metrics_collector import load_config
+    from src.wallclock_profiler import parse_time
+
+    parser = argparse.ArgumentParser(description='Find anomalies and level shifts in collected series')
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    parser.add_argument('--threshold', type=float, help='Robust z-score of an anomaly (default: anomalies.threshold)')
+    parser.add_argument('--limit', type=float, help='CUSUM level of a change (default: anomalies.limit)')
+    parser.add_argument('--output', help='Events CSV, replaced (default: <data-dir>/anomalies_batch.csv; '
+                                         'anomalies.csv belongs to a running collector)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    series = load_all_series(args.data_dir, parse_time(args.start), parse_time(args.end))
+    if not series:
+        print("No series found")
+        return
+    loaded = time.perf_counter()
+    # Tuned like the collectors' online detectors, so both find the same events
+    params = anomaly_params(load_config()) or {}
+    for name in ('threshold', 'limit'):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    events = detect_all(series, params)
+    events.sort(key=lambda event: event[0])
+
+    output = args.output or f'{args.data_dir}/anomalies_batch.csv'
+    path_base = output[:-len('.csv')] if output.endswith('.csv') else output
+    with open(f'{path_base}.csv', 'w'):
+        pass
+    sink = open_sink(path_base, ANOMALY_COLUMNS)
+    for event in events:
+        sink.write(event)
+    sink.close()
+    print(f"{len(events)} events in {len(series)} series, {sum(len(s.values) for s in series)} samples "
+          f"(load {loaded - started:.1f}s, detect {time.perf_counter() - loaded:.1f}s), saved as {path_base}.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 #!/bin/bash
 
 PID=$1
-OUTPUT_DIR=$2
 DURATION=$3
 
+# Absolute, so it still points at the same place after the cd below
+OUTPUT_DIR=$(cd "$2" && pwd) || exit 1
+
 # Check if async-profiler is available
 ASYNC_PROFILER_HOME=${ASYNC_PROFILER_HOME:-"/opt/async-profiler"}
 
@@ -13,13 +15,16 @@ if [ ! -d "$ASYNC_PROFILER_HOME" ]; then
 fi
 
 # Start profiling
-$ASYNC_PROFILER_HOME/profiler.sh start -e lock -i 1ms -f $OUTPUT_DIR/lock_profile.jfr $PID
+"$ASYNC_PROFILER_HOME/profiler.sh" start -e lock -i 1ms -f "$OUTPUT_DIR/lock_profile.jfr" "$PID"
 
 # Wait for specified duration
-sleep $DURATION
+sleep "$DURATION"
 
 # Stop profiling
-$ASYNC_PROFILER_HOME/profiler.sh stop $PID
+"$ASYNC_PROFILER_HOME/profiler.sh" stop "$PID"
 
 # Convert JFR to JSON for analysis
-$ASYNC_PROFILER_HOME/converters/jfr2flame.sh $OUTPUT_DIR/lock_profile.jfr
+"$ASYNC_PROFILER_HOME/converters/jfr2flame.sh" "$OUTPUT_DIR/lock_profile.jfr"
+
+# Lock wait times, owners and stacks in the collector's lock schema
+(cd "$(dirname "$0")/.." && python3 -m src.jfr_reader --jfr "$OUTPUT_DIR/lock_profile.jfr" --data-dir "$OUTPUT_DIR")
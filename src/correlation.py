@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from src.plot_system_metrices import MetricsAnalyzer, plot_downsampled
+from src.java_lock_metrics_collector import FILE_NAMES, COLUMNS as JAVA_COLUMNS, BINARY_TYPES as JAVA_BINARY_TYPES
+from src.jfr_reader import JFR_LOCK_COLUMNS
+from src.stack_table import load_names
+from src.table_loader import table_dtypes
+from src.wallclock_profiler import parse_time
+from src.anomaly import SYSTEM_SERIES
+
+RANKING_COLUMNS = ['series_a', 'series_b', 'lag_seconds', 'correlation', 'correlation_at_0', 'consistency',
+                   'samples']
+# Rolling correlations at least this strong (with the overall sign) count as consistent
+CONSISTENT_CORRELATION = 0.5
+
+
+# A series on its own timestamps. Gauges (levels sampled at an instant) are
+# aligned to the grid with an as-of join; events (amounts that happened at an
+# instant, such as a GC pause) are summed into the grid step they fall in.
+class Series:
+    def __init__(self, name, group, timestamps, values, events=False):
+        self.name = name
+        self.group = group
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.events = events
+
+
+def system_series(analyzer, start=None, end=None):
+    # The series the anomaly detector watches, named the same way
+    series = []
+    for metric, specs in SYSTEM_SERIES.items():
+        df = analyzer.load_range(metric, start, end, [column for _, column, _, _ in specs])
+        if df is None:
+            continue
+        for name, column, rate, divisor in specs:
+            values = df[column].to_numpy(dtype=np.float64)
+            if rate:
+                values = np.diff(values, prepend=np.nan) / df['timestamp'].diff().to_numpy()
+            series.append(Series(name, metric, df['timestamp'], values / divisor))
+    return series
+
+
+def _per_sample(timestamps, weights):
+    # Sum of weights per distinct timestamp (one collector sample)
+    codes, samples = pd.factorize(timestamps, sort=True)
+    return samples, np.bincount(codes, weights=weights, minlength=len(samples))
+
+
+def java_series(analyzer, prefix='', start=None, end=None):
+    # Series of one JVM's tables; prefix tells JVMs apart (e.g. 'pid-1234:')
+    series = []
+    data_dir = analyzer.data_dir
+    threads = analyzer.load_table(FILE_NAMES['threads'], start, end, ['state_id'],
+                                  table_dtypes(JAVA_COLUMNS['threads'], JAVA_BINARY_TYPES['threads']))
+    samples = None
+    if threads is not None and len(threads) and os.path.exists(f'{data_dir}/java_states.csv'):
+        states = load_names(data_dir, 'java_states')
+        timestamps = threads['timestamp'].to_numpy()
+        state_ids = threads['state_id'].to_numpy()
+        for state, label in [('BLOCKED', 'blocked'), ('WAITING', 'waiting'), ('TIMED_WAITING', 'timed_waiting')]:
+            ids = [i for i, name in states.items() if name == state]
+            samples, counts = _per_sample(timestamps, np.isin(state_ids, ids))
+            series.append(Series(f'{prefix}threads.{label}', f'{prefix}threads', samples, counts))
+
+    summary = analyzer.load_table(FILE_NAMES['lock_summary'], start, end, ['waiters'],
+                                  table_dtypes(JAVA_COLUMNS['lock_summary'], JAVA_BINARY_TYPES['lock_summary']))
+    if summary is not None and len(summary):
+        waiter_times, waiters = _per_sample(summary['timestamp'].to_numpy(), summary['waiters'].to_numpy())
+        if samples is not None:
+            # Samples without a contended lock have no summary rows: zero, not "unchanged"
+            waiters = pd.Series(waiters, index=waiter_times).reindex(samples, fill_value=0).to_numpy()
+            waiter_times = samples
+        series.append(Series(f'{prefix}locks.waiters', f'{prefix}locks', waiter_times, waiters))
+
+    gc = analyzer.load_table(FILE_NAMES['gc'], start, end, ['gc_type', 'duration_ms'])
+    if gc is not None and len(gc):
+        gc = gc[gc['gc_type'] == 'All']
+        series.append(Series(f'{prefix}gc.time_ms', f'{prefix}gc', gc['timestamp'], gc['duration_ms'], events=True))
+
+    pauses = analyzer.load_table(FILE_NAMES['gc_pauses'], start, end, ['duration_ms', 'time_to_safepoint_ms'])
+    if pauses is not None and len(pauses):
+        series.append(Series(f'{prefix}gc.pause_ms', f'{prefix}gc_pauses', pauses['timestamp'],
+                             pauses['duration_ms'], events=True))
+        series.append(Series(f'{prefix}gc.ttsp_ms', f'{prefix}gc_pauses', pauses['timestamp'],
+                             pauses['time_to_safepoint_ms'].fillna(0), events=True))
+
+    safepoints = analyzer.load_table(FILE_NAMES['safepoint'], start, end, ['duration_ms'])
+    if safepoints is not None and len(safepoints):
+        series.append(Series(f'{prefix}safepoint.ms', f'{prefix}safepoint', safepoints['timestamp'],
+                             safepoints['duration_ms'], events=True))
+
+    lock_waits = analyzer.load_table('jfr_lock_waits', start, end, ['wait_time'],
+                                     table_dtypes(JFR_LOCK_COLUMNS, 'diidii'))
+    if lock_waits is not None and len(lock_waits):
+        series.append(Series(f'{prefix}jfr.lock_wait_ms', f'{prefix}jfr', lock_waits['timestamp'],
+                             lock_waits['wait_time'], events=True))
+    return series
+
+
+def jvm_dirs(data_dir):
+    # (prefix, directory) of every JVM: the data directory itself when a
+    # single collector wrote there, plus the pid-<pid>/ directories of java_fanout
+    dirs = []
+    if any(name.startswith(('java_threads', 'gc_metrics', 'jfr_lock_waits')) for name in os.listdir(data_dir)):
+        dirs.append(('', data_dir))
+    for name in sorted(os.listdir(data_dir)):
+        if name.startswith('pid-') and os.path.isdir(f'{data_dir}/{name}'):
+            dirs.append((f'{name}:', f'{data_dir}/{name}'))
+    return dirs
+
+
+def align(series, resolution=1.0, tolerance=None, start=None, end=None):
+    # One row per grid step of `resolution` seconds, one column per series.
+    # A gauge takes the sample nearest to the step (collectors sample at
+    # different phases, taking the last one before would shift some series
+    # by a step) if within tolerance (default 3 steps), else NaN.
+    tolerance = tolerance if tolerance is not None else 3 * resolution
+    if start is None:
+        start = min(s.timestamps[0] for s in series if len(s.timestamps))
+    if end is None:
+        end = max(s.timestamps[-1] for s in series if len(s.timestamps)) + resolution
+    start = np.floor(start / resolution) * resolution
+    grid = pd.DataFrame({'timestamp': np.arange(start, end, resolution)})
+
+    columns = {}
+    for s in series:
+        keep = ~np.isnan(s.values)
+        timestamps, values = s.timestamps[keep], s.values[keep]
+        if s.events:
+            steps = ((timestamps - start) // resolution).astype(np.int64)
+            inside = (steps >= 0) & (steps < len(grid))
+            columns[s.name] = np.bincount(steps[inside], weights=values[inside], minlength=len(grid))
+        else:
+            order = np.argsort(timestamps, kind='stable')
+            right = pd.DataFrame({'timestamp': timestamps[order], s.name: values[order]})
+            joined = pd.merge_asof(grid, right, on='timestamp', direction='nearest', tolerance=tolerance)
+            columns[s.name] = joined[s.name].to_numpy()
+    frame = pd.concat([grid, pd.DataFrame(columns)], axis=1)
+    frame['datetime'] = (frame['timestamp'].to_numpy() * 1e9).astype('int64').astype('datetime64[ns]')
+    return frame
+
+
+def lagged_correlations(values, max_lag):
+    # values: (steps, k) with NaN gaps. Returns C with C[lag, i, j] the
+    # correlation of column i at t with column j at t + lag, for lag in
+    # 0..max_lag (negative lags are C[lag, j, i]), and the number of steps
+    # both columns had a value. Columns are standardized once and gaps count
+    # as the mean, so every lag is one (k, steps) @ (steps, k) product.
+    present = ~np.isnan(values)
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    std[std == 0] = np.nan
+    z = np.where(present, (values - mean) / std, 0.0)
+    mask = present.astype(np.float64)
+
+    steps, k = values.shape
+    correlations = np.empty((max_lag + 1, k, k))
+    counts = np.empty((max_lag + 1, k, k))
+    for lag in range(max_lag + 1):
+        counts[lag] = mask[:steps - lag].T @ mask[lag:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlations[lag] = (z[:steps - lag].T @ z[lag:]) / counts[lag]
+    return correlations, counts
+
+
+def rank_pairs(frame, series, max_lag=60, resolution=1.0, window=300, top=20, min_samples=30):
+    # Pairs of series from different tables, strongest lagged correlation
+    # first. lag_seconds > 0 means series_a leads series_b. For the top pairs
+    # the rolling correlation over `window` seconds at that lag says how much
+    # of the time the relationship holds (consistency).
+    names = [s.name for s in series]
+    groups = np.array([s.group for s in series])
+    lag_steps = max(int(round(max_lag / resolution)), 0)
+    correlations, counts = lagged_correlations(frame[names].to_numpy(dtype=np.float64), lag_steps)
+
+    # Both directions side by side: index l < L+1 is a leading b by l steps,
+    # L+1+l is b leading a by l steps
+    both = np.concatenate([correlations, correlations.transpose(0, 2, 1)])
+    both_counts = np.concatenate([counts, counts.transpose(0, 2, 1)])
+    both[both_counts < min_samples] = np.nan
+
+    i, j = np.triu_indices(len(names), 1)
+    pairs = groups[i] != groups[j]
+    i, j = i[pairs], j[pairs]
+    scores = np.abs(both[:, i, j])
+    valid = ~np.isnan(scores).all(axis=0)
+    i, j, scores = i[valid], j[valid], scores[:, valid]
+    best = np.nanargmax(scores, axis=0)
+    best_correlation = both[best, i, j]
+    lags = np.where(best <= lag_steps, best, -(best - lag_steps - 1)) * resolution
+
+    ranking = pd.DataFrame({
+        'series_a': np.array(names)[i],
+        'series_b': np.array(names)[j],
+        'lag_seconds': lags,
+        'correlation': best_correlation,
+        'correlation_at_0': correlations[0, i, j],
+        'consistency': np.nan,
+        'samples': both_counts[best, i, j].astype(np.int64)
+    })
+    ranking = ranking.iloc[np.argsort(-np.abs(best_correlation), kind='stable')[:top]]
+    ranking = ranking.reset_index(drop=True)
+
+    window_steps = max(int(round(window / resolution)), 2)
+    rolling = {}
+    for row in ranking.itertuples():
+        r = rolling_correlation(frame, row.series_a, row.series_b, row.lag_seconds, resolution, window_steps)
+        rolling[f'{row.series_a} ~ {row.series_b}'] = r
+        strong = np.sign(r) == np.sign(row.correlation)
+        strong &= np.abs(r) >= CONSISTENT_CORRELATION
+        defined = ~np.isnan(r)
+        ranking.loc[row.Index, 'consistency'] = strong[defined].mean() if defined.any() else np.nan
+    return ranking[RANKING_COLUMNS], rolling
+
+
+def rolling_correlation(frame, a, b, lag_seconds, resolution, window_steps):
+    # Correlation of a at t with b at t + lag over a trailing window
+    shift = int(round(lag_seconds / resolution))
+    return frame[a].rolling(window_steps, min_periods=window_steps // 2).corr(
+        frame[b].shift(-shift)).to_numpy()
+
+
+def load_all_series(data_dir, start=None, end=None):
+    series = system_series(MetricsAnalyzer(data_dir), start, end)
+    for prefix, jvm_dir in jvm_dirs(data_dir):
+        series += java_series(MetricsAnalyzer(jvm_dir), prefix, start, end)
+    return [s for s in series if len(s.timestamps)]
+
+
+def plot_rolling(frame, ranking, rolling, output, count=5):
+    fig, axes = plt.subplots(min(count, len(ranking)), 1, figsize=(15, 4 * min(count, len(ranking))),
+                             squeeze=False)
+    for ax, row in zip(axes[:, 0], ranking.itertuples()):
+        name = f'{row.series_a} ~ {row.series_b}'
+        data = pd.DataFrame({'timestamp': frame['timestamp'], 'datetime': frame['datetime'],
+                             'correlation': rolling[name]})
+        plot_downsampled(ax, data, 'correlation', 'rolling correlation', max(int(ax.get_window_extent().width), 100))
+        ax.axhline(0, color='grey', linewidth=0.5)
+        ax.set_ylim(-1, 1)
+        ax.set_title(f'{name} (lag {row.lag_seconds:g}s, r={row.correlation:.2f})')
+    plt.tight_layout()
+    fig.savefig(output)
+    print(f"Plot saved as {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Correlate system metrics with Java lock, thread and GC data')
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    parser.add_argument('--resolution', type=float, default=1.0, help='Grid step in seconds')
+    parser.add_argument('--tolerance', type=float, help='Oldest sample (seconds) a grid step may take a gauge from')
+    parser.add_argument('--max-lag', type=float, default=60, help='Largest lead/lag tried, in seconds')
+    parser.add_argument('--window', type=float, default=300, help='Rolling correlation window in seconds')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help='Ranking CSV (default: <data-dir>/correlations.csv)')
+    parser.add_argument('--plot', help='PNG of the rolling correlation of the top pairs')
+    args = parser.parse_args()
+
+    start, end = parse_time(args.start), parse_time(args.end)
+    series = load_all_series(args.data_dir, start, end)
+    if len(series) < 2:
+        print("Not enough series to correlate")
+        return
+    frame = align(series, args.resolution, args.tolerance, start, end)
+    ranking, rolling = rank_pairs(frame, series, args.max_lag, args.resolution, args.window, args.top)
+
+    output = args.output or f'{args.data_dir}/correlations.csv'
+    ranking.to_csv(output, index=False)
+    print(f"{len(series)} series over {len(frame)} steps of {args.resolution:g}s")
+    if len(ranking):
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(ranking.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    else:
+        print("No pairs of series from different tables overlap enough to correlate")
+    print(f"Ranking saved as {output}")
+    if args.plot and len(ranking):
+        plot_rolling(frame, ranking, rolling, args.plot)
+
+
+if __name__ == "__main__":
+    main()
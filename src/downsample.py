@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import os
+import shutil
+
+import numpy as np
+
+from src.sinks import open_sink
+
+# Rollup tiers in seconds, finest first
+ROLLUP_TIERS = [60, 600, 3600]
+ROLLUP_STATS = ['min', 'max', 'sum', 'last']
+
+
+def rollup_columns(fields):
+    return ['timestamp', 'count'] + [f'{field}_{stat}' for stat in ROLLUP_STATS for field in fields]
+
+
+def rollup_types(fields):
+    return 'dq' + 'd' * (len(ROLLUP_STATS) * len(fields))
+
+
+def rollup_name(metric, tier):
+    return f'{metric}_rollup_{tier}s'
+
+
+def _bucket_bounds(n, n_buckets):
+    # Start index of each of n_buckets near-equal buckets over n points
+    return np.linspace(0, n, n_buckets + 1).astype(np.int64)
+
+
+# Largest-Triangle-Three-Buckets (Steinarsson 2013): keeps the first and last
+# point and, from each bucket in between, the point forming the largest
+# triangle with the previously kept point and the next bucket's mean. Each
+# bucket is one vectorized step, so the Python loop runs n_out times no matter
+# how many points go in.
+def lttb(x, y, n_out):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keep = ~np.isnan(y)
+    if not keep.all():
+        x, y = x[keep], y[keep]
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if keep.all() else np.flatnonzero(keep)
+
+    bounds = _bucket_bounds(n - 2, n_out - 2) + 1
+    # Mean of every bucket, used as the third triangle vertex
+    sums_x = np.add.reduceat(x[1:-1], bounds[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:-1], bounds[:-1] - 1)
+    sizes = np.diff(bounds)
+    mean_x = np.append(sums_x / sizes, x[-1])
+    mean_y = np.append(sums_y / sizes, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        ax, ay = x[a], y[a]
+        areas = np.abs((ax - mean_x[i + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[i + 1] - ay))
+        a = lo + int(areas.argmax())
+        selected[i + 1] = a
+
+    return selected if keep.all() else np.flatnonzero(keep)[selected]
+
+
+# Min/max per bucket: the envelope of everything in the series, so a one
+# sample spike survives any amount of reduction. Returns the bucket start x
+# and the bucket's min and max.
+def minmax_envelope(x, y, n_buckets, y_max=None):
+    x = np.asarray(x)
+    y_min = np.asarray(y, dtype=np.float64)
+    y_max = y_min if y_max is None else np.asarray(y_max, dtype=np.float64)
+    n = len(y_min)
+    if n <= n_buckets:
+        return x, y_min, y_max
+
+    starts = np.arange(0, n, math.ceil(n / n_buckets))
+    # fmin/fmax skip NaNs, e.g. the first row of a rate
+    return x[starts], np.fmin.reduceat(y_min, starts), np.fmax.reduceat(y_max, starts)
+
+
+# Aggregates for one time bucket of one tier. Raw samples and closed buckets
+# of the finer tier are both folded in as (count, min, max, sum, last).
+class _Bucket:
+    def __init__(self, start, count, mins, maxs, sums, lasts):
+        self.start = start
+        self.count = count
+        self.mins = list(mins)
+        self.maxs = list(maxs)
+        self.sums = list(sums)
+        self.lasts = list(lasts)
+
+    def add(self, count, mins, maxs, sums, lasts):
+        self.count += count
+        self.mins = [m if m <= v else v for m, v in zip(self.mins, mins)]
+        self.maxs = [m if m >= v else v for m, v in zip(self.maxs, maxs)]
+        self.sums = [s + v for s, v in zip(self.sums, sums)]
+        self.lasts = list(lasts)
+
+    def row(self):
+        return [self.start, self.count] + self.mins + self.maxs + self.sums + self.lasts
+
+
+# Maintains the rollup tiers of one table while it is being written: every
+# sample goes into the current 1 min bucket, and when a bucket closes its
+# aggregates are written and folded into the next tier's bucket. Cost per
+# sample is independent of how much history exists. Partial buckets are
+# written on close; readers merge rows that share a bucket.
+class RollupWriter:
+    def __init__(self, path_base, fields, tiers=None, output_config=None):
+        self.fields = list(fields)
+        self.tiers = sorted(tiers or ROLLUP_TIERS)
+        self.buckets = [None] * len(self.tiers)
+        self.sinks = [open_sink(f'{path_base}_rollup_{tier}s', rollup_columns(self.fields), output_config,
+                                rollup_types(self.fields), datetime_column=False)
+                      for tier in self.tiers]
+
+    def add(self, row):
+        # row is [timestamp] + one value per field
+        values = [float(v) for v in row[1:]]
+        self._add(0, row[0], 1, values, values, values, values)
+
+    def _add(self, level, timestamp, count, mins, maxs, sums, lasts):
+        tier = self.tiers[level]
+        start = timestamp // tier * tier
+        bucket = self.buckets[level]
+        if bucket is not None and bucket.start != start:
+            self._close(level)
+            bucket = None
+        if bucket is None:
+            self.buckets[level] = _Bucket(start, count, mins, maxs, sums, lasts)
+        else:
+            bucket.add(count, mins, maxs, sums, lasts)
+
+    def _close(self, level):
+        bucket = self.buckets[level]
+        self.buckets[level] = None
+        self.sinks[level].write(bucket.row())
+        if level + 1 < len(self.tiers):
+            self._add(level + 1, bucket.start, bucket.count, bucket.mins, bucket.maxs, bucket.sums, bucket.lasts)
+
+    @property
+    def bytes_written(self):
+        return sum(sink.bytes_written for sink in self.sinks)
+
+    def flush(self, durable=False):
+        for sink in self.sinks:
+            sink.flush(durable)
+
+    def close(self):
+        for level in range(len(self.tiers)):
+            if self.buckets[level] is not None:
+                self._close(level)
+        for sink in self.sinks:
+            sink.close()
+
+
+def rollup_frame(df, fields, tier):
+    # Batch equivalent of RollupWriter for one tier, from raw rows. pandas is
+    # imported here: the collector imports this module for RollupWriter only.
+    import pandas as pd
+
+    buckets = (df['timestamp'] // tier * tier).rename('timestamp')
+    grouped = df[fields].groupby(buckets, sort=True)
+    parts = [grouped.size().rename('count')]
+    for stat, how in zip(ROLLUP_STATS, ['min', 'max', 'sum', 'last']):
+        parts.append(grouped.agg(how).add_suffix(f'_{stat}'))
+    return pd.concat(parts, axis=1).reset_index()
+
+
+def merge_rollup(df, fields):
+    # Combine rows written for the same bucket (partial buckets around a
+    # collector restart) and add a <field>_mean column per field
+    if not df['timestamp'].is_unique:
+        grouped = df.groupby('timestamp', sort=True)
+        how = {'count': 'sum'}
+        for field in fields:
+            how.update({f'{field}_min': 'min', f'{field}_max': 'max', f'{field}_sum': 'sum',
+                        f'{field}_last': 'last'})
+        df = grouped.agg(how).reset_index()
+    for field in fields:
+        df[f'{field}_mean'] = df[f'{field}_sum'] / df['count']
+    return df
+
+
+def rebuild_rollups(data_dir, tiers=None, output_config=None):
+    # Recompute every tier of the system tables from the raw data, e.g. for
+    # data collected before rollups were enabled. Existing tiers are replaced.
+    from src.plot_system_metrices import MetricsAnalyzer, METRIC_TYPES
+    from src.system_metrics_collector import COLUMNS
+
+    analyzer = MetricsAnalyzer(data_dir)
+    for metric in METRIC_TYPES:
+        df = analyzer.load_range(metric)
+        if df is None:
+            continue
+        fields = COLUMNS[metric][1:]
+        for tier in sorted(tiers or ROLLUP_TIERS):
+            base = f'{data_dir}/{rollup_name(metric, tier)}'
+            for ext in ('.csv', '.bin'):
+                if os.path.exists(f'{base}{ext}'):
+                    os.remove(f'{base}{ext}')
+            if os.path.isdir(base):
+                shutil.rmtree(base)
+            sink = open_sink(base, rollup_columns(fields), output_config, rollup_types(fields),
+                             datetime_column=False)
+            for row in rollup_frame(df, fields, tier).itertuples(index=False):
+                sink.write(list(row))
+            sink.close()
+        print(f"{metric}: {len(df)} rows rolled up into {len(tiers or ROLLUP_TIERS)} tiers")
+
+
+def main():
+    from src.system_metrics_collector import load_config
+
+    config = load_config()
+    parser = argparse.ArgumentParser(description='Rebuild the rollup tiers used for long-range plots')
+    parser.add_argument('--data-dir', default='metrics_data')
+    args = parser.parse_args()
+    output_config = dict(config.get('output') or {})
+    rebuild_rollups(args.data_dir, output_config.pop('rollups', None), output_config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from src.ring_buffer import RingBuffer
+
+# Cumulative tables, exposed as Prometheus counters
+COUNTER_METRICS = {'io', 'network'}
+
+# Distinct range queries cached per tick, beyond which they are answered uncached
+RANGE_CACHE_SIZE = 256
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Serves what the collector samples over HTTP from an asyncio loop in its own
+# thread, so scrapers never wait on sampling and sampling never waits on them:
+#
+#   GET /metrics                 latest sample of every metric, Prometheus text
+#   GET /api/latest              the same as JSON
+#   GET /api/range?metric=cpu&seconds=60   (or &start=&end=, epoch seconds)
+#                                recent rows from an in-memory ring buffer
+#
+# publish() only appends rows to the ring buffers and bumps a version. The
+# responses are rendered once per tick on the loop thread and served as cached
+# bytes until the next tick, so hundreds of scrapers cost one render.
+class MetricsExporter:
+    def __init__(self, columns, host='127.0.0.1', port=9105, history=600, interval=1, process_columns=None):
+        self.columns = columns
+        self.process_columns = process_columns
+        self.host = host
+        self.port = port
+        capacity = int(history / interval) + 1
+        self.rings = {metric: RingBuffer(capacity, len(metric_columns)) for metric, metric_columns in columns.items()}
+        self.latest = {}
+        self.processes = []
+        self.lock = threading.Lock()
+        self.version = 0
+
+        self.rendered_version = -1
+        self.cache = {}
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.error = None
+        self.requests = 0
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), name='exporter', daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error:
+            raise self.error
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def _run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port, backlog=1024))
+        except OSError as e:
+            self.error = e
+            ready.set()
+            return
+        if not self.port:
+            self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+        # Stopped: drop open connections and close the loop
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def stop(self):
+        if self.loop and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(5)
+
+    def publish(self, timestamp, rows, processes=None):
+        # Called from the sampling thread once per tick: rows maps metric to
+        # [timestamp] + values, processes are PROCESS_COLUMNS rows
+        with self.lock:
+            for metric, row in rows.items():
+                if metric in self.rings:
+                    self.rings[metric].extend([row])
+                    self.latest[metric] = row
+            if processes is not None:
+                self.processes = processes
+            self.version += 1
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.render)
+
+    def render(self):
+        # Pre-renders the per-tick responses; range answers are cached lazily
+        with self.lock:
+            if self.rendered_version == self.version:
+                return
+            self.rendered_version = self.version
+            latest = dict(self.latest)
+            processes = list(self.processes)
+        self.cache = {
+            '/metrics': ('200 OK', 'text/plain; version=0.0.4', self.prometheus_text(latest, processes)),
+            '/api/latest': ('200 OK', 'application/json', self.latest_json(latest, processes))
+        }
+
+    def prometheus_text(self, latest, processes):
+        lines = []
+        newest = 0
+        for metric, row in latest.items():
+            counter = metric in COUNTER_METRICS
+            newest = max(newest, row[0])
+            for column, value in zip(self.columns[metric][1:], row[1:]):
+                name = f'system_{metric}_{column}' + ('_total' if counter else '')
+                lines.append(f'# TYPE {name} {"counter" if counter else "gauge"}')
+                lines.append(f'{name} {value}')
+        if processes and self.process_columns:
+            # pid, name, then one gauge family per measurement
+            for i, column in enumerate(self.process_columns[3:], 3):
+                name = f'system_process_{column}'
+                lines.append(f'# TYPE {name} gauge')
+                for row in processes:
+                    lines.append(f'{name}{{pid="{row[1]}",name="{_label(row[2])}"}} {row[i]}')
+        if newest:
+            lines.append('# TYPE system_last_sample_timestamp_seconds gauge')
+            lines.append(f'system_last_sample_timestamp_seconds {newest}')
+        return ('\n'.join(lines) + '\n').encode()
+
+    def latest_json(self, latest, processes):
+        data = {metric: dict(zip(self.columns[metric], row)) for metric, row in latest.items()}
+        if self.process_columns:
+            data['process'] = [dict(zip(self.process_columns, row)) for row in processes]
+        return json.dumps(data).encode()
+
+    def range_json(self, query):
+        params = parse_qs(query)
+        metric = params.get('metric', [None])[0]
+        if metric not in self.rings:
+            return '404 Not Found', 'application/json', json.dumps(
+                {'error': f'unknown metric, one of: {", ".join(self.rings)}'}).encode()
+        try:
+            start = float(params['start'][0]) if 'start' in params else None
+            end = float(params['end'][0]) if 'end' in params else None
+            seconds = float(params['seconds'][0]) if 'seconds' in params else None
+        except ValueError:
+            return '400 Bad Request', 'application/json', json.dumps({'error': 'bad number'}).encode()
+
+        with self.lock:
+            rows = self.rings[metric].view().copy()
+        timestamps = rows[:, 0]
+        if seconds is not None and len(rows):
+            start = timestamps[-1] - seconds
+        first = timestamps.searchsorted(start, 'right' if seconds is not None else 'left') if start else 0
+        last = timestamps.searchsorted(end) if end else len(rows)
+        return '200 OK', 'application/json', json.dumps(
+            {'metric': metric, 'columns': self.columns[metric], 'rows': rows[first:last].tolist()}).encode()
+
+    def respond(self, method, target):
+        if method != 'GET':
+            return '405 Method Not Allowed', 'text/plain', b'GET only\n'
+        if self.rendered_version != self.version:
+            self.render()
+        response = self.cache.get(target)
+        if response:
+            return response
+        url = urlsplit(target)
+        if url.path in self.cache:
+            return self.cache[url.path]
+        if url.path == '/api/range':
+            response = self.range_json(url.query)
+            if len(self.cache) < RANGE_CACHE_SIZE:
+                self.cache[target] = response
+            return response
+        return '404 Not Found', 'text/plain', b'Try /metrics, /api/latest or /api/range?metric=cpu&seconds=60\n'
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive, enough for Prometheus and curl
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, _, headers = head.decode('latin-1').partition('\r\n')
+                method, target, version = request_line.split(' ', 2)
+                headers = headers.lower()
+                keep_alive = ('connection: close' not in headers if version.strip() == 'HTTP/1.1'
+                              else 'connection: keep-alive' in headers)
+                self.requests += 1
+                status, content_type, body = self.respond(method, target)
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                             f'Content-Length: {len(body)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Exporter stopping with the connection still open
+            pass
+        finally:
+            writer.close()
+
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import shlex
+from datetime import datetime
+
+GC_PAUSE_COLUMNS = ['timestamp', 'gc_id', 'gc_type', 'cause', 'duration_ms', 'time_to_safepoint_ms',
+                    'heap_before_kb', 'heap_after_kb', 'heap_total_kb']
+SAFEPOINT_COLUMNS = ['timestamp', 'operation', 'duration_ms', 'threads_wait_time']
+
+DECORATORS = re.compile(r'((?:\[[^\]]*\])+)\s*')
+DECORATOR = re.compile(r'\[([^\]]*)\]')
+MILLIS = re.compile(r'(\d+)ms$')
+
+# [gc] GC(3) Pause Young (Normal) (G1 Evacuation Pause) 24M->4M(256M) 3.456ms
+# [gc,phases] GC(0) Pause Mark Start 0.012ms (ZGC, no heap sizes)
+PAUSE = re.compile(r'GC\((\d+)\) Pause (.*?)(?: (\d+)([KMG])->(\d+)([KMG])\((\d+)([KMG])\))? (\d+(?:\.\d+)?)ms$')
+# JDK 17+: one line per safepoint (JDK 21 adds Cleanup)
+SAFEPOINT = re.compile(r'Safepoint "([^"]+)", Time since last: \d+ ns, Reaching safepoint: (\d+) ns, '
+                       r'(?:Cleanup: \d+ ns, )?At safepoint: \d+ ns, Total: (\d+) ns')
+# JDK 9-16: operation name and stopped time on separate lines
+SAFEPOINT_ENTER = re.compile(r'Entering safepoint region: (\S+)')
+SAFEPOINT_STOPPED = re.compile(r'Total time for which application threads were stopped: ([\d.]+) seconds, '
+                               r'Stopping threads took: ([\d.]+) seconds')
+# VM operations that carry a GC pause, so their time to safepoint belongs to it
+GC_OPERATION = re.compile(r'GC|Collect|G1|^Z[A-Z]|Shenandoah|CMS')
+
+SIZE_KB = {'K': 1, 'M': 1024, 'G': 1024 * 1024}
+
+
+# Follows a growing log file by offset, the way `tail -F` does: only bytes
+# past the last offset are read, a partial last line is held back until its
+# newline arrives, and when the path is rotated (renamed away and recreated,
+# as -Xlog's filecount rotation does) or truncated, the old file is drained
+# before switching to the new one. Growth is detected by polling stat once
+# per call, which is cheap enough at collector intervals. With from_end, the
+# first file opened is read from its last from_end bytes (at a line start)
+# instead of from the beginning.
+class LogTailer:
+    def __init__(self, path, max_bytes=4 * 1024 * 1024, from_end=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.from_end = from_end
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+
+    def _open(self):
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.offset = 0
+        self.partial = b''
+        if self.from_end is not None and stat.st_size > self.from_end:
+            start = stat.st_size - self.from_end
+            # Skip the line the start falls into
+            newline = os.pread(self.file.fileno(), 64 * 1024, start - 1).find(b'\n')
+            self.offset = start + newline if newline >= 0 else start
+        self.from_end = None
+        return True
+
+    def _read(self, limit):
+        data = os.pread(self.file.fileno(), limit, self.offset)
+        self.offset += len(data)
+        return data
+
+    def read_lines(self):
+        if self.file is None and not self._open():
+            return []
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+
+        data = self._read(self.max_bytes)
+        if len(data) < self.max_bytes:
+            if stat is None or (stat.st_dev, stat.st_ino) != self.inode:
+                # Rotated and the old file is drained: finish its last line
+                # and continue from the start of the new one
+                lines = self._split(data, final=True)
+                self.file.close()
+                self.file = None
+                return lines + self.read_lines() if stat is not None else lines
+            if stat.st_size < self.offset:
+                # Truncated in place
+                self.offset = 0
+                self.partial = b''
+                return self._split(self._read(self.max_bytes))
+        return self._split(data)
+
+    def _split(self, data, final=False):
+        data = self.partial + data
+        lines = data.split(b'\n')
+        self.partial = b'' if final else lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines if line]
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def _kb(value, unit):
+    return int(value) * SIZE_KB[unit] if value is not None else None
+
+
+def _split_pause_name(name):
+    # "Young (Normal) (G1 Evacuation Pause)" -> ("Young (Normal)", "G1 Evacuation Pause")
+    if not name.endswith(')'):
+        return name, ''
+    depth = 0
+    for i in range(len(name) - 1, -1, -1):
+        if name[i] == ')':
+            depth += 1
+        elif name[i] == '(':
+            depth -= 1
+            if depth == 0:
+                return name[:i].rstrip(), name[i + 1:-1]
+    return name, ''
+
+
+def line_timestamp(decorators):
+    # Wall clock time from the time/utctime or timemillis decorators, None
+    # when the log was configured with uptime only
+    for decorator in decorators:
+        if len(decorator) > 10 and decorator[4] == '-' and decorator[10] == 'T':
+            try:
+                return datetime.strptime(decorator, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+            except ValueError:
+                continue
+        match = MILLIS.match(decorator)
+        if match and int(match.group(1)) > 10 ** 11:
+            return int(match.group(1)) / 1000
+    return None
+
+
+# Turns unified logging lines into GC pause and safepoint rows. A GC pause is
+# logged inside its safepoint and the safepoint line follows it, so a pause is
+# held back until that line supplies its time to safepoint, or until the next
+# batch of lines, whichever comes first.
+class GcLogParser:
+    def __init__(self):
+        self.pending = []
+        self.operation = None
+
+    def feed(self, lines, now):
+        pauses = []
+        safepoints = []
+        held = len(self.pending)
+
+        for line in lines:
+            match = DECORATORS.match(line)
+            decorators = DECORATOR.findall(match.group(1)) if match else []
+            message = line[match.end():] if match else line
+            timestamp = line_timestamp(decorators) or now
+
+            pause = PAUSE.search(message)
+            if pause:
+                gc_type, cause = _split_pause_name(pause.group(2))
+                self.pending.append([timestamp, int(pause.group(1)), gc_type, cause, float(pause.group(9)), None,
+                                     _kb(pause.group(3), pause.group(4)), _kb(pause.group(5), pause.group(6)),
+                                     _kb(pause.group(7), pause.group(8))])
+                continue
+
+            safepoint = SAFEPOINT.search(message)
+            if safepoint:
+                operation = safepoint.group(1)
+                reaching_ms = int(safepoint.group(2)) / 1e6
+                total_ms = int(safepoint.group(3)) / 1e6
+            else:
+                enter = SAFEPOINT_ENTER.search(message)
+                if enter:
+                    self.operation = enter.group(1)
+                    continue
+                stopped = SAFEPOINT_STOPPED.search(message)
+                if not stopped:
+                    continue
+                operation = self.operation or 'Unknown'
+                self.operation = None
+                total_ms = float(stopped.group(1)) * 1000
+                reaching_ms = float(stopped.group(2)) * 1000
+
+            safepoints.append([timestamp, operation, total_ms, reaching_ms])
+            if self.pending and GC_OPERATION.search(operation):
+                # The safepoint closes the pause logged just before it; any
+                # older pending pause missed its safepoint line
+                self.pending[-1][5] = reaching_ms
+                pauses.extend(self.pending)
+                self.pending = []
+                held = 0
+
+        # Pauses already held over from the previous batch never got a
+        # safepoint line (safepoint logging is off), emit them as they are
+        pauses.extend(self.pending[:held])
+        self.pending = self.pending[held:]
+        return pauses, safepoints
+
+    def close(self):
+        pauses, self.pending = self.pending, []
+        return pauses
+
+
+def find_gc_log(pid, proc_path='/proc'):
+    # The file= output of the JVM's first -Xlog option that logs gc or
+    # safepoint tags, resolved against the JVM's working directory
+    try:
+        with open(f'{proc_path}/{pid}/cmdline', 'rb') as f:
+            args = [arg.decode(errors='replace') for arg in f.read().split(b'\0') if arg]
+    except OSError:
+        return None
+
+    for arg in args:
+        if not arg.startswith('-Xlog:') or ('gc' not in arg and 'safepoint' not in arg):
+            continue
+        parts = arg[len('-Xlog:'):].split(':')
+        if len(parts) < 2 or not parts[1].startswith('file='):
+            continue
+        path = shlex.split(parts[1][len('file='):])[0]
+        if '%t' in path:
+            print(f"Cannot locate GC log {path}: %t in the file name is not supported, use --gc-log")
+            return None
+        path = path.replace('%p', str(pid))
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.realpath(f'{proc_path}/{pid}/cwd'), path)
+        return path
+    return None
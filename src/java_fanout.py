@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from src.system_metrics_collector import load_config
+from src.scheduler import TickScheduler
+from src.java_lock_metrics_collector import JavaLockMetricsCollector
+from src.alerts import build_rules
+from src.anomaly import anomaly_params
+from src.self_metrics import SelfMonitor, self_metrics_params
+
+
+def discover_java_processes(pattern=None):
+    # pid -> create_time of running Java processes whose command line matches
+    regex = re.compile(pattern) if pattern else None
+    found = {}
+    for process in psutil.process_iter(['pid', 'name', 'cmdline', 'create_time']):
+        info = process.info
+        if 'java' not in (info['name'] or '').lower():
+            continue
+        if regex and not regex.search(' '.join(info['cmdline'] or [])):
+            continue
+        found[info['pid']] = info['create_time']
+    return found
+
+
+def running_processes(pids):
+    found = {}
+    for pid in pids:
+        try:
+            found[pid] = psutil.Process(pid).create_time()
+        except psutil.Error:
+            pass
+    return found
+
+
+# One monitored JVM. At most one sample per target is in flight; a tick that
+# finds the previous sample still running is skipped for that target only.
+class Target:
+    def __init__(self, pid, create_time, collector):
+        self.pid = pid
+        self.create_time = create_time
+        self.collector = collector
+        self.busy = False
+        self.closing = False
+        self.samples = 0
+        self.skipped = 0
+        self.expired = 0
+        self.errors = 0
+
+
+# Samples many JVMs from one process. A single TickScheduler hands each
+# target's sample to a bounded thread pool (the work is jstack/JMX/file I/O,
+# so threads suffice); a sample that has not started by the next tick is
+# dropped rather than queued behind the others. Targets are either a fixed
+# list of PIDs or every Java process matching a command line regex,
+# re-evaluated every discover_interval seconds, so JVMs that start are picked
+# up and JVMs that exit (or whose PID is reused) are closed. Each target
+# writes the usual Java tables under output_dir/pid-<pid>/.
+class JavaFanoutCollector:
+    def __init__(self, output_dir, interval=1, pids=None, match=None, workers=4,
+                 discover_interval=10, collector_options=None, self_metrics=None):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.pids = pids
+        self.match = match
+        self.discover_interval = discover_interval
+        self.collector_options = dict(collector_options or {})
+        # Written by the collectors of JVMs that have exited
+        self.bytes_written = 0
+        # The fan-out process's own cost and tick lateness in output_dir;
+        # each JVM's collector records only its sampling latency
+        self.monitor = None
+        if self_metrics is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            self.monitor = SelfMonitor(output_dir, self.collector_options.get('output_config'), 'java_collector',
+                                       writers=self.writers, **self_metrics)
+            self.collector_options['self_metrics'] = dict(self_metrics, process=False)
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='java-fanout')
+        self.scheduler = TickScheduler(interval, self.tick, name='java-fanout', monitor=self.monitor)
+        self.discovering = False
+        self.last_discovery = None
+
+    def discover(self):
+        if self.pids:
+            return running_processes(self.pids)
+        return discover_java_processes(self.match)
+
+    def refresh_targets(self):
+        try:
+            found = self.discover()
+
+            for pid, target in list(self.targets.items()):
+                if found.get(pid) != target.create_time:
+                    print(f"JVM {pid} exited, closing its collector")
+                    self.remove_target(target)
+
+            for pid, create_time in found.items():
+                if pid not in self.targets:
+                    self.add_target(pid, create_time)
+        finally:
+            self.discovering = False
+
+    def add_target(self, pid, create_time):
+        try:
+            collector = JavaLockMetricsCollector(pid, f'{self.output_dir}/pid-{pid}', self.interval,
+                                                 **self.collector_options)
+            collector.sample_timeout = self.interval
+            collector.open_connection()
+        except Exception as e:
+            # Retried on the next discovery pass
+            print(f"Cannot collect from JVM {pid}: {e}")
+            return
+        with self.lock:
+            self.targets[pid] = Target(pid, create_time, collector)
+        print(f"Collecting from JVM {pid}")
+
+    def remove_target(self, target):
+        with self.lock:
+            self.targets.pop(target.pid, None)
+            # An in-flight sample closes the collector when it finishes
+            target.closing = True
+            if target.busy:
+                return
+        self.close_target(target)
+
+    def close_target(self, target):
+        try:
+            target.collector.close()
+            self.bytes_written += sum(sink.bytes_written for sink in target.collector.sinks.values())
+        except Exception as e:
+            print(f"Error closing collector for JVM {target.pid}: {e}")
+        print(f"JVM {target.pid}: {target.samples} samples, {target.skipped} skipped, "
+              f"{target.expired} expired, {target.errors} errors")
+
+    def tick(self, timestamp):
+        now = time.monotonic()
+        if not self.discovering and (self.last_discovery is None
+                                     or now - self.last_discovery >= self.discover_interval):
+            self.discovering = True
+            self.last_discovery = now
+            self.pool.submit(self.refresh_targets)
+
+        deadline = now + self.interval
+        with self.lock:
+            targets = list(self.targets.values())
+        if self.monitor:
+            self.monitor.poll()
+        for target in targets:
+            with self.lock:
+                if target.busy or target.closing:
+                    target.skipped += 1
+                    continue
+                target.busy = True
+            self.pool.submit(self.sample_target, target, deadline)
+
+    def sample_target(self, target, deadline):
+        try:
+            if time.monotonic() > deadline:
+                target.expired += 1
+                return
+            collector = target.collector
+            start = time.perf_counter()
+            collector.sample_locks()
+            collector.sample_gc()
+            collector.sample_gc_log()
+            target.samples += 1
+            if self.monitor:
+                self.monitor.record('sample', time.perf_counter() - start)
+                collector.monitor.poll()
+        except Exception as e:
+            target.errors += 1
+            if self.monitor:
+                self.monitor.error('sample')
+            print(f"Error sampling JVM {target.pid}: {e}")
+        finally:
+            with self.lock:
+                target.busy = False
+                close = target.closing
+            if close:
+                self.close_target(target)
+
+    def start_collection(self):
+        return [self.scheduler.start()]
+
+    def stop_collection(self):
+        self.scheduler.stop()
+        self.pool.shutdown(wait=True)
+        for target in list(self.targets.values()):
+            self.remove_target(target)
+        if self.monitor:
+            self.monitor.close()
+        stats = self.scheduler.stats()
+        print(f"Fan-out ticks: {stats['ticks']}, missed: {stats['missed_ticks']}")
+
+    def writers(self):
+        # Sinks of the running collectors, and self for the bytes of closed ones
+        with self.lock:
+            targets = list(self.targets.values())
+        return [self] + [sink for target in targets for sink in target.collector.sinks.values()]
+
+    def flush(self, durable=True):
+        with self.lock:
+            targets = list(self.targets.values())
+        for target in targets:
+            target.collector.flush(durable)
+        if self.monitor:
+            self.monitor.flush(durable)
+
+
+def main():
+    config = load_config()
+    java_config = config['collection']['java']
+    fanout_config = java_config.get('fanout', {})
+    parser = argparse.ArgumentParser(description='Collect Java metrics from many JVMs')
+    targets = parser.add_mutually_exclusive_group()
+    targets.add_argument('--pids', help='Comma separated PIDs')
+    targets.add_argument('--match', default=fanout_config.get('match'),
+                         help='Regex over the command line of running Java processes (default: all)')
+    parser.add_argument('--output-dir', default='metrics_data')
+    parser.add_argument('--interval', type=float, default=java_config['interval'])
+    parser.add_argument('--workers', type=int, default=fanout_config.get('workers', 4))
+    parser.add_argument('--discover-interval', type=float, default=fanout_config.get('discover_interval', 10))
+    parser.add_argument('--connection', choices=['auto', 'jmx', 'jstack'],
+                        default=java_config.get('connection', 'auto'))
+    parser.add_argument('--duration', default=0, type=int,
+                        help='Seconds to collect for, 0 to run until interrupted')
+    args = parser.parse_args()
+
+    pids = [int(pid) for pid in args.pids.split(',')] if args.pids else None
+    collector = JavaFanoutCollector(args.output_dir, args.interval, pids, args.match, args.workers,
+                                    args.discover_interval, {
+                                        'output_config': config.get('output'),
+                                        'connection': args.connection,
+                                        'profile_bucket': java_config.get('profile_bucket', 60),
+                                        'profile_max_stacks': java_config.get('profile_max_stacks', 5000),
+                                        'alert_rules': build_rules(config),
+                                        'anomaly_params': anomaly_params(config)
+                                    }, self_metrics_params(config))
+
+    signal.signal(signal.SIGUSR1, lambda signum, frame: collector.flush())
+
+    # kill and systemd stop with SIGTERM: close the sinks so buffered rows reach disk
+    def stop(signum, frame):
+        print(f"\nReceived signal {signum}")
+        collector.stop_collection()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        collector.start_collection()
+        if args.duration > 0:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    collector.stop_collection()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,41 +2,119 @@
 
 import subprocess
 import time
-import csv
 import os
-from datetime import datetime
 import threading
-import re
+import signal
+import sys
 
 from src.system_metrics_collector import load_config
+from src.sinks import open_sink
+from src.jvm_connection import JmxConnection, JstatStream
+from src.thread_dump_parser import parse_thread_dump, summarize_locks, find_deadlocks
+from src.stack_table import JavaTables
+from src.wallclock_profiler import WallClockProfiler, PROFILE_COLUMNS
+from src.gc_log import LogTailer, GcLogParser, find_gc_log, GC_PAUSE_COLUMNS, SAFEPOINT_COLUMNS
+from src.alerts import AlertEngine, build_rules
+from src.anomaly import AnomalyMonitor, JAVA_SERIES, JAVA_SERIES_COLUMNS, anomaly_params
+from src.self_metrics import SelfMonitor, self_metrics_params
+
+
+FILE_NAMES = {
+    'locks': 'java_locks',
+    'lock_summary': 'java_lock_summary',
+    'deadlocks': 'java_deadlocks',
+    'threads': 'java_threads',
+    'gc': 'gc_metrics',
+    'gc_pauses': 'gc_pauses',
+    'safepoint': 'safepoint_metrics',
+    'profile': 'java_profile'
+}
+
+# Thread, state, lock and stack columns hold ids into the dictionaries kept by
+# JavaTables (java_thread_names.csv, java_states.csv, java_lock_ids.csv,
+# java_stacks.csv); -1 means no owner. A thread dump only shows who waits, not
+# for how long: wait times are in jfr_lock_waits, see src/jfr_reader.py
+COLUMNS = {
+    'locks': ['timestamp', 'thread_id', 'lock_id', 'owner_thread_id'],
+    'lock_summary': ['timestamp', 'lock_id', 'owner_thread_id', 'waiters'],
+    'deadlocks': ['timestamp', 'threads'],
+    'threads': ['timestamp', 'thread_id', 'state_id', 'stack_id', 'waited_count', 'blocked_count', 'blocked_time'],
+    'gc': ['timestamp', 'gc_type', 'duration_ms', 'young_size', 'old_size'],
+    'gc_pauses': GC_PAUSE_COLUMNS,
+    'safepoint': SAFEPOINT_COLUMNS,
+    'profile': PROFILE_COLUMNS
+}
+
+# Per-sample totals the alert rules see as the 'contention' metric: blocked
+# time summed over all threads (ms, cumulative; JMX only) and threads waiting
+# on a lock
+CONTENTION_COLUMNS = ['timestamp', 'blocked_time', 'waiters']
+
+# Record layout of the all-numeric tables when writing the binary format
+BINARY_TYPES = {
+    'locks': 'diii',
+    'lock_summary': 'diii',
+    'threads': 'diiiqqq',
+    'profile': 'diii'
+}
+
+# Longest wait between attempts of a sampling loop that keeps failing
+MAX_BACKOFF = 60
 
 
 class JavaLockMetricsCollector:
-    def __init__(self, pid, output_dir, interval=1):
+    def __init__(self, pid, output_dir, interval=1, output_config=None, connection='auto',
+                 profile_bucket=60, profile_max_stacks=5000, gc_log=None, alert_rules=None,
+                 anomaly_params=None, self_metrics=None):
         self.pid = pid
         self.output_dir = output_dir
         self.interval = interval
         self.running = True
+        self.stopped = threading.Event()
+        self.connection = connection
+        self.jmx = None
+        self.jstat = None
+        self.reported_deadlocks = set()
+        self.last_gc_time = None
+        # jstack runs longer than this many seconds are killed and the sample dropped
+        self.sample_timeout = None
 
         # Verify it's a Java process
         self._verify_java_process()
 
-        # Initialize files
-        self.files = {
-            'locks': open(f'{output_dir}/java_locks.csv', 'a'),
-            'threads': open(f'{output_dir}/java_threads.csv', 'a'),
-            'gc': open(f'{output_dir}/gc_metrics.csv', 'a'),
-            'safepoint': open(f'{output_dir}/safepoint_metrics.csv', 'a')
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Initialize sinks
+        # Id-based tables skip the datetime column, it is derivable from timestamp, and
+        # flush the dictionaries before their own rows so every id they hold is on disk
+        self.tables = JavaTables(output_dir)
+        self.sinks = {
+            metric: open_sink(f'{output_dir}/{name}', COLUMNS[metric], output_config,
+                              BINARY_TYPES.get(metric), metric not in BINARY_TYPES,
+                              self.tables.flush if metric in BINARY_TYPES else None)
+            for metric, name in FILE_NAMES.items()
         }
-
-        self.writers = {
-            'locks': csv.writer(self.files['locks']),
-            'threads': csv.writer(self.files['threads']),
-            'gc': csv.writer(self.files['gc']),
-            'safepoint': csv.writer(self.files['safepoint'])
-        }
-
-        self._write_headers()
+        self.profiler = WallClockProfiler(self.sinks['profile'], profile_bucket, profile_max_stacks)
+        self.alerts = AlertEngine(alert_rules or [], {'contention': CONTENTION_COLUMNS}, output_dir,
+                                  output_config, 'java_alerts')
+        self.anomalies = None
+        if anomaly_params is not None:
+            self.anomalies = AnomalyMonitor(JAVA_SERIES, JAVA_SERIES_COLUMNS, output_dir, output_config,
+                                            'java_anomalies', anomaly_params)
+
+        # Sampling latency per step, and with process=True the collector's own
+        # CPU, memory and loop lateness (java_collector_metrics)
+        self.monitor = None
+        if self_metrics is not None:
+            self.monitor = SelfMonitor(output_dir, output_config, 'java_collector',
+                                       writers=lambda: list(self.sinks.values()), **self_metrics)
+
+        # Pause-level GC and safepoint data comes from the JVM's -Xlog file
+        self.gc_log = gc_log or find_gc_log(pid)
+        self.gc_log_tailer = LogTailer(self.gc_log) if self.gc_log else None
+        self.gc_log_parser = GcLogParser()
+        if not self.gc_log:
+            print("No -Xlog:gc*,safepoint file found, GC pauses and safepoints are not collected")
 
     def _verify_java_process(self):
         try:
@@ -47,148 +125,210 @@ class JavaLockMetricsCollector:
         except subprocess.CalledProcessError:
             raise ValueError(f"Process {self.pid} not found")
 
-    def _write_headers(self):
-        headers = {
-            'locks': ['timestamp', 'datetime', 'thread_name', 'lock_class', 'lock_id', 'wait_time', 'owner_thread'],
-            'threads': ['timestamp', 'datetime', 'thread_name', 'state', 'waited_count', 'blocked_count', 'blocked_time'],
-            'gc': ['timestamp', 'datetime', 'gc_type', 'duration_ms', 'young_size', 'old_size'],
-            'safepoint': ['timestamp', 'datetime', 'operation', 'duration_ms', 'threads_wait_time']
-        }
+    def open_connection(self):
+        # Prefer one persistent JMX session; fall back to forking jstack per
+        # sample for thread dumps and one streaming jstat process for GC
+        if self.connection in ('auto', 'jmx'):
+            try:
+                self.jmx = JmxConnection(self.pid)
+                return
+            except Exception as e:
+                if self.connection == 'jmx':
+                    raise
+                print(f"JMX connection unavailable, falling back to jstack/jstat: {e}")
+
+        self.jstat = JstatStream(self.pid, self.interval)
 
-        for metric_type, header in headers.items():
-            if os.path.getsize(f'{self.output_dir}/{metric_type}.csv') == 0:
-                self.writers[metric_type].writerow(header)
+    def collect_thread_info(self):
+        if self.jmx:
+            return self.jmx.thread_info()
+        return self.collect_thread_dump()
 
     def collect_thread_dump(self):
+        # Parse jstack's output as it streams in rather than buffering it whole
         try:
-            cmd = f"jstack -l {self.pid}"
-            return subprocess.check_output(cmd, shell=True).decode()
-        except subprocess.CalledProcessError as e:
+            with subprocess.Popen(['jstack', '-l', str(self.pid)], stdout=subprocess.PIPE,
+                                  text=True) as process:
+                timer = threading.Timer(self.sample_timeout, process.kill) if self.sample_timeout else None
+                if timer:
+                    timer.start()
+                try:
+                    # CPU time of this thread only: waiting on jstack's pipe is not counted
+                    parse_start = time.thread_time()
+                    thread_info = self.parse_thread_dump(process.stdout)
+                    if self.monitor:
+                        self.monitor.record('jstack_parse_cpu', time.thread_time() - parse_start)
+                finally:
+                    if timer:
+                        timer.cancel()
+            if process.returncode != 0:
+                print(f"Error collecting thread dump: jstack exited with status {process.returncode}")
+                return None
+            return thread_info
+        except OSError as e:
             print(f"Error collecting thread dump: {e}")
             return None
 
     def collect_gc_stats(self):
-        try:
-            cmd = f"jstat -gc {self.pid}"
-            return subprocess.check_output(cmd, shell=True).decode()
-        except subprocess.CalledProcessError as e:
-            print(f"Error collecting GC stats: {e}")
-            return None
+        if self.jmx:
+            return self.jmx.gc_info()
+        return self.jstat.gc_info()
 
     def parse_thread_dump(self, thread_dump):
-        threads_info = []
-        current_thread = None
-        lock_info = []
-
-        for line in thread_dump.split('\n'):
-            if '"' in line and 'nid=' in line:  # Thread line
-                thread_match = re.match(r'"([^"]+)".*prio=(\d+).*tid=(\w+).*nid=(\w+).*state=(\w+)', line)
-                if thread_match:
-                    current_thread = {
-                        'name': thread_match.group(1),
-                        'state': thread_match.group(5),
-                        'waited_count': 0,
-                        'blocked_count': 0,
-                        'blocked_time': 0
-                    }
-                    threads_info.append(current_thread)
-
-            elif current_thread and 'waiting on' in line:
-                lock_match = re.search(r'waiting on <(\w+)> \(a ([\w\.]+)\)', line)
-                if lock_match:
-                    lock_info.append({
-                        'thread_name': current_thread['name'],
-                        'lock_id': lock_match.group(1),
-                        'lock_class': lock_match.group(2),
-                        'owner_thread': None
-                    })
-
-            elif current_thread and 'waiting to lock' in line:
-                lock_match = re.search(r'waiting to lock <(\w+)> \(a ([\w\.]+)\)', line)
-                if lock_match:
-                    lock_info.append({
-                        'thread_name': current_thread['name'],
-                        'lock_id': lock_match.group(1),
-                        'lock_class': lock_match.group(2),
-                        'owner_thread': None
-                    })
-
-        return threads_info, lock_info
-
-    def collect_lock_metrics(self):
+        return parse_thread_dump(thread_dump)
+
+    def measure(self, source, start):
+        if self.monitor:
+            self.monitor.record(source, time.perf_counter() - start)
+
+    def run_loop(self, source, sample):
+        # Calls sample() every interval until stopped. Lateness is measured
+        # against the previous start plus the interval, so the time sample()
+        # itself takes shows up as drift. A failing sample is retried after
+        # interval * 2^failures (at most MAX_BACKOFF) seconds rather than at
+        # once, and only the first error of a run of failures is printed.
+        failures = 0
+        deadline = None
         while self.running:
+            start = time.monotonic()
+            if self.monitor and deadline is not None:
+                lateness = start - deadline
+                self.monitor.tick(lateness, int(max(lateness, 0) // self.interval), lateness > self.interval * 0.1)
             try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-                thread_dump = self.collect_thread_dump()
-                if thread_dump:
-                    threads_info, lock_info = self.parse_thread_dump(thread_dump)
-
-                    for lock in lock_info:
-                        self.writers['locks'].writerow([
-                            timestamp,
-                            datetime_str,
-                            lock['thread_name'],
-                            lock['lock_class'],
-                            lock['lock_id'],
-                            0,  # wait_time (needs JFR for accurate timing)
-                            lock['owner_thread']
-                        ])
-
-                    for thread in threads_info:
-                        self.writers['threads'].writerow([
-                            timestamp,
-                            datetime_str,
-                            thread['name'],
-                            thread['state'],
-                            thread['waited_count'],
-                            thread['blocked_count'],
-                            thread['blocked_time']
-                        ])
-
-                self.files['locks'].flush()
-                self.files['threads'].flush()
-                time.sleep(self.interval)
-
+                sample()
             except Exception as e:
-                print(f"Error in lock metrics collection: {e}")
+                failures += 1
+                if self.monitor:
+                    self.monitor.error(source)
+                if failures == 1:
+                    print(f"Error in {source} collection: {e}, retrying with backoff")
+            else:
+                if failures:
+                    print(f"{source} collection recovered after {failures} failed attempts")
+                failures = 0
+            if self.monitor:
+                self.monitor.poll()
+            delay = min(self.interval * 2 ** failures, MAX_BACKOFF) if failures else self.interval
+            deadline = start + delay
+            self.stopped.wait(delay)
 
-    def collect_gc_metrics(self):
-        while self.running:
-            try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-                gc_stats = self.collect_gc_stats()
-                if gc_stats:
-                    # Parse jstat output
-                    lines = gc_stats.strip().split('\n')
-                    if len(lines) >= 2:
-                        headers = lines[0].split()
-                        values = lines[1].split()
-                        gc_data = dict(zip(headers, values))
-
-                        self.writers['gc'].writerow([
-                            timestamp,
-                            datetime_str,
-                            'Unknown',  # gc_type needs JFR for accurate type
-                            gc_data.get('GCT', 0),  # GC time
-                            gc_data.get('EU', 0),   # Eden usage
-                            gc_data.get('OU', 0)    # Old usage
-                        ])
-
-                self.files['gc'].flush()
-                time.sleep(self.interval)
+    def collect_lock_metrics(self):
+        self.run_loop('lock metrics', self.sample_locks)
+
+    def sample_locks(self):
+        timestamp = time.time()
+
+        start = time.perf_counter()
+        thread_info = self.collect_thread_info()
+        self.measure('thread_dump', start)
+        if thread_info:
+            threads_info, lock_info = thread_info
+
+            start = time.perf_counter()
+            self.record_thread_info(timestamp, threads_info, lock_info)
+            self.record_deadlocks(timestamp, find_deadlocks(lock_info))
+            self.measure('record_threads', start)
+
+    def record_thread_info(self, timestamp, threads_info, lock_info):
+        tables = self.tables
+
+        for lock in lock_info:
+            self.sinks['locks'].write([
+                timestamp,
+                tables.thread(lock['thread_name'], lock['thread_id']),
+                tables.locks.intern(lock['lock_id'], lock['lock_class']),
+                tables.thread(lock['owner_thread'], lock['owner_id'])
+            ])
+
+        states = {}
+        for thread in threads_info:
+            states[thread['state']] = states.get(thread['state'], 0) + 1
+            state_id = tables.states.intern(thread['state'])
+            stack_id = tables.stacks.intern(thread['stack'])
+            self.sinks['threads'].write([
+                timestamp,
+                tables.thread(thread['name'], thread['thread_id']),
+                state_id,
+                stack_id,
+                thread['waited_count'],
+                thread['blocked_count'],
+                thread['blocked_time']
+            ])
+            self.profiler.add(timestamp, state_id, stack_id)
+        self.profiler.end_sample()
+
+        waiters = 0
+        for lock in summarize_locks(lock_info):
+            self.sinks['lock_summary'].write([
+                timestamp,
+                tables.locks.intern(lock['lock_id'], lock['lock_class']),
+                tables.thread(lock['owner_thread'], lock['owner_id']),
+                lock['waiters']
+            ])
+            waiters += lock['waiters']
+        self.alerts.observe('contention', [timestamp, sum(thread['blocked_time'] for thread in threads_info),
+                                           waiters])
+        if self.anomalies:
+            self.anomalies.observe('threads', [timestamp, states.get('BLOCKED', 0), states.get('WAITING', 0),
+                                               states.get('TIMED_WAITING', 0)])
+
+    def record_deadlocks(self, timestamp, deadlocks):
+        for cycle in deadlocks:
+            threads = ' -> '.join(cycle + cycle[:1])
+            self.sinks['deadlocks'].write([timestamp, threads])
+            if threads not in self.reported_deadlocks:
+                self.reported_deadlocks.add(threads)
+                print(f"Deadlock detected: {threads}")
 
-            except Exception as e:
-                print(f"Error in GC metrics collection: {e}")
+    def collect_gc_metrics(self):
+        self.run_loop('GC metrics', self.sample_gc)
+
+    def sample_gc(self):
+        timestamp = time.time()
+
+        start = time.perf_counter()
+        gc_data = self.collect_gc_stats()
+        self.measure('gc', start)
+        if gc_data:
+            # GC time spent since the previous sample, summed over all
+            # collectors; per-pause rows are in gc_pauses.csv
+            gc_time = gc_data.get('GCT', 0)
+            interval_ms = (gc_time - self.last_gc_time) * 1000 if self.last_gc_time is not None else 0
+            self.last_gc_time = gc_time
+            self.sinks['gc'].write([
+                timestamp,
+                'All',
+                max(interval_ms, 0),
+                gc_data.get('EU', 0),   # Eden usage
+                gc_data.get('OU', 0)    # Old usage
+            ])
+            if self.anomalies and interval_ms > 0:
+                self.anomalies.observe('gc', [timestamp, interval_ms])
+
+    def collect_gc_log(self):
+        self.run_loop('GC log', self.sample_gc_log)
+
+    def sample_gc_log(self):
+        if self.gc_log_tailer:
+            start = time.perf_counter()
+            self.record_gc_log(self.gc_log_tailer.read_lines(), time.time())
+            self.measure('gc_log', start)
+
+    def record_gc_log(self, lines, timestamp):
+        pauses, safepoints = self.gc_log_parser.feed(lines, timestamp)
+        for row in pauses:
+            self.sinks['gc_pauses'].write(row)
+        for row in safepoints:
+            self.sinks['safepoint'].write(row)
 
     def start_collection(self):
+        self.open_connection()
         self.threads = [
             threading.Thread(target=self.collect_lock_metrics, name="locks"),
             threading.Thread(target=self.collect_gc_metrics, name="gc")
         ]
+        if self.gc_log_tailer:
+            self.threads.append(threading.Thread(target=self.collect_gc_log, name="gclog"))
 
         for thread in self.threads:
             thread.daemon = True
@@ -198,10 +338,40 @@ class JavaLockMetricsCollector:
 
     def stop_collection(self):
         self.running = False
+        self.stopped.set()
         for thread in self.threads:
             thread.join()
-        for file in self.files.values():
-            file.close()
+        self.close()
+
+    def close(self):
+        for connection in (self.jmx, self.jstat):
+            if connection:
+                connection.close()
+        if self.gc_log_tailer:
+            # Pick up whatever the JVM logged since the last read
+            self.record_gc_log(self.gc_log_tailer.read_lines(), time.time())
+            for row in self.gc_log_parser.close():
+                self.sinks['gc_pauses'].write(row)
+            self.gc_log_tailer.close()
+        self.profiler.close()
+        self.tables.close()
+        for sink in self.sinks.values():
+            sink.close()
+        self.alerts.close()
+        if self.anomalies:
+            self.anomalies.close()
+        if self.monitor:
+            self.monitor.close()
+
+    def flush(self, durable=True):
+        self.tables.flush(durable)
+        for sink in self.sinks.values():
+            sink.flush(durable)
+        self.alerts.flush(durable)
+        if self.anomalies:
+            self.anomalies.flush(durable)
+        if self.monitor:
+            self.monitor.flush(durable)
 
 def main():
     import argparse
@@ -211,13 +381,41 @@ def main():
     parser.add_argument('--output-dir', default='metrics_data')
     parser.add_argument('--interval', type=float,
                     default=config['collection']['java']['interval'])
+    parser.add_argument('--connection', choices=['auto', 'jmx', 'jstack'],
+                        default=config['collection']['java'].get('connection', 'auto'))
+    parser.add_argument('--gc-log', default=config['collection']['java'].get('gc_log'),
+                        help='JVM unified log written with -Xlog:gc*,safepoint:file=...; '
+                             'found from the JVM command line when omitted')
+    parser.add_argument('--duration', default=0, type=int,
+                        help='Seconds to collect for, 0 to run until interrupted')
     args = parser.parse_args()
-    collector = JavaLockMetricsCollector(args.pid, args.output_dir, args.interval)
+    java_config = config['collection']['java']
+    collector = JavaLockMetricsCollector(args.pid, args.output_dir, args.interval,
+                                         config.get('output'), args.connection,
+                                         java_config.get('profile_bucket', 60),
+                                         java_config.get('profile_max_stacks', 5000),
+                                         args.gc_log, build_rules(config), anomaly_params(config),
+                                         self_metrics_params(config))
+
+    # Flush buffered rows to disk on demand
+    signal.signal(signal.SIGUSR1, lambda signum, frame: collector.flush())
+
+    # kill and systemd stop with SIGTERM: close the sinks so buffered rows reach disk
+    def stop(signum, frame):
+        print(f"\nReceived signal {signum}")
+        collector.stop_collection()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
 
     try:
-        threads = collector.start_collection()
-        while True:
-            time.sleep(1)
+        collector.start_collection()
+        if args.duration > 0:
+            time.sleep(args.duration)
+            collector.stop_collection()
+        else:
+            while True:
+                time.sleep(1)
     except KeyboardInterrupt:
         collector.stop_collection()
 
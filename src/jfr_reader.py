@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import mmap
+import struct
+from array import array
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from src.sinks import open_sink
+from src.stack_table import JavaTables
+
+CHUNK_MAGIC = b'FLR\x00'
+HEADER_SIZE = 68
+METADATA_EVENT = 0
+CONSTANT_POOL_EVENT = 1
+
+# Lock contention events written by HotSpot's JFR and by async-profiler in lock mode
+LOCK_EVENTS = {
+    'jdk.JavaMonitorEnter': ('monitorClass', 'previousOwner'),
+    'jdk.ThreadPark': ('parkedClass', None)
+}
+
+JFR_LOCK_COLUMNS = ['timestamp', 'thread_id', 'lock_id', 'wait_time', 'owner_thread_id', 'stack_id']
+JFR_SUMMARY_COLUMNS = ['lock_id', 'lock_address', 'lock_class', 'events', 'total_ms', 'mean_ms',
+                       'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'top_owner']
+
+# Primitive types stored as varints when integers are compressed
+VARINT_BITS = {'long': 64, 'int': 32, 'short': 16}
+
+FLOAT = struct.Struct('>f')
+DOUBLE = struct.Struct('>d')
+
+
+VARINT_SHIFTS = np.arange(0, 63, 7, dtype=np.uint64)
+
+# Events decoded per numpy pass, bounding the (events, 9) byte windows
+BATCH_EVENTS = 1 << 18
+
+
+class JfrFormatError(ValueError):
+    pass
+
+
+def decode_varints(data, positions):
+    # JfrInput.varlong at every offset of `positions` at once, over the uint8
+    # array `data` (readable 8 bytes past the last varint): returns the
+    # values (uint64) and the offsets past them
+    window = np.lib.stride_tricks.sliding_window_view(data, 9)[positions]
+    more = window[:, :8] >= 0x80
+    length = np.where(more.all(axis=1), 9, more.argmin(axis=1) + 1)
+    digits = (window & 0x7f).astype(np.uint64)
+    digits[:, 8] = window[:, 8]
+    digits <<= VARINT_SHIFTS
+    digits[np.arange(9) >= length[:, None]] = 0
+    return np.bitwise_or.reduce(digits, axis=1), positions + length
+
+
+# Reference to an entry of a chunk's constant pool, resolved lazily
+class PoolRef(tuple):
+    __slots__ = ()
+
+    def __new__(cls, type_id, key):
+        return tuple.__new__(cls, (type_id, key))
+
+
+# Cursor over the memory-mapped recording. With compressed integers (every
+# JDK 11+ recording) int/long/short/char are LEB128 varints of up to 9 bytes,
+# the last one carrying a full 8 bits.
+class JfrInput:
+    __slots__ = ('buf', 'pos', 'compressed')
+
+    def __init__(self, buf, pos=0, compressed=True):
+        self.buf = buf
+        self.pos = pos
+        self.compressed = compressed
+
+    def byte(self):
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def varlong(self):
+        buf = self.buf
+        pos = self.pos
+        result = 0
+        shift = 0
+        while shift < 56:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                self.pos = pos
+                return result
+            shift += 7
+        result |= buf[pos] << 56
+        self.pos = pos + 1
+        return result
+
+    def _raw(self, size):
+        value = int.from_bytes(self.buf[self.pos:self.pos + size], 'big')
+        self.pos += size
+        return value
+
+    def long(self):
+        value = self.varlong() if self.compressed else self._raw(8)
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def int(self):
+        value = (self.varlong() if self.compressed else self._raw(4)) & 0xffffffff
+        return value - (1 << 32) if value >= 1 << 31 else value
+
+    def short(self):
+        value = (self.varlong() if self.compressed else self._raw(2)) & 0xffff
+        return value - (1 << 16) if value >= 1 << 15 else value
+
+    def char(self):
+        return chr((self.varlong() if self.compressed else self._raw(2)) & 0xffff)
+
+    def float(self):
+        value, = FLOAT.unpack_from(self.buf, self.pos)
+        self.pos += 4
+        return value
+
+    def double(self):
+        value, = DOUBLE.unpack_from(self.buf, self.pos)
+        self.pos += 8
+        return value
+
+    def string(self, string_type=None):
+        encoding = self.byte()
+        if encoding == 0:
+            return None
+        if encoding == 1:
+            return ''
+        if encoding == 2:
+            return PoolRef(string_type, self.long())
+        length = self.int()
+        if encoding == 3:
+            value = bytes(self.buf[self.pos:self.pos + length]).decode('utf-8', 'replace')
+        elif encoding == 5:
+            value = bytes(self.buf[self.pos:self.pos + length]).decode('latin-1')
+        elif encoding == 4:
+            return ''.join(self.char() for _ in range(length))
+        else:
+            raise JfrFormatError(f"Unknown string encoding {encoding} at {self.pos - 1}")
+        self.pos += length
+        return value
+
+
+class ChunkHeader:
+    def __init__(self, buf, start):
+        if buf[start:start + 4] != CHUNK_MAGIC:
+            raise JfrFormatError(f"No chunk magic at offset {start}")
+        (self.major, self.minor, self.size, self.constant_pool_offset, self.metadata_offset,
+         self.start_nanos, self.duration_nanos, self.start_ticks,
+         self.ticks_per_second) = struct.unpack_from('>HHqqqqqqq', buf, start + 4)
+        self.start = start
+        self.compressed = bool(buf[start + 67] & 1)
+
+    def epoch_seconds(self, ticks):
+        return (self.start_nanos + (ticks - self.start_ticks) * 1e9 / self.ticks_per_second) / 1e9
+
+    def millis(self, ticks):
+        return ticks * 1000 / self.ticks_per_second
+
+
+class JfrType:
+    __slots__ = ('id', 'name', 'super_type', 'fields', 'reader')
+
+    def __init__(self, type_id, name, super_type):
+        self.id = type_id
+        self.name = name
+        self.super_type = super_type
+        # (name, type id, constant pool ref, array)
+        self.fields = []
+        self.reader = None
+
+
+def _read_element(inp, strings):
+    name = strings[inp.int()]
+    attributes = {}
+    for _ in range(inp.int()):
+        key = strings[inp.int()]
+        attributes[key] = strings[inp.int()]
+    children = [_read_element(inp, strings) for _ in range(inp.int())]
+    return name, attributes, children
+
+
+# One chunk of a recording: its type metadata, constant pools and a way to
+# walk its events. Everything here is dropped once the chunk is processed.
+class JfrChunk:
+    def __init__(self, buf, header):
+        self.buf = buf
+        self.header = header
+        self.types = {}
+        self.types_by_name = {}
+        self.pools = defaultdict(dict)
+        self._classes = {}
+        self._threads = {}
+        self._stacks = {}
+        self._read_metadata()
+        self._build_readers()
+        self._read_constant_pools()
+
+    def _input(self, pos):
+        return JfrInput(self.buf, pos, self.header.compressed)
+
+    def _read_metadata(self):
+        inp = self._input(self.header.start + self.header.metadata_offset)
+        inp.int()  # size
+        if inp.long() != METADATA_EVENT:
+            raise JfrFormatError("Metadata offset does not point at a metadata event")
+        inp.long()  # start time
+        inp.long()  # duration
+        inp.long()  # metadata id
+        strings = [inp.string() for _ in range(inp.int())]
+        _, _, children = _read_element(inp, strings)
+
+        for name, _, classes in children:
+            if name != 'metadata':
+                continue
+            for element, attributes, class_children in classes:
+                if element != 'class':
+                    continue
+                jfr_type = JfrType(int(attributes['id']), attributes['name'], attributes.get('superType'))
+                for field_element, field, _ in class_children:
+                    if field_element == 'field':
+                        jfr_type.fields.append((field['name'], int(field['class']),
+                                                field.get('constantPool') == 'true',
+                                                field.get('dimension') == '1'))
+                self.types[jfr_type.id] = jfr_type
+                self.types_by_name[jfr_type.name] = jfr_type
+
+    def _build_readers(self):
+        string_type = self.types_by_name.get('java.lang.String')
+        string_id = string_type.id if string_type else None
+        primitives = {
+            'boolean': lambda inp: inp.byte() != 0,
+            'byte': lambda inp: (inp.byte() ^ 0x80) - 0x80,
+            'char': JfrInput.char,
+            'short': JfrInput.short,
+            'int': JfrInput.int,
+            'long': JfrInput.long,
+            'float': JfrInput.float,
+            'double': JfrInput.double,
+            'java.lang.String': lambda inp: inp.string(string_id)
+        }
+        for jfr_type in self.types.values():
+            if jfr_type.name in primitives:
+                jfr_type.reader = primitives[jfr_type.name]
+        for jfr_type in self.types.values():
+            if jfr_type.reader is None:
+                jfr_type.reader = self._flat_reader(jfr_type) or self._struct_reader(jfr_type)
+
+    def _flat_reader(self, jfr_type):
+        # Events are mostly longs and pool references; with compressed
+        # integers those are all varints, decoded here in one inline loop
+        # instead of a method call per field
+        if not self.header.compressed or not jfr_type.fields:
+            return None
+        plan = []
+        for name, type_id, pooled, is_array in jfr_type.fields:
+            bits = None if pooled else VARINT_BITS.get(self.types[type_id].name)
+            if is_array or (not pooled and bits is None):
+                return None
+            plan.append((name, type_id, bits or 64, pooled))
+
+        def read(inp):
+            buf = inp.buf
+            pos = inp.pos
+            value = {}
+            for name, type_id, bits, pooled in plan:
+                result = 0
+                shift = 0
+                while True:
+                    b = buf[pos]
+                    pos += 1
+                    if shift == 56:
+                        result |= b << 56
+                        break
+                    result |= (b & 0x7f) << shift
+                    if b < 0x80:
+                        break
+                    shift += 7
+                result &= (1 << bits) - 1
+                if result >= 1 << (bits - 1):
+                    result -= 1 << bits
+                value[name] = PoolRef(type_id, result) if pooled else result
+            inp.pos = pos
+            return value
+
+        return read
+
+    def _struct_reader(self, jfr_type):
+        types = self.types
+
+        def read(inp):
+            value = {}
+            for name, type_id, pooled, is_array in jfr_type.fields:
+                if is_array:
+                    value[name] = [read_field(inp, type_id, pooled) for _ in range(inp.int())]
+                else:
+                    value[name] = read_field(inp, type_id, pooled)
+            return value
+
+        def read_field(inp, type_id, pooled):
+            if pooled:
+                return PoolRef(type_id, inp.long())
+            return types[type_id].reader(inp)
+
+        return read
+
+    def _read_constant_pools(self):
+        # Pools are chained backwards from the header's offset by relative deltas
+        position = self.header.start + self.header.constant_pool_offset
+        while True:
+            inp = self._input(position)
+            inp.int()  # size
+            if inp.long() != CONSTANT_POOL_EVENT:
+                raise JfrFormatError(f"Expected a constant pool event at {position}")
+            inp.long()  # start time
+            inp.long()  # duration
+            delta = inp.long()
+            inp.byte()  # flush
+            for _ in range(inp.int()):
+                jfr_type = self.types[inp.long()]
+                pool = self.pools[jfr_type.id]
+                for _ in range(inp.int()):
+                    key = inp.long()
+                    pool[key] = jfr_type.reader(inp)
+            if delta == 0:
+                break
+            position += delta
+
+    def resolve(self, value):
+        if isinstance(value, PoolRef):
+            return self.pools[value[0]].get(value[1])
+        return value
+
+    def symbol(self, ref):
+        value = self.resolve(ref)
+        if isinstance(value, dict):
+            value = self.resolve(value.get('string'))
+        return value
+
+    def class_name(self, ref):
+        if ref not in self._classes:
+            cls = self.resolve(ref)
+            self._classes[ref] = (self.symbol(cls.get('name')) or '').replace('/', '.') if cls else None
+        return self._classes[ref]
+
+    def thread(self, ref):
+        # (name, thread id), the id being '#<java thread id>' as jstack and JMX
+        # threads have it, or the name for a thread without one
+        if ref not in self._threads:
+            thread = self.resolve(ref)
+            if thread:
+                name = self.resolve(thread.get('javaName')) or self.resolve(thread.get('osName'))
+                java_id = thread.get('javaThreadId')
+                self._threads[ref] = (name, f'#{java_id}' if java_id else name)
+            else:
+                self._threads[ref] = None
+        return self._threads[ref]
+
+    def stack(self, ref):
+        if ref not in self._stacks:
+            frames = []
+            for frame in (self.resolve(ref) or {}).get('frames', []):
+                method = self.resolve(frame.get('method')) or {}
+                cls = self.class_name(method.get('type')) or '?'
+                name = self.symbol(method.get('name')) or '?'
+                line = frame.get('lineNumber', -1)
+                if line > 0:
+                    location = f'line {line}'
+                elif (self.resolve(frame.get('type')) or {}).get('description') == 'Native':
+                    location = 'Native Method'
+                else:
+                    location = 'Unknown Source'
+                frames.append(f"{cls}.{name}({location})")
+            self._stacks[ref] = frames
+        return self._stacks[ref]
+
+    def event_columns(self, wanted):
+        # (type, {field: int64 array}) per type in `wanted`, pool references
+        # as their keys. Only the size and type prefixes are walked event by
+        # event; fields are then decoded column by column for all events of a
+        # type. Types with other than varint fields fall back to the reader.
+        wanted_ids = {t.id: t for name, t in self.types_by_name.items() if name in wanted}
+        start = self.header.start
+        data = self.buf[start:start + self.header.size]
+        positions = {type_id: [] for type_id in wanted_ids}
+        position = HEADER_SIZE
+        end = len(data)
+        compressed = self.header.compressed
+        while position < end:
+            if not compressed:
+                inp = JfrInput(data, position, False)
+                size = inp.int()
+                if size <= 0:
+                    raise JfrFormatError(f"Invalid event size {size} at {start + position}")
+                type_id = JfrInput(data, inp.pos, False).long()
+                if type_id in positions:
+                    positions[type_id].append(inp.pos)
+                position += size
+                continue
+            # Size then type id, both varints; HotSpot pads sizes to 4 bytes
+            size = 0
+            shift = 0
+            pos = position
+            while True:
+                b = data[pos]
+                pos += 1
+                size |= (b & 0x7f) << shift
+                if b < 0x80:
+                    break
+                shift += 7
+            if size <= 0 or shift > 56:
+                raise JfrFormatError(f"Invalid event size {size} at {start + position}")
+            b = data[pos]
+            if b < 0x80:
+                type_id = b
+            elif data[pos + 1] < 0x80:
+                type_id = (b & 0x7f) | data[pos + 1] << 7
+            else:
+                type_id = JfrInput(data, pos).long()
+            if type_id in positions:
+                positions[type_id].append(pos)
+            position += size
+
+        for type_id, starts in positions.items():
+            if starts:
+                yield wanted_ids[type_id], self._decode_columns(wanted_ids[type_id], data, starts)
+
+    def _decode_columns(self, jfr_type, data, starts):
+        fields = []
+        for name, type_id, pooled, is_array in jfr_type.fields:
+            bits = 64 if pooled else VARINT_BITS.get(self.types[type_id].name)
+            if is_array or bits is None or not self.header.compressed:
+                return self._read_columns(jfr_type, data, starts)
+            fields.append((name, bits))
+
+        data = np.frombuffer(data + bytes(8), dtype=np.uint8)
+        columns = {name: np.empty(len(starts), dtype=np.int64) for name, _ in fields}
+        for first in range(0, len(starts), BATCH_EVENTS):
+            positions = np.array(starts[first:first + BATCH_EVENTS], dtype=np.int64)
+            # Skip the type id, then read every field in order
+            positions = decode_varints(data, positions)[1]
+            for name, bits in fields:
+                values, positions = decode_varints(data, positions)
+                if bits < 64:
+                    values = (values & np.uint64((1 << bits) - 1)).astype(np.int64)
+                    values[values >= 1 << (bits - 1)] -= 1 << bits
+                columns[name][first:first + len(values)] = values.view(np.int64)
+        return columns
+
+    def _read_columns(self, jfr_type, data, starts):
+        inp = JfrInput(data, 0, self.header.compressed)
+        events = []
+        for pos in starts:
+            inp.pos = pos
+            inp.long()  # type id
+            events.append(jfr_type.reader(inp))
+        columns = {}
+        for name, _, pooled, is_array in jfr_type.fields:
+            values = [event[name] for event in events]
+            if pooled and not is_array:
+                columns[name] = np.array([value[1] for value in values], dtype=np.int64)
+            elif not is_array and all(isinstance(value, int) for value in values):
+                columns[name] = np.array(values, dtype=np.int64)
+        return columns
+
+    def lookup(self, jfr_type, columns, count, field, resolve):
+        # (distinct resolved values, index into them per event) of a pool
+        # reference column; every value is resolved once however many events
+        # share it. A missing field resolves to None for every event.
+        type_ids = {name: type_id for name, type_id, _, _ in jfr_type.fields}
+        if field not in columns:
+            return [None], np.zeros(count, dtype=np.intp)
+        uniques, codes = np.unique(columns[field], return_inverse=True)
+        return [resolve(PoolRef(type_ids[field], int(key))) for key in uniques], codes.reshape(-1)
+
+
+def iter_chunks(path):
+    # Memory-maps the recording and yields one JfrChunk at a time. A trailing
+    # chunk that is still being written (size 0 or past EOF) is ignored.
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            position = 0
+            while position + HEADER_SIZE <= len(buf):
+                header = ChunkHeader(buf, position)
+                if header.size <= 0 or position + header.size > len(buf):
+                    break
+                yield JfrChunk(buf, header)
+                position += header.size
+
+
+def iter_lock_batches(path):
+    # One batch per chunk and event type: numpy columns for the numbers and
+    # (distinct values, per-event index) pairs for thread, class and stack;
+    # threads and owners are (name, thread id) pairs, see JfrChunk.thread
+    for chunk in iter_chunks(path):
+        header = chunk.header
+        for jfr_type, columns in chunk.event_columns(LOCK_EVENTS):
+            class_field, owner_field = LOCK_EVENTS[jfr_type.name]
+            count = len(columns['startTime'])
+            yield {
+                'event': jfr_type.name,
+                'timestamp': (header.start_nanos + (columns['startTime'] - header.start_ticks) * 1e9
+                              / header.ticks_per_second) / 1e9,
+                'wait_time': columns['duration'] * 1000 / header.ticks_per_second,
+                'address': columns.get('address', np.zeros(count, dtype=np.int64)).view(np.uint64),
+                'thread': chunk.lookup(jfr_type, columns, count, 'eventThread', chunk.thread),
+                'lock_class': chunk.lookup(jfr_type, columns, count, class_field, chunk.class_name),
+                'owner': chunk.lookup(jfr_type, columns, count, owner_field, chunk.thread),
+                'stack': chunk.lookup(jfr_type, columns, count, 'stackTrace', chunk.stack)
+            }
+
+
+def lock_id(address):
+    # Formatted like jstack's <0x...>
+    return f"0x{address:016x}"
+
+
+def iter_lock_events(path):
+    # One dict per contended monitor enter / park
+    for batch in iter_lock_batches(path):
+        categories = [(key, batch[key][0], batch[key][1].tolist())
+                      for key in ('thread', 'lock_class', 'owner', 'stack')]
+        for i, (timestamp, wait_time, address) in enumerate(zip(batch['timestamp'].tolist(),
+                                                                 batch['wait_time'].tolist(),
+                                                                 batch['address'].tolist())):
+            event = {'event': batch['event'], 'timestamp': timestamp, 'wait_time': wait_time,
+                     'lock_id': lock_id(address)}
+            for key, values, codes in categories:
+                event[key] = values[codes[i]]
+            # Named like the thread dump parser's lock entries
+            event['thread_name'], event['thread_id'] = event.pop('thread')
+            event['owner_thread'], event['owner_id'] = event.pop('owner') or (None, None)
+            yield event
+
+
+# Writes JFR lock events in the java_locks schema plus their wait time and
+# stack id, using the data directory's own dictionaries so rows join with the
+# sampled tables on thread, lock and stack ids, and keeps per-lock wait-time
+# distributions.
+# Batches from iter_lock_batches are added whole: every distinct thread,
+# lock and stack is interned once per batch and rows are mapped with numpy.
+class LockWaitRecorder:
+    def __init__(self, data_dir, output_config=None):
+        self.data_dir = data_dir
+        self.tables = JavaTables(data_dir)
+        self.sink = open_sink(f'{data_dir}/jfr_lock_waits', JFR_LOCK_COLUMNS, output_config,
+                              'diidii', datetime_column=False, before_flush=self.tables.flush)
+        self.wait_times = defaultdict(lambda: array('d'))
+        self.owners = defaultdict(Counter)
+        self.locks = {}
+        self.events = 0
+
+    def add_batch(self, batch):
+        tables = self.tables
+        threads, thread_codes = batch['thread']
+        thread_ids = np.array([tables.thread(*(thread or (None,))) for thread in threads],
+                              dtype=np.int64)[thread_codes]
+        owners, owner_codes = batch['owner']
+        owner_ids = np.array([tables.thread(*(owner or (None,))) for owner in owners], dtype=np.int64)[owner_codes]
+        stacks, stack_codes = batch['stack']
+        stack_ids = np.array([tables.stacks.intern(stack) for stack in stacks], dtype=np.int64)[stack_codes]
+
+        # A lock is an address and a class; intern each distinct pair once
+        classes, class_codes = batch['lock_class']
+        addresses, address_codes = np.unique(batch['address'], return_inverse=True)
+        pairs, lock_codes = np.unique(address_codes.reshape(-1) * len(classes) + class_codes, return_inverse=True)
+        lock_codes = lock_codes.reshape(-1)
+        lock_ids = []
+        for pair in pairs.tolist():
+            address = int(addresses[pair // len(classes)])
+            lock_class = classes[pair % len(classes)]
+            lock = tables.locks.intern(lock_id(address), lock_class or '')
+            self.locks[lock] = (lock_id(address), lock_class)
+            lock_ids.append(lock)
+
+        wait_time = batch['wait_time']
+        order = np.argsort(lock_codes, kind='stable')
+        bounds = np.flatnonzero(np.diff(lock_codes[order])) + 1
+        for group in np.split(order, bounds):
+            self.wait_times[lock_ids[lock_codes[group[0]]]].frombytes(wait_time[group].tobytes())
+
+        pairs, counts = np.unique(lock_codes * len(owners) + owner_codes, return_counts=True)
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            owner = owners[pair % len(owners)]
+            if owner is not None:
+                self.owners[lock_ids[pair // len(owners)]][owner[0]] += count
+
+        self.sink.write_many(zip(batch['timestamp'].tolist(), thread_ids.tolist(),
+                                 np.array(lock_ids, dtype=np.int64)[lock_codes].tolist(), wait_time.tolist(),
+                                 owner_ids.tolist(), stack_ids.tolist()))
+        self.events += len(wait_time)
+
+    def summary(self):
+        rows = []
+        for lock, wait_times in self.wait_times.items():
+            values = np.frombuffer(wait_times, dtype=np.float64)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            owners = self.owners[lock].most_common(1)
+            address, lock_class = self.locks[lock]
+            rows.append([lock, address, lock_class, len(values)]
+                        + [round(float(v), 3) for v in (values.sum(), values.mean(), p50, p90, p99, values.max())]
+                        + [owners[0][0] if owners else None])
+        rows.sort(key=lambda row: row[4], reverse=True)
+        return rows
+
+    def close(self):
+        self.sink.close()
+        with open(f'{self.data_dir}/jfr_lock_wait_summary.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(JFR_SUMMARY_COLUMNS)
+            writer.writerows(self.summary())
+        self.tables.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract lock wait times from a JFR recording')
+    parser.add_argument('--jfr', required=True, help='Recording, e.g. lock_profile.jfr from async-profiler')
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--top', type=int, default=10, help='Print this many most contended locks')
+    args = parser.parse_args()
+
+    # Same format, flushing and rotation as the collector's tables next to it
+    from src.system_metrics_collector import load_config
+    recorder = LockWaitRecorder(args.data_dir, load_config().get('output'))
+    for batch in iter_lock_batches(args.jfr):
+        recorder.add_batch(batch)
+    summary = recorder.summary()
+    recorder.close()
+
+    print(f"{recorder.events} lock events on {len(summary)} locks")
+    for row in summary[:args.top]:
+        print(f"{row[1]} {row[2]}: {row[3]} waits, total {row[4]:.1f} ms, p99 {row[8]:.2f} ms, owner {row[10]}")
+
+
+if __name__ == "__main__":
+    main()
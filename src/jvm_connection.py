@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import subprocess
+import threading
+
+try:
+    import jpype
+except ImportError:
+    jpype = None
+
+
+# One long-lived JMX session to the target JVM. The embedded JVM (JPype) uses
+# the Attach API once to start the target's local management agent, then every
+# sample is a ThreadMXBean/GarbageCollectorMXBean call over that connection
+# instead of forking jstack/jstat.
+class JmxConnection:
+    def __init__(self, pid):
+        if jpype is None:
+            raise RuntimeError("jpype is not installed")
+        if not jpype.isJVMStarted():
+            jpype.startJVM(convertStrings=False)
+
+        VirtualMachine = jpype.JClass('com.sun.tools.attach.VirtualMachine')
+        JMXServiceURL = jpype.JClass('javax.management.remote.JMXServiceURL')
+        JMXConnectorFactory = jpype.JClass('javax.management.remote.JMXConnectorFactory')
+        ManagementFactory = jpype.JClass('java.lang.management.ManagementFactory')
+
+        vm = VirtualMachine.attach(str(pid))
+        try:
+            url = vm.startLocalManagementAgent()
+        finally:
+            vm.detach()
+
+        self.connector = JMXConnectorFactory.connect(JMXServiceURL(url))
+        server = self.connector.getMBeanServerConnection()
+
+        self.thread_bean = ManagementFactory.newPlatformMXBeanProxy(
+            server, ManagementFactory.THREAD_MXBEAN_NAME,
+            jpype.JClass('java.lang.management.ThreadMXBean'))
+        if self.thread_bean.isThreadContentionMonitoringSupported():
+            # Needed for blocked/waited times, otherwise they read as -1
+            self.thread_bean.setThreadContentionMonitoringEnabled(True)
+
+        self.gc_beans = list(ManagementFactory.getPlatformMXBeans(
+            server, jpype.JClass('java.lang.management.GarbageCollectorMXBean')))
+        self.pool_beans = list(ManagementFactory.getPlatformMXBeans(
+            server, jpype.JClass('java.lang.management.MemoryPoolMXBean')))
+
+    def thread_info(self):
+        # Same shape as JavaLockMetricsCollector.parse_thread_dump
+        threads_info = []
+        lock_info = []
+
+        for info in self.thread_bean.dumpAllThreads(True, True):
+            if info is None:
+                continue
+            name = str(info.getThreadName())
+            state = str(info.getThreadState())
+            thread_id = f'#{int(info.getThreadId())}'
+            threads_info.append({
+                'thread_id': thread_id,
+                'name': name,
+                'state': state,
+                'waited_count': int(info.getWaitedCount()),
+                'blocked_count': int(info.getBlockedCount()),
+                'blocked_time': max(int(info.getBlockedTime()), 0),
+                'stack': [str(frame) for frame in info.getStackTrace()]
+            })
+
+            lock = info.getLockInfo()
+            if lock is not None:
+                owner = info.getLockOwnerName()
+                lock_info.append({
+                    'thread_id': thread_id,
+                    'thread_name': name,
+                    'lock_id': f'0x{int(lock.getIdentityHashCode()):08x}',
+                    'lock_class': str(lock.getClassName()),
+                    'owner_id': f'#{int(info.getLockOwnerId())}' if owner is not None else None,
+                    'owner_thread': str(owner) if owner is not None else None,
+                    'blocking': state == 'BLOCKED' or owner is not None
+                })
+
+        return threads_info, lock_info
+
+    def gc_info(self):
+        # Same keys and units as `jstat -gc`: GCT in seconds, pool usage in KB
+        gc_time = sum(max(int(bean.getCollectionTime()), 0) for bean in self.gc_beans)
+        gc_data = {'GCT': gc_time / 1000}
+
+        for pool in self.pool_beans:
+            name = str(pool.getName())
+            used = int(pool.getUsage().getUsed()) / 1024
+            if 'Eden' in name:
+                gc_data['EU'] = used
+            elif 'Old' in name or 'Tenured' in name:
+                gc_data['OU'] = used
+
+        return gc_data
+
+    def close(self):
+        try:
+            self.connector.close()
+        except Exception as e:
+            print(f"Error closing JMX connection: {e}")
+
+
+# A single `jstat -gc <pid> <interval>` process kept running for the whole
+# collection; a reader thread keeps the most recent line parsed, as floats
+# like JmxConnection.gc_info. Columns printed as '-' (a collector the JVM
+# does not use) are left out.
+class JstatStream:
+    def __init__(self, pid, interval):
+        self.process = subprocess.Popen(
+            ['jstat', '-gc', str(pid), f'{max(int(interval * 1000), 1)}ms'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.headers = None
+        self.latest = None
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._read, name='jstat')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            values = line.split()
+            if not values:
+                continue
+            if self.headers is None or values[0] == self.headers[0]:
+                self.headers = values
+                continue
+            latest = {}
+            for header, value in zip(self.headers, values):
+                try:
+                    latest[header] = float(value)
+                except ValueError:
+                    pass
+            with self.lock:
+                self.latest = latest
+
+    def gc_info(self):
+        with self.lock:
+            latest, self.latest = self.latest, None
+        if latest is None and self.process.poll() is not None:
+            raise RuntimeError(f"jstat exited with status {self.process.returncode}")
+        return latest
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import base64
+import io
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from src.gc_log import LogTailer
+from src.ring_buffer import RingBuffer
+from src.sinks import SEGMENT_NAME, read_binary_header, binary_dtype, segment_order
+
+# (metric, title, y label, [(column, label)], plotted as per-second rate, divisor)
+PANELS = [
+    ('cpu', 'CPU Utilization', 'Percentage',
+     [('cpu_percent', 'CPU %'), ('user', 'User %'), ('system', 'System %'), ('iowait', 'IO Wait %')], False, 1),
+    ('memory', 'Memory Usage (GB)', 'GB',
+     [('used', 'Used'), ('cached', 'Cached'), ('buffers', 'Buffers')], False, 1024 ** 3),
+    ('io', 'Disk I/O', 'MB/s',
+     [('read_bytes', 'Read MB/s'), ('write_bytes', 'Write MB/s')], True, 1024 * 1024),
+    ('network', 'Network I/O', 'MB/s',
+     [('bytes_sent', 'Sent MB/s'), ('bytes_recv', 'Received MB/s')], True, 1024 * 1024)
+]
+
+
+# Rows appended to a CSV table since the last read
+class _CsvTail:
+    def __init__(self, path, columns, backlog_rows=None):
+        with open(path, 'rb') as f:
+            header = f.readline().decode().rstrip('\r\n').split(',')
+            row = f.readline()
+        self.indices = [header.index(column) for column in columns]
+        self.header = header[0]
+        # Bytes of backlog_rows rows, judged by the first row with some headroom
+        from_end = backlog_rows * len(row) * 3 // 2 if backlog_rows else None
+        self.tailer = LogTailer(path, from_end=from_end)
+
+    def read(self):
+        rows = [line.split(',') for line in self.tailer.read_lines() if not line.startswith(self.header)]
+        return np.array([[float(row[i]) for i in self.indices] for row in rows], dtype=np.float64).reshape(
+            len(rows), len(self.indices))
+
+    def close(self):
+        self.tailer.close()
+
+
+# Whole records appended to a binary table since the last read
+class _BinaryTail:
+    def __init__(self, path, columns, backlog_rows=None):
+        names, types, header_bytes = read_binary_header(path)
+        self.dtype = binary_dtype(names, types)
+        self.columns = columns
+        self.fd = os.open(path, os.O_RDONLY)
+        records = (os.fstat(self.fd).st_size - header_bytes) // self.dtype.itemsize
+        skip = max(records - backlog_rows, 0) if backlog_rows else 0
+        self.offset = header_bytes + skip * self.dtype.itemsize
+
+    def read(self):
+        count = (os.fstat(self.fd).st_size - self.offset) // self.dtype.itemsize
+        data = os.pread(self.fd, count * self.dtype.itemsize, self.offset)
+        self.offset += len(data)
+        records = np.frombuffer(data, dtype=self.dtype)
+        return np.column_stack([records[column].astype(np.float64) for column in self.columns]).reshape(
+            len(records), len(self.columns))
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Follows the file a table is currently written to: <table>.csv/.bin, or the
+# newest open segment of a rotated <table>/ directory. When the collector
+# moves on to a new segment, the rest of the old one is read first.
+class TableTail:
+    def __init__(self, data_dir, table, columns, backlog_rows):
+        self.base = f'{data_dir}/{table}'
+        self.columns = list(columns)
+        self.backlog_rows = backlog_rows
+        self.path = None
+        self.reader = None
+
+    def current_path(self):
+        for ext in ('.csv', '.bin'):
+            if os.path.isfile(f'{self.base}{ext}'):
+                return f'{self.base}{ext}'
+        if os.path.isdir(self.base):
+            open_segments = [name for name in os.listdir(self.base)
+                             if SEGMENT_NAME.match(name) and not name.endswith('.gz')]
+            if open_segments:
+                return f'{self.base}/{max(open_segments, key=segment_order)}'
+        return None
+
+    def read(self):
+        parts = []
+        path = self.current_path()
+        if path != self.path:
+            if self.reader:
+                parts.append(self.reader.read())
+                self.reader.close()
+                self.reader = None
+            # Only the first file opened starts from the backlog
+            backlog_rows = self.backlog_rows if self.path is None else None
+            self.path = path
+            if path:
+                reader = _BinaryTail if path.endswith('.bin') else _CsvTail
+                self.reader = reader(path, self.columns, backlog_rows)
+        if self.reader:
+            parts.append(self.reader.read())
+        if not parts:
+            return np.empty((0, len(self.columns)))
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def close(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+
+# Live view of the last `window` seconds of the system tables. Each refresh
+# reads only the rows appended since the previous one into fixed-size ring
+# buffers, and the x axis is "seconds ago", so axes stay put and only the
+# lines are redrawn (blitted over a cached background). The background is
+# redrawn when a y range has to grow or shrink. The cost of a refresh depends
+# on the window, not on how long the collector has been running.
+#
+# On a non-interactive backend (no display), the rendered buffer is written
+# to `snapshot` every snapshot_interval seconds: a PNG, or an HTML page that
+# embeds it and reloads itself.
+class LiveDashboard:
+    def __init__(self, data_dir, window=600, interval=1, refresh=1, snapshot=None, snapshot_interval=10):
+        self.data_dir = data_dir
+        self.window = window
+        self.refresh_interval = refresh
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        capacity = int(window / interval) + 2
+
+        self.panels = []
+        for metric, _, _, series, rate, scale in PANELS:
+            columns = ['timestamp'] + [column for column, _ in series]
+            self.panels.append({
+                'metric': metric,
+                'rate': rate,
+                'scale': scale,
+                'tail': TableTail(data_dir, f'{metric}_metrics', columns, capacity),
+                'ring': RingBuffer(capacity, len(columns))
+            })
+
+        self.fig, axes = plt.subplots(len(PANELS), 1, figsize=(15, 20))
+        self.status = self.fig.suptitle('System Metrics (live)', animated=True)
+        for panel, ax, (_, title, ylabel, series, _, _) in zip(self.panels, axes, PANELS):
+            panel['ax'] = ax
+            panel['lines'] = [ax.plot([], [], label=label, animated=True)[0] for _, label in series]
+            ax.set_xlim(-window, 0)
+            ax.set_ylim(0, 1)
+            ax.set_title(title)
+            ax.set_ylabel(ylabel)
+            ax.set_xlabel('Seconds ago')
+            ax.legend(handles=panel['lines'], loc='upper left')
+        self.fig.tight_layout(rect=(0, 0, 1, 0.98))
+
+        self.interactive = getattr(self.fig.canvas, 'required_interactive_framework', None) is not None
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.last_snapshot = None
+        self.refreshes = 0
+        self.refresh_time = 0.0
+
+    def on_draw(self, event):
+        # Every full draw (first show, resize, y range change) renews the
+        # background the lines are blitted onto
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        self.fig.draw_artist(self.status)
+        for panel in self.panels:
+            for line in panel['lines']:
+                panel['ax'].draw_artist(line)
+
+    def update(self):
+        latest = None
+        for panel in self.panels:
+            rows = panel['tail'].read()
+            if len(rows):
+                panel['ring'].extend(rows)
+            if panel['ring'].count:
+                last = panel['ring'].view()[-1, 0]
+                latest = last if latest is None else max(latest, last)
+        if latest is None:
+            return False
+
+        rescale = self.background is None
+        for panel in self.panels:
+            data = panel['ring'].view()
+            x = data[:, 0] - latest
+            values = data[:, 1:]
+            if panel['rate']:
+                values = np.diff(values, axis=0) / np.diff(data[:, 0])[:, None]
+                x = x[1:]
+            values = values / panel['scale']
+            visible = values[x >= -self.window]
+            for i, line in enumerate(panel['lines']):
+                line.set_data(x, values[:, i])
+
+            if len(visible) and not np.isnan(visible).all():
+                low, high = min(np.nanmin(visible), 0), np.nanmax(visible)
+                bottom, top = panel['ax'].get_ylim()
+                # Grow with headroom, shrink once the data uses under a quarter
+                if high > top or low < bottom or (top > 1 and high < top / 4):
+                    panel['ax'].set_ylim(low * 1.2, max(high * 1.2, 1))
+                    rescale = True
+
+        self.status.set_text(f"System Metrics (live) - last sample {datetime.fromtimestamp(latest):%Y-%m-%d %H:%M:%S}")
+        canvas = self.fig.canvas
+        if rescale:
+            # Redraws the background (and the lines) through on_draw
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.draw_lines()
+            canvas.blit(self.fig.bbox)
+        return True
+
+    def write_snapshot(self):
+        buffer = np.asarray(self.fig.canvas.buffer_rgba())
+        png = io.BytesIO()
+        plt.imsave(png, buffer, format='png')
+        data = png.getvalue()
+        if self.snapshot.endswith('.html'):
+            refresh = max(int(self.snapshot_interval), 1)
+            data = (f'<!DOCTYPE html>\n<html><head><meta http-equiv="refresh" content="{refresh}">'
+                    f'<title>System Metrics</title></head>\n<body><p>Updated {datetime.now():%Y-%m-%d %H:%M:%S}</p>'
+                    f'<img src="data:image/png;base64,{base64.b64encode(data).decode()}"></body></html>\n').encode()
+        with open(f'{self.snapshot}.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(f'{self.snapshot}.tmp', self.snapshot)
+
+    def run(self, duration=0):
+        if self.interactive:
+            plt.show(block=False)
+        else:
+            self.fig.canvas.draw()
+        started = time.monotonic()
+        next_refresh = started
+        try:
+            while not duration or time.monotonic() - started < duration:
+                if self.interactive and not plt.fignum_exists(self.fig.number):
+                    break
+                begin = time.perf_counter()
+                if self.update():
+                    self.refreshes += 1
+                    self.refresh_time += time.perf_counter() - begin
+                now = time.monotonic()
+                if self.snapshot and (self.last_snapshot is None
+                                      or now - self.last_snapshot >= self.snapshot_interval):
+                    self.last_snapshot = now
+                    self.write_snapshot()
+                if self.interactive:
+                    self.fig.canvas.flush_events()
+                next_refresh += self.refresh_interval
+                time.sleep(max(next_refresh - time.monotonic(), 0))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for panel in self.panels:
+                panel['tail'].close()
+        if self.refreshes:
+            print(f"{self.refreshes} refreshes, {self.refresh_time / self.refreshes * 1000:.1f} ms on average")
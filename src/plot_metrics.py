@@ -1,46 +1,123 @@
-def plot_lock_metrics(self, ax):
-    df = self.metrics['locks']
-
-    # Group by lock_address and calculate wait time statistics
-    lock_stats = df.groupby('lock_address').agg({
-        'wait_time': ['mean', 'max', 'count']
-    }).reset_index()
-
-    # Plot top 10 contended locks
-    top_locks = lock_stats.nlargest(10, ('wait_time', 'mean'))
-
-    bars = ax.bar(range(len(top_locks)), top_locks[('wait_time', 'mean')])
-    ax.set_xticks(range(len(top_locks)))
-    ax.set_xticklabels(top_locks['lock_address'], rotation=45)
-    ax.set_title('Top 10 Contended Locks')
-    ax.set_ylabel('Average Wait Time (ms)')
-
-    # Add contention count annotations
-    for i, bar in enumerate(bars):
-        ax.text(
-            bar.get_x() + bar.get_width()/2,
-            bar.get_height(),
-            f'Count: {int(top_locks.iloc[i][("wait_time", "count")])}',
-            ha='center',
-            va='bottom'
+#!/usr/bin/env python3
+
+import argparse
+import os
+
+import matplotlib.pyplot as plt
+
+from src.plot_system_metrices import MetricsAnalyzer
+from src.java_lock_metrics_collector import FILE_NAMES, COLUMNS, BINARY_TYPES
+from src.jfr_reader import JFR_LOCK_COLUMNS
+from src.stack_table import load_table, load_names
+from src.table_loader import table_dtypes
+from src.wallclock_profiler import parse_time
+
+
+def _names(data_dir, table, ids):
+    # ids (a Series) resolved through a JavaTables dictionary, -1 -> None
+    path = f'{data_dir}/{table}.csv'
+    names = load_names(data_dir, table) if os.path.exists(path) else {}
+    return ids.map(names)
+
+
+# The Java collector's tables with their dictionary ids resolved:
+# metrics['locks'] gains lock_address, lock_class and thread_name (wait times
+# come from jfr_lock_waits when a JFR recording was converted, java_locks only
+# has sampled waiters), metrics['threads'] gains state and thread_name.
+class JavaMetricsAnalyzer(MetricsAnalyzer):
+    def load_range(self, metric, start=None, end=None, columns=None):
+        if metric == 'locks':
+            df = self.load_table('jfr_lock_waits', start, end, columns, table_dtypes(JFR_LOCK_COLUMNS, 'diidii'))
+            if df is None:
+                df = self.load_table(FILE_NAMES['locks'], start, end, columns,
+                                     table_dtypes(COLUMNS['locks'], BINARY_TYPES['locks']))
+            if df is None:
+                return None
+            path = f'{self.data_dir}/java_lock_ids.csv'
+            locks = load_table(path) if os.path.exists(path) else {}
+            df['lock_address'] = df['lock_id'].map({i: values[0] for i, values in locks.items()})
+            df['lock_class'] = df['lock_id'].map({i: values[1] for i, values in locks.items()})
+            df['thread_name'] = _names(self.data_dir, 'java_thread_names', df['thread_id'])
+            return df
+        if metric == 'threads':
+            df = self.load_table(FILE_NAMES['threads'], start, end, columns,
+                                 table_dtypes(COLUMNS['threads'], BINARY_TYPES['threads']))
+            if df is None:
+                return None
+            df['state'] = _names(self.data_dir, 'java_states', df['state_id'])
+            df['thread_name'] = _names(self.data_dir, 'java_thread_names', df['thread_id'])
+            return df
+        return super().load_range(metric, start, end, columns)
+
+    def plot_lock_metrics(self, ax):
+        df = self.metrics['locks']
+
+        # Group by lock and calculate wait time statistics; without JFR wait
+        # times, rank locks by waiter samples
+        timed = 'wait_time' in df
+        stats = {'mean': ('wait_time', 'mean'), 'max': ('wait_time', 'max')} if timed else {}
+        lock_stats = df.groupby(['lock_address', 'lock_class']).agg(
+            **stats, count=('lock_id', 'count')
+        ).reset_index()
+
+        top_locks = lock_stats.nlargest(10, 'mean' if timed else 'count')
+
+        bars = ax.bar(range(len(top_locks)), top_locks['mean' if timed else 'count'])
+        ax.set_xticks(range(len(top_locks)))
+        ax.set_xticklabels([f'{cls.rsplit(".", 1)[-1]}@{address}' for address, cls
+                            in zip(top_locks['lock_address'], top_locks['lock_class'])], rotation=45, ha='right')
+        ax.set_title('Top 10 Contended Locks')
+        ax.set_ylabel('Average Wait Time (ms)' if timed else 'Waiting Thread Samples')
+
+        # Add contention count annotations
+        for bar, count in zip(bars, top_locks['count']):
+            ax.text(
+                bar.get_x() + bar.get_width() / 2,
+                bar.get_height(),
+                f'Count: {int(count)}',
+                ha='center',
+                va='bottom'
+            )
+
+    def plot_thread_states(self, ax):
+        df = self.metrics['threads']
+
+        # Calculate thread state distribution over time
+        thread_states = df.groupby(['datetime', 'state']).size().unstack(fill_value=0)
+
+        thread_states.plot(
+            kind='area',
+            stacked=True,
+            ax=ax
         )
+        ax.set_title('Thread States Over Time')
+        ax.set_ylabel('Thread Count')
+        ax.legend(title='Thread State')
+
+    def plot_java_metrics(self):
+        fig, axes = plt.subplots(2, 1, figsize=(15, 10))
+        fig.suptitle('Java Lock and Thread Metrics')
+
+        self.plot_lock_metrics(axes[0])
+        self.plot_thread_states(axes[1])
+
+        plt.tight_layout()
+        return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot Java lock and thread metrics')
+    parser.add_argument('--data-dir', default='metrics_data', help='Directory containing the Java tables')
+    parser.add_argument('--output', default='java_metrics.png', help='Output file name')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    args = parser.parse_args()
+
+    analyzer = JavaMetricsAnalyzer(args.data_dir, parse_time(args.start), parse_time(args.end))
+    analyzer.plot_java_metrics()
+    plt.savefig(args.output)
+    print(f"Plot saved as {args.output}")
+
 
-def plot_thread_states(self, ax):
-    df = self.metrics['threads']
-
-    # Calculate thread state distribution over time
-    thread_states = df.pivot_table(
-        index='datetime',
-        columns='state',
-        values='thread_id',
-        aggfunc='count'
-    ).fillna(0)
-
-    thread_states.plot(
-        kind='area',
-        stacked=True,
-        ax=ax
-    )
-    ax.set_title('Thread States Over Time')
-    ax.set_ylabel('Thread Count')
-    ax.legend(title='Thread State')
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,251 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import glob
 import os
+import re
 import argparse
 
+from src.sinks import read_device_series, find_segments
+from src.system_metrics_collector import COLUMNS, BINARY_TYPES, load_config
+from src.table_loader import TableLoader, table_dtypes
+from src.wallclock_profiler import parse_time
+from src.downsample import lttb, minmax_envelope, merge_rollup, rollup_columns, rollup_types, rollup_name
+from src.live_dashboard import LiveDashboard
+
+METRIC_TYPES = ['cpu', 'memory', 'io', 'network']
+# Raw rows (or rollup buckets) read per horizontal pixel before switching to a
+# coarser tier; everything read is reduced to one point per pixel for drawing
+POINTS_PER_PIXEL = 20
+
+
+def axes_points(ax):
+    # Width of the axes in pixels, the most points worth drawing across it
+    return max(int(ax.get_window_extent().width), 100)
+
+
+def plot_downsampled(ax, df, column, label, points, scale=1, envelope=None):
+    # LTTB line of `column`, shaded with the min/max envelope of the series
+    # (or of the envelope=(min column, max column) pair) so spikes dropped
+    # from the line stay visible
+    x = df['timestamp'].to_numpy()
+    dates = df['datetime'].to_numpy()
+    y = df[column].to_numpy(dtype=np.float64) / scale
+    selected = lttb(x, y, points)
+    line, = ax.plot(dates[selected], y[selected], label=label)
+
+    if envelope is None and len(y) <= points:
+        return
+    y_min, y_max = (y, y) if envelope is None else (df[envelope[0]].to_numpy(dtype=np.float64) / scale,
+                                                    df[envelope[1]].to_numpy(dtype=np.float64) / scale)
+    starts, low, high = minmax_envelope(np.arange(len(y)), y_min, points, y_max)
+    ax.fill_between(dates[starts], low, high, step='post', color=line.get_color(), alpha=0.2, linewidth=0)
+
+
+# Loads a metric table the first time it is looked up
+class LazyMetrics(dict):
+    def __init__(self, analyzer):
+        super().__init__()
+        self.analyzer = analyzer
+
+    def __missing__(self, metric):
+        df = self.analyzer.load_range(metric, self.analyzer.start, self.analyzer.end)
+        if df is None:
+            raise KeyError(metric)
+        self[metric] = df
+        return df
+
+    def __contains__(self, metric):
+        try:
+            self[metric]
+            return True
+        except KeyError:
+            return False
+
+
 class MetricsAnalyzer:
-    def __init__(self, data_dir):
+    # start/end (epoch seconds) restrict every table to [start, end). Tables
+    # are loaded on first use; parsed rows are cached under data_dir/.cache so
+    # reloading a growing directory only parses what was appended since.
+    def __init__(self, data_dir, start=None, end=None, cache=True):
         self.data_dir = data_dir
-        self.metrics = {}
-        self.load_data()
+        self.start = start
+        self.end = end
+        self.loader = TableLoader(f'{data_dir}/.cache' if cache else None)
+        self.metrics = LazyMetrics(self)
+        self.anomalies = None
 
     def load_data(self):
-        metric_types = ['cpu', 'memory', 'io', 'network']
+        # Drop loaded tables so the next lookup picks up newly written rows
+        self.metrics = LazyMetrics(self)
+        self.anomalies = None
+        for metric in METRIC_TYPES:
+            try:
+                self.metrics[metric]
+            except KeyError:
+                pass
+
+    def metric_files(self, metric, start=None, end=None):
+        # The table's single file(s) plus, when rotation is on, the segments
+        # overlapping the window; oldest first
+        return self.table_files(f"{metric}_metrics", start, end)
+
+    def table_files(self, table, start=None, end=None):
+        base = f"{self.data_dir}/{table}"
+        paths = [f'{base}{ext}' for ext in ('.csv', '.bin') if os.path.isfile(f'{base}{ext}')]
+        if os.path.isdir(base):
+            paths += find_segments(base, start, end)
+        return paths
+
+    def load_range(self, metric, start=None, end=None, columns=None):
+        # Rows with start <= timestamp < end, optionally only some columns
+        dtypes = table_dtypes(COLUMNS[metric], BINARY_TYPES[metric]) if metric in COLUMNS else None
+        return self.load_table(f"{metric}_metrics", start, end, columns, dtypes)
 
-        for metric in metric_types:
-            files = glob.glob(f"{self.data_dir}/{metric}_*.csv")
-            if files:
-                latest_file = max(files, key=os.path.getctime)
-                self.metrics[metric] = pd.read_csv(latest_file)
-                # Convert timestamp to datetime
-                self.metrics[metric]['datetime'] = pd.to_datetime(self.metrics[metric]['timestamp'], unit='s')
+    def load_table(self, table, start=None, end=None, columns=None, dtypes=None):
+        # Any table written through open_sink, by its file name without extension
+        paths = self.table_files(table, start, end)
+        if not paths:
+            return None
+        if columns is not None and 'timestamp' not in columns:
+            columns = ['timestamp'] + list(columns)
+        return self._load_files(paths, columns, dtypes, start, end)
+
+    def _load_files(self, paths, columns, dtypes, start, end):
+        frames = [self.loader.read(path, columns, dtypes) for path in paths]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        if len(frames) > 1 and not df['timestamp'].is_monotonic_increasing:
+            df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+
+        # Rows are in time order, so the window is a slice
+        timestamps = df['timestamp'].to_numpy()
+        first = timestamps.searchsorted(start) if start is not None else 0
+        last = timestamps.searchsorted(end) if end is not None else len(df)
+        df = df.iloc[first:last].reset_index(drop=True)
+        # Much faster than pd.to_datetime(unit='s') on float seconds
+        df['datetime'] = (df['timestamp'].to_numpy() * 1e9).astype('int64').astype('datetime64[ns]')
+        return df
+
+    def rollup_tiers(self, metric):
+        # Bucket sizes (seconds) with a rollup table for the metric, finest first
+        pattern = re.compile(rf'^{metric}_rollup_(\d+)s(\.csv|\.bin)?$')
+        return sorted({int(match.group(1)) for match in map(pattern.match, os.listdir(self.data_dir)) if match})
+
+    def load_rollup(self, metric, tier, start=None, end=None):
+        # Buckets of one tier overlapping [start, end), with <field>_mean columns
+        fields = COLUMNS[metric][1:]
+        if start is not None:
+            start = start // tier * tier
+        paths = self.table_files(rollup_name(metric, tier), start, end)
+        if not paths:
+            return None
+        dtypes = table_dtypes(rollup_columns(fields), rollup_types(fields))
+        return merge_rollup(self._load_files(paths, None, dtypes, start, end), fields)
+
+    def choose_tier(self, metric, points):
+        # None to read raw rows, else the finest tier with at most
+        # POINTS_PER_PIXEL buckets per pixel. The coarsest tier's counts give
+        # the number of raw rows in the window without reading them.
+        tiers = self.rollup_tiers(metric)
+        if not tiers:
+            return None
+        coarse = self.load_rollup(metric, tiers[-1], self.start, self.end)
+        budget = points * POINTS_PER_PIXEL
+        if coarse is None or coarse['count'].sum() <= budget:
+            return None
+        start = self.start if self.start is not None else coarse['timestamp'].iloc[0]
+        end = self.end if self.end is not None else coarse['timestamp'].iloc[-1] + tiers[-1]
+        for tier in tiers:
+            if (end - start) / tier <= budget:
+                return tier
+        return tiers[-1]
+
+    def load_series(self, metric, points):
+        # (frame, tier): raw rows while the window is small enough, rollup
+        # buckets (tier in seconds) for long ranges
+        tier = self.choose_tier(metric, points)
+        if tier is None:
+            return self.metrics[metric], None
+        return self.load_rollup(metric, tier, self.start, self.end), tier
+
+    def plot_fields(self, ax, metric, fields, scale=1):
+        points = axes_points(ax)
+        df, tier = self.load_series(metric, points)
+        for field, label in fields:
+            if tier is None:
+                plot_downsampled(ax, df, field, label, points, scale)
+            else:
+                plot_downsampled(ax, df, f'{field}_mean', label, points, scale,
+                                 (f'{field}_min', f'{field}_max'))
+        self.plot_anomalies(ax, metric)
+
+    def plot_rates(self, ax, metric, fields, scale=1):
+        # Counter columns as per-second rates. On a rollup tier the rate is
+        # the mean over each bucket: the change between bucket end values over
+        # the time the bucket's samples cover, so a partial bucket is not diluted
+        points = axes_points(ax)
+        df, tier = self.load_series(metric, points)
+        if tier is None:
+            elapsed = df['timestamp'].diff()
+        else:
+            elapsed = df['count'] * (tier / df['count'].median())
+        for field, label in fields:
+            counter = df[field] if tier is None else df[f'{field}_last']
+            df[f'{field}_rate'] = counter.diff() / elapsed
+            plot_downsampled(ax, df, f'{field}_rate', label, points, scale)
+        self.plot_anomalies(ax, metric)
+
+    def plot_anomalies(self, ax, metric):
+        # Events the collector's detector wrote for the metric's series:
+        # anomalies shaded over their span, level changes as dashed lines
+        if self.anomalies is None:
+            # Events can start before the window and end in it
+            self.anomalies = self.load_table('anomalies', None, self.end)
+            if self.anomalies is not None and self.start is not None:
+                self.anomalies = self.anomalies[self.anomalies['end'] >= self.start]
+        if self.anomalies is None:
+            return
+        events = self.anomalies[self.anomalies['series'].str.startswith(f'{metric}.')]
+        for start, end, kind in zip(events['timestamp'], events['end'], events['kind']):
+            start, end = pd.to_datetime([start, end], unit='s')
+            if kind == 'change':
+                ax.axvline(end, color='tab:orange', linestyle='--', linewidth=1)
+            else:
+                ax.axvspan(start, end + pd.Timedelta(seconds=1), color='tab:red', alpha=0.15, linewidth=0)
+
+    def load_device_metrics(self, kind, fields=None):
+        # Per-device series written by DeviceSink: returns (timestamps, devices,
+        # {field: (ticks, devices) array}) without going through pandas
+        base_dir = f"{self.data_dir}/{kind}_metrics"
+        if not os.path.isdir(base_dir):
+            return None
+        return read_device_series(base_dir, fields, self.start, self.end)
 
     def plot_cpu_metrics(self, ax):
-        df = self.metrics['cpu']
-        ax.plot(df['datetime'], df['cpu_percent'], label='CPU %')
-        ax.plot(df['datetime'], df['user'], label='User %')
-        ax.plot(df['datetime'], df['system'], label='System %')
-        ax.plot(df['datetime'], df['iowait'], label='IO Wait %')
+        self.plot_fields(ax, 'cpu', [('cpu_percent', 'CPU %'), ('user', 'User %'), ('system', 'System %'),
+                                     ('iowait', 'IO Wait %')])
         ax.set_title('CPU Utilization')
         ax.set_ylabel('Percentage')
         ax.legend()
 
     def plot_memory_metrics(self, ax):
-        df = self.metrics['memory']
-        # Convert to GB
-        for col in ['total', 'available', 'used', 'free', 'cached', 'buffers']:
-            df[f'{col}_gb'] = df[col] / (1024 ** 3)
-
-        ax.plot(df['datetime'], df['used_gb'], label='Used')
-        ax.plot(df['datetime'], df['cached_gb'], label='Cached')
-        ax.plot(df['datetime'], df['buffers_gb'], label='Buffers')
+        self.plot_fields(ax, 'memory', [('used', 'Used'), ('cached', 'Cached'), ('buffers', 'Buffers')],
+                         scale=1024 ** 3)
         ax.set_title('Memory Usage (GB)')
         ax.set_ylabel('GB')
         ax.legend()
 
     def plot_io_metrics(self, ax):
-        df = self.metrics['io']
-        # Calculate rates
-        df['read_mb_s'] = df['read_bytes'].diff() / (df['timestamp'].diff() * 1024 * 1024)
-        df['write_mb_s'] = df['write_bytes'].diff() / (df['timestamp'].diff() * 1024 * 1024)
-
-        ax.plot(df['datetime'], df['read_mb_s'], label='Read MB/s')
-        ax.plot(df['datetime'], df['write_mb_s'], label='Write MB/s')
+        self.plot_rates(ax, 'io', [('read_bytes', 'Read MB/s'), ('write_bytes', 'Write MB/s')],
+                        scale=1024 * 1024)
         ax.set_title('Disk I/O')
         ax.set_ylabel('MB/s')
         ax.legend()
 
     def plot_network_metrics(self, ax):
-        df = self.metrics['network']
-        # Calculate rates
-        df['sent_mb_s'] = df['bytes_sent'].diff() / (df['timestamp'].diff() * 1024 * 1024)
-        df['recv_mb_s'] = df['bytes_recv'].diff() / (df['timestamp'].diff() * 1024 * 1024)
-
-        ax.plot(df['datetime'], df['sent_mb_s'], label='Sent MB/s')
-        ax.plot(df['datetime'], df['recv_mb_s'], label='Received MB/s')
+        self.plot_rates(ax, 'network', [('bytes_sent', 'Sent MB/s'), ('bytes_recv', 'Received MB/s')],
+                        scale=1024 * 1024)
         ax.set_title('Network I/O')
         ax.set_ylabel('MB/s')
         ax.legend()
@@ -86,10 +266,31 @@ def main():
     parser = argparse.ArgumentParser(description='Plot system metrics')
     parser.add_argument('--data-dir', default='metrics_data', help='Directory containing metrics data')
     parser.add_argument('--output', default='system_metrics.png', help='Output file name')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+
+    parser.add_argument('--no-cache', action='store_true', help='Parse every file from scratch')
+
+    parser.add_argument('--live', action='store_true', help='Follow the collector and redraw as rows arrive')
+    parser.add_argument('--window', type=float, default=600, help='Seconds shown in live mode')
+    parser.add_argument('--refresh', type=float, default=1, help='Seconds between live refreshes')
+    parser.add_argument('--snapshot', help='PNG or .html file rewritten in live mode '
+                                           '(default: --output when there is no display)')
+    parser.add_argument('--snapshot-interval', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=0, help='Seconds to run live mode, 0 until interrupted')
 
     args = parser.parse_args()
 
-    analyzer = MetricsAnalyzer(args.data_dir)
+    if args.live:
+        interval = load_config()['collection']['system']['interval']
+        dashboard = LiveDashboard(args.data_dir, args.window, interval, args.refresh, args.snapshot,
+                                  args.snapshot_interval)
+        if not dashboard.interactive and not dashboard.snapshot:
+            dashboard.snapshot = args.output
+        dashboard.run(args.duration)
+        return
+
+    analyzer = MetricsAnalyzer(args.data_dir, parse_time(args.start), parse_time(args.end), not args.no_cache)
     fig = analyzer.plot_all_metrics()
     plt.savefig(args.output)
     print(f"Plot saved as {args.output}")
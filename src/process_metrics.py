@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import os
+from collections import OrderedDict
+from operator import attrgetter
+
+import psutil
+
+from src.procfs import ProcFile, PROC_PATH
+
+# One row per process that is in the top N of any ranking this tick. Rates are
+# per second since the process was last read in full.
+PROCESS_COLUMNS = ['timestamp', 'pid', 'name', 'cpu_percent', 'rss', 'read_bytes_s', 'write_bytes_s',
+                   'ctx_switches_s', 'num_threads']
+
+# What the top N are taken by, and whether it is a rate: only processes that
+# ran since the previous tick have a rate above 0, so only they are ranked
+RANKINGS = {
+    'cpu': (attrgetter('cpu_percent'), True),
+    'memory': (attrgetter('rss'), False),
+    'io': (lambda handle: handle.read_rate + handle.write_rate, True),
+    'ctx_switches': (attrgetter('ctx_rate'), True),
+    'threads': (attrgetter('num_threads'), False)
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+# A psutil.Process kept across ticks, identified by (pid, create_time), with
+# the counters of its last full read. On Linux /proc/<pid>/stat gives CPU
+# ticks, RSS and threads in one read: with one pread while ProcessTracker keeps
+# it open, otherwise with an open/read/close. A read whose start time (field
+# 22) differs from the first one is another process that reused the pid.
+# Elsewhere psutil's start time is compared on every full read instead. When
+# the CPU ticks have not moved the process has not run, so it cannot have done
+# I/O or switched context either, and the oneshot() read of io/status is
+# skipped.
+class ProcessHandle:
+    def __init__(self, pid, stat_path=None):
+        self.process = psutil.Process(pid)
+        self.pid = pid
+        self.key = (pid, self.process.create_time())
+        self.name = self.process.name()
+        self.stat_path = stat_path
+        self.stat = None
+        self.start_ticks = None
+        self.io_denied = False
+        # Ticks between probes, doubled while the process stays idle
+        self.skip = 1
+        self.next_tick = 0
+        self.cpu_ticks = None
+        self.counters = None
+        self.last_time = None
+        self.cpu_percent = self.read_rate = self.write_rate = self.ctx_rate = 0.0
+        self.rss = 0
+        self.num_threads = 0
+
+    def open_stat(self):
+        try:
+            self.stat = ProcFile(self.stat_path, 1024)
+        except OSError:
+            # Out of descriptors or gone: read it per update instead
+            self.stat = None
+        return self.stat is not None
+
+    def read_stat(self):
+        if self.stat:
+            return self.stat.buffer, self.stat.read()
+        with open(self.stat_path, 'rb') as f:
+            data = f.read()
+        return data, len(data)
+
+    def update(self, timestamp):
+        # Returns whether the process used CPU since the last update
+        if self.stat_path:
+            buffer, n = self.read_stat()
+            # Fields after the command name, which may contain spaces
+            fields = bytes(buffer[buffer.rindex(b')', 0, n) + 2:n]).split()
+            if self.start_ticks is None:
+                self.start_ticks = fields[19]
+            elif fields[19] != self.start_ticks:
+                raise psutil.NoSuchProcess(self.pid)
+            ticks = int(fields[11]) + int(fields[12])
+            self.num_threads = int(fields[17])
+            self.rss = int(fields[21]) * PAGE_SIZE
+            if ticks == self.cpu_ticks:
+                self.cpu_percent = self.read_rate = self.write_rate = self.ctx_rate = 0.0
+                return False
+            self.cpu_ticks = ticks
+            cpu = ticks / CLOCK_TICKS
+
+        with self.process.oneshot():
+            if not self.stat_path:
+                if (self.pid, psutil.Process(self.pid).create_time()) != self.key:
+                    raise psutil.NoSuchProcess(self.pid)
+                times = self.process.cpu_times()
+                cpu = times.user + times.system
+                self.rss = self.process.memory_info().rss
+                self.num_threads = self.process.num_threads()
+            read = write = 0
+            if not self.io_denied:
+                try:
+                    io = self.process.io_counters()
+                    read, write = io.read_bytes, io.write_bytes
+                except (psutil.AccessDenied, AttributeError):
+                    # Other users' processes without privileges, or no
+                    # per-process I/O on this platform; not retried
+                    self.io_denied = True
+            switches = self.process.num_ctx_switches()
+            ctx = switches.voluntary + switches.involuntary
+
+        counters = (cpu, read, write, ctx)
+        previous = self.counters
+        active = previous is None or cpu != previous[0]
+        if previous is not None and timestamp > self.last_time and cpu >= previous[0]:
+            elapsed = timestamp - self.last_time
+            self.cpu_percent = (cpu - previous[0]) / elapsed * 100
+            self.read_rate = (read - previous[1]) / elapsed
+            self.write_rate = (write - previous[2]) / elapsed
+            self.ctx_rate = (ctx - previous[3]) / elapsed
+        self.counters = counters
+        self.last_time = timestamp
+        return active
+
+    def row(self, timestamp):
+        return [timestamp, self.pid, self.name, round(self.cpu_percent, 2), self.rss, round(self.read_rate),
+                round(self.write_rate), round(self.ctx_rate, 1), self.num_threads]
+
+    def close(self):
+        if self.stat:
+            self.stat.close()
+            self.stat = None
+
+
+# Per-process CPU, memory, I/O, context switches and threads, reduced each
+# tick to the top `top` processes of every ranking (picked with a heap, not a
+# sort of every process). Handles of exited processes are dropped each tick.
+#
+# Reading thousands of /proc files is most of the cost, and most processes
+# sleep, so a process found idle is probed again after 2, 4, ... up to
+# `max_skip` ticks, and every tick again once it runs. Its counters are
+# cumulative, so nothing is lost; a process waking from a long sleep just
+# enters the rankings up to max_skip ticks late.
+#
+# The stat files of the max_open most recently read processes stay open, so
+# the busy ones cost a single pread; the rest are opened per read. The cap
+# keeps the tracker within the open file limit however many processes run.
+class ProcessTracker:
+    def __init__(self, top=10, rankings=None, proc_path=PROC_PATH, max_skip=8, max_open=1024):
+        self.top = top
+        self.max_skip = max_skip
+        self.max_open = max_open
+        self.tick = 0
+        self.rankings = [RANKINGS[name] for name in (rankings or RANKINGS)]
+        self.proc_path = proc_path if os.path.isdir(proc_path) else None
+        self.handles = {}
+        # pid -> handle with its stat file open, least recently read first
+        self.open_stats = OrderedDict()
+
+    def keep_open(self, handle):
+        if handle.stat:
+            self.open_stats.move_to_end(handle.pid)
+            return
+        if not self.max_open:
+            return
+        if len(self.open_stats) >= self.max_open:
+            _, oldest = self.open_stats.popitem(last=False)
+            oldest.close()
+        if handle.open_stat():
+            self.open_stats[handle.pid] = handle
+
+    def drop(self, pid):
+        self.open_stats.pop(pid, None)
+        self.handles.pop(pid).close()
+
+    def sample(self, timestamp):
+        self.tick += 1
+        alive = set(psutil.pids())
+        for pid in self.handles.keys() - alive:
+            self.drop(pid)
+        for pid in alive - self.handles.keys():
+            try:
+                stat_path = f'{self.proc_path}/{pid}/stat' if self.proc_path else None
+                self.handles[pid] = ProcessHandle(pid, stat_path)
+            except psutil.Error:
+                pass
+
+        gone = []
+        active_handles = []
+        for pid, handle in self.handles.items():
+            if handle.next_tick > self.tick:
+                continue
+            if handle.stat_path:
+                self.keep_open(handle)
+            try:
+                active = handle.update(timestamp)
+            except (psutil.ZombieProcess, psutil.AccessDenied):
+                # Keeps its last values; zombies hold no resources
+                active = False
+            except (psutil.NoSuchProcess, ProcessLookupError, FileNotFoundError):
+                # Exited; a new process reusing the pid is picked up next tick
+                gone.append(pid)
+                continue
+            if active:
+                active_handles.append(handle)
+            handle.skip = 1 if active else min(handle.skip * 2, self.max_skip)
+            handle.next_tick = self.tick + handle.skip
+            if handle.skip == self.max_skip:
+                # Spread long sleepers over the ticks by pid, rather than
+                # probing everything started together on the same tick
+                handle.next_tick -= (self.tick + pid) % self.max_skip
+        for pid in gone:
+            self.drop(pid)
+
+        selected = {}
+        for key, rate in self.rankings:
+            candidates = active_handles if rate else self.handles.values()
+            for handle in heapq.nlargest(self.top, candidates, key=key):
+                selected[handle.pid] = handle
+        return [handle.row(timestamp) for handle in selected.values()]
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+        self.open_stats.clear()
+
+
+def main():
+    from src.plot_system_metrices import MetricsAnalyzer
+    from src.wallclock_profiler import parse_time
+
+    parser = argparse.ArgumentParser(description='Processes with the most CPU, memory, I/O or context switches')
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    parser.add_argument('--by', default='cpu_percent', choices=PROCESS_COLUMNS[3:])
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    analyzer = MetricsAnalyzer(args.data_dir)
+    df = analyzer.load_table('process_metrics', parse_time(args.start), parse_time(args.end))
+    if df is None or df.empty:
+        print("No process samples in range")
+        return
+    # Ticks a process was outside every top N count as 0
+    ticks = df['timestamp'].nunique()
+    stats = df.groupby(['pid', 'name'])[args.by].agg(['sum', 'max', 'count']).reset_index()
+    stats['mean'] = stats['sum'] / ticks
+    stats = stats.nlargest(args.top, 'mean')
+    print(f"Top {len(stats)} processes by {args.by} over {ticks} samples")
+    print(stats[['pid', 'name', 'mean', 'max', 'count']].to_string(index=False, float_format=lambda v: f'{v:.2f}'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+
+PROC_PATH = '/proc'
+SYS_BLOCK_PATH = '/sys/block'
+DISK_SECTOR_SIZE = 512
+
+
+# A /proc file kept open for the lifetime of the collector and re-read with
+# preadv into one reusable buffer, so a sample costs a single syscall and no
+# open/close or Python file object.
+class ProcFile:
+    def __init__(self, path, size=16384):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+
+    def read(self):
+        while True:
+            n = os.preadv(self.fd, [self.buffer], 0)
+            if n < len(self.buffer):
+                return n
+            # File outgrew the buffer (many disks/NICs), grow and re-read
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def raise_open_file_limit():
+    # Soft RLIMIT_NOFILE up to the hard limit, for a process that keeps many
+    # descriptors open (per tracked process, per aggregated host). Only done
+    # when the config asks for it, and printed, since it affects the whole process.
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            print(f"Raised the open file limit from {soft} to {hard}")
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Cannot raise the open file limit: {e}")
+
+
+def _meminfo_value(buffer, n, key):
+    start = buffer.find(key, 0, n)
+    if start < 0:
+        return None
+    start += len(key)
+    end = buffer.find(b'\n', start, n)
+    return int(buffer[start:end].split()[0]) * 1024
+
+
+def cpu_percents(deltas):
+    # guest and guest_nice are already included in user and nice
+    total = sum(deltas[:8])
+    if total == 0:
+        return [0.0, 0.0, 0.0, 0.0]
+    user, _, system, idle, iowait = deltas[:5]
+    busy = total - idle - iowait
+
+    def percent(value):
+        return min(max(round(value / total * 100, 1), 0.0), 100.0)
+
+    return [percent(busy), percent(user), percent(system), percent(iowait)]
+
+
+# Linux-only replacement for the psutil calls in MetricsCollector. Every method
+# returns exactly the fields (and units) the psutil backend returns; see the
+# psutil Linux implementation for the meaning of each derived value.
+class ProcfsBackend:
+    name = 'procfs'
+
+    def __init__(self, proc_path=PROC_PATH):
+        self.stat = ProcFile(f'{proc_path}/stat')
+        self.meminfo = ProcFile(f'{proc_path}/meminfo')
+        self.diskstats = ProcFile(f'{proc_path}/diskstats')
+        self.netdev = ProcFile(f'{proc_path}/net/dev')
+        self.last_cpu_times = self._read_cpu_times()
+        self.last_percpu_times = self._read_percpu_times()
+        self.storage_devices = {}
+
+    def _read_cpu_times(self):
+        n = self.stat.read()
+        buffer = self.stat.buffer
+        # First line is the aggregate "cpu  user nice system idle iowait irq softirq steal guest guest_nice"
+        end = buffer.find(b'\n', 0, n)
+        return [int(v) for v in buffer[4:end].split()]
+
+    def _read_percpu_times(self):
+        n = self.stat.read()
+        percpu = {}
+        for line in self.stat.buffer[:n].splitlines()[1:]:
+            if not line.startswith(b'cpu'):
+                break
+            fields = line.split()
+            percpu[fields[0].decode()] = [int(v) for v in fields[1:]]
+        return percpu
+
+    def cpu(self):
+        times = self._read_cpu_times()
+        deltas = [max(0, t2 - t1) for t1, t2 in zip(self.last_cpu_times, times)]
+        self.last_cpu_times = times
+        return cpu_percents(deltas)
+
+    def percpu(self):
+        percpu = self._read_percpu_times()
+        rows = []
+        for cpu, times in percpu.items():
+            last = self.last_percpu_times.get(cpu, times)
+            rows.append(cpu_percents([max(0, t2 - t1) for t1, t2 in zip(last, times)]))
+        self.last_percpu_times = percpu
+        return list(percpu), rows
+
+    def memory(self):
+        n = self.meminfo.read()
+        buffer = self.meminfo.buffer
+        total = _meminfo_value(buffer, n, b'MemTotal:')
+        free = _meminfo_value(buffer, n, b'MemFree:')
+        buffers = _meminfo_value(buffer, n, b'Buffers:') or 0
+        cached = (_meminfo_value(buffer, n, b'\nCached:') or 0) + (_meminfo_value(buffer, n, b'SReclaimable:') or 0)
+        available = _meminfo_value(buffer, n, b'MemAvailable:')
+        if not available:
+            # Kernels before 3.14 (or the occasional 0 reading), same fallback as free(1)
+            available = free + buffers + cached
+        if available > total:
+            available = free
+
+        return [total, available, total - available, free, cached, buffers]
+
+    def _is_storage_device(self, name):
+        if name not in self.storage_devices:
+            path = f"{SYS_BLOCK_PATH}/{name.replace('/', '!')}"
+            self.storage_devices[name] = os.access(path, os.F_OK)
+        return self.storage_devices[name]
+
+    def _read_diskstats(self):
+        n = self.diskstats.read()
+        for line in self.diskstats.buffer[:n].splitlines():
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            yield fields[2].decode(), [
+                int(fields[5]) * DISK_SECTOR_SIZE,
+                int(fields[9]) * DISK_SECTOR_SIZE,
+                int(fields[3]),
+                int(fields[7]),
+                int(fields[6]),
+                int(fields[10])
+            ]
+
+    def io(self):
+        totals = [0, 0, 0, 0, 0, 0]
+        for name, values in self._read_diskstats():
+            # Totals only count whole devices, not their partitions
+            if self._is_storage_device(name):
+                totals = [t + v for t, v in zip(totals, values)]
+        return totals
+
+    def perdisk(self):
+        disks = dict(self._read_diskstats())
+        return list(disks), list(disks.values())
+
+    def _read_netdev(self):
+        n = self.netdev.read()
+        # Two header lines, then "iface: rx_bytes rx_packets rx_errs ... tx_bytes tx_packets tx_errs ..."
+        for line in self.netdev.buffer[:n].splitlines()[2:]:
+            colon = line.rfind(b':')
+            fields = line[colon + 1:].split()
+            yield line[:colon].strip().decode(), [
+                int(fields[8]),
+                int(fields[0]),
+                int(fields[9]),
+                int(fields[1]),
+                int(fields[2]),
+                int(fields[10])
+            ]
+
+    def network(self):
+        totals = [0, 0, 0, 0, 0, 0]
+        for _, values in self._read_netdev():
+            totals = [t + v for t, v in zip(totals, values)]
+        return totals
+
+    def pernic(self):
+        nics = dict(self._read_netdev())
+        return list(nics), list(nics.values())
+
+    def close(self):
+        for proc_file in (self.stat, self.meminfo, self.diskstats, self.netdev):
+            proc_file.close()
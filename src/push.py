@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+# Wire format between collectors and the aggregator. Every frame is a 4 byte
+# big-endian length followed by a zlib-compressed payload whose first byte is
+# its kind:
+#
+#   H  hello, once per connection: JSON {host, columns, types} describing
+#      the host and the record layout of each metric, in metric index order
+#   B  batch: for each metric with rows, [u8 metric index][u32 row count]
+#      then the rows packed little-endian with the metric's struct types
+FRAME_HEADER = struct.Struct('>I')
+BATCH_HEADER = struct.Struct('<BI')
+HELLO = b'H'
+BATCH = b'B'
+
+# Sent back by the aggregator after each batch: batches taken on the connection
+ACK = struct.Struct('>I')
+
+# Larger frames, compressed or not, are a corrupt stream, not a batch
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def encode_frame(kind, payload, level=6):
+    data = zlib.compress(kind + payload, level)
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def decode_frame(data, max_size=MAX_FRAME):
+    # Inflates at most max_size bytes, so a small frame cannot expand into
+    # gigabytes on the receiving side
+    inflater = zlib.decompressobj()
+    payload = inflater.decompress(data, max_size)
+    if inflater.unconsumed_tail:
+        raise ValueError(f"frame inflates to more than {max_size} bytes")
+    if not inflater.eof:
+        raise ValueError("truncated frame")
+    return payload[:1], memoryview(payload)[1:]
+
+
+def encode_hello(host, columns, types):
+    return encode_frame(HELLO, json.dumps({'host': host, 'columns': columns, 'types': types}).encode())
+
+
+def decode_batch(payload, records):
+    # Yields (metric index, rows) with rows as tuples, records[i] being the
+    # struct.Struct of metric i
+    offset = 0
+    while offset < len(payload):
+        index, count = BATCH_HEADER.unpack_from(payload, offset)
+        offset += BATCH_HEADER.size
+        record = records[index]
+        end = offset + count * record.size
+        if end > len(payload):
+            raise ValueError(f"batch truncated: {count} rows of metric {index}")
+        yield index, record.iter_unpack(payload[offset:end])
+        offset = end
+
+
+# Frames that could not be sent, kept on disk in order until the aggregator
+# is back. Frames are appended to numbered segment files of segment_bytes;
+# once the spool holds more than max_bytes the oldest segments are deleted,
+# so an aggregator outage costs the oldest data rather than unbounded disk.
+# The spool survives a collector restart.
+class Spool:
+    def __init__(self, spool_dir, max_bytes=64 * 1024 * 1024, segment_bytes=None):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes or max(max_bytes // 16, 64 * 1024)
+        self.file = None
+        self.dropped_bytes = 0
+        os.makedirs(spool_dir, exist_ok=True)
+        self.segments = sorted(name for name in os.listdir(spool_dir) if name.endswith('.spool'))
+        self.size = sum(os.path.getsize(self.path(name)) for name in self.segments)
+
+    def path(self, name):
+        return f'{self.spool_dir}/{name}'
+
+    def append(self, frame):
+        if self.file is None or self.file.tell() >= self.segment_bytes:
+            self._close_segment()
+            number = int(self.segments[-1].split('.')[0]) + 1 if self.segments else 0
+            self.segments.append(f'{number:012d}.spool')
+            self.file = open(self.path(self.segments[-1]), 'ab')
+        self.file.write(frame)
+        self.size += len(frame)
+        while self.size > self.max_bytes and len(self.segments) > 1:
+            if not self.dropped_bytes:
+                print(f"Push spool over {self.max_bytes} bytes, dropping its oldest samples")
+            self.dropped_bytes += self.remove(self.segments[0])
+
+    def _close_segment(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def pending(self):
+        # Segment names, oldest first; the one being appended to is closed
+        self._close_segment()
+        return list(self.segments)
+
+    def frames(self, name):
+        with open(self.path(name), 'rb') as f:
+            data = f.read()
+        frames = []
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            length, = FRAME_HEADER.unpack_from(data, offset)
+            end = offset + FRAME_HEADER.size + length
+            if end > len(data):
+                # Partial frame from a crash while appending
+                break
+            frames.append(data[offset:end])
+            offset = end
+        return frames
+
+    def remove(self, name):
+        size = os.path.getsize(self.path(name))
+        os.remove(self.path(name))
+        self.segments.remove(name)
+        self.size -= size
+        if not self.segments and self.dropped_bytes:
+            print(f"Push spool drained, {self.dropped_bytes} bytes of samples were dropped")
+            self.dropped_bytes = 0
+        return size
+
+    def close(self):
+        self._close_segment()
+
+
+# Sends the collector's samples to an aggregator over one persistent TCP
+# connection. publish() runs on the sampling thread and only packs rows into
+# the pending batch; a sender thread compresses and sends the batch every
+# batch_interval seconds, so a slow or absent aggregator never delays a tick.
+#
+# The aggregator acknowledges every batch (ACK, the count of batches it has
+# taken on the connection) and sent batches are kept until acknowledged. When
+# the connection breaks, unacknowledged batches and everything after them go
+# to the Spool and the connection is retried with exponential backoff (1 s up
+# to max_backoff). After reconnecting the spool is sent, a segment at a time
+# and removed once acknowledged, before any newer batch. A batch may arrive
+# twice this way but not out of order, and the aggregator drops rows it
+# already has.
+class PushClient:
+    def __init__(self, address, columns, types, host=None, spool_dir='push_spool', spool_bytes=64 * 1024 * 1024,
+                 batch_interval=5, max_backoff=30, timeout=10):
+        self.address = address
+        self.host = host or socket.gethostname()
+        self.metrics = list(columns)
+        self.index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.records = {metric: struct.Struct('<' + types[metric]) for metric in self.metrics}
+        self.hello = encode_hello(self.host, {m: columns[m] for m in self.metrics},
+                                  {m: types[m] for m in self.metrics})
+        self.spool = Spool(spool_dir, spool_bytes)
+        self.batch_interval = batch_interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.sock = None
+        self.backoff = 1
+        self.retry_at = 0
+        # Batches sent on this connection and not acknowledged yet
+        self.inflight = collections.deque()
+        self.sent = 0
+        self.ack_buffer = b''
+        self.bytes_sent = 0
+        self.frames_sent = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='push', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(2 * self.timeout + 5)
+        self.spool.close()
+
+    def publish(self, timestamp, rows):
+        # rows maps metric to [timestamp] + values, as the collector samples them
+        with self.lock:
+            for metric, row in rows.items():
+                if metric in self.records:
+                    rows_buffer = self.pending.setdefault(metric, [0, bytearray()])
+                    rows_buffer[0] += 1
+                    rows_buffer[1] += self.records[metric].pack(*row)
+
+    def take_batch(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return None
+        payload = b''.join(BATCH_HEADER.pack(self.index[metric], count) + bytes(data)
+                           for metric, (count, data) in pending.items())
+        return encode_frame(BATCH, payload)
+
+    def _run(self):
+        while not self.stopped.wait(self.batch_interval):
+            self.deliver(self.take_batch())
+        # Last partial batch on stop, then wait for it to be taken
+        self.deliver(self.take_batch())
+        if self.sock is not None:
+            try:
+                self._wait_acks()
+            except OSError:
+                self._disconnect()
+        self._disconnect()
+
+    def deliver(self, frame):
+        if self.sock is None and time.monotonic() >= self.retry_at:
+            self._connect()
+        if frame is None:
+            return
+        if self.sock is not None:
+            try:
+                self._send_batch(frame)
+                self._read_acks(wait=False)
+                return
+            except OSError as e:
+                print(f"Lost connection to aggregator {self.address[0]}:{self.address[1]}: {e}")
+                self._disconnect()
+        self.spool.append(frame)
+
+    def _send_batch(self, frame):
+        self.sock.sendall(frame)
+        self.inflight.append(frame)
+        self.sent += 1
+        self.bytes_sent += len(frame)
+        self.frames_sent += 1
+
+    def _read_acks(self, wait):
+        self.sock.settimeout(self.timeout if wait else 0)
+        try:
+            data = self.sock.recv(4096)
+        except BlockingIOError:
+            return
+        finally:
+            self.sock.settimeout(self.timeout)
+        if not data:
+            raise ConnectionResetError("aggregator closed the connection")
+        data = self.ack_buffer + data
+        usable = len(data) - len(data) % ACK.size
+        self.ack_buffer = data[usable:]
+        if usable:
+            acked, = ACK.unpack_from(data, usable - ACK.size)
+            while len(self.inflight) > self.sent - acked:
+                self.inflight.popleft()
+
+    def _wait_acks(self):
+        while self.inflight:
+            self._read_acks(wait=True)
+
+    def _connect(self):
+        try:
+            self.sock = socket.create_connection(self.address, self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.sendall(self.hello)
+            if len(self.spool):
+                print(f"Connected to aggregator, sending {self.spool.size} spooled bytes")
+            for name in self.spool.pending():
+                for frame in self.spool.frames(name):
+                    self._send_batch(frame)
+                self._wait_acks()
+                self.spool.remove(name)
+            self.backoff = 1
+        except OSError as e:
+            if self.backoff == 1:
+                print(f"Cannot reach aggregator {self.address[0]}:{self.address[1]} ({e}), spooling")
+            # Unacknowledged frames of the segment being replayed are still in it
+            self.inflight.clear()
+            self._disconnect()
+            self.retry_at = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def _disconnect(self):
+        # Unacknowledged batches go back to the spool, ahead of anything newer
+        for frame in self.inflight:
+            self.spool.append(frame)
+        self.inflight.clear()
+        self.sent = 0
+        self.ack_buffer = b''
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+def parse_address(address, default_port=9106):
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port, default_port
+    return host.strip('[]'), int(port)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+# Fixed number of rows, overwritten oldest first
+class RingBuffer:
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.data = np.full((capacity, width), np.nan)
+        self.head = 0
+        self.count = 0
+
+    def extend(self, rows):
+        rows = rows[-self.capacity:]
+        n = len(rows)
+        end = self.head + n
+        if end <= self.capacity:
+            self.data[self.head:end] = rows
+        else:
+            split = self.capacity - self.head
+            self.data[self.head:] = rows[:split]
+            self.data[:n - split] = rows[split:]
+        self.head = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def view(self):
+        # Rows oldest first
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return np.concatenate((self.data[self.head:], self.data[:self.head]))
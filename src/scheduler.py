@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+
+# Fires callback(timestamp) once per interval. Deadlines are start + n * interval
+# on the monotonic clock, so time spent in the callback never accumulates as
+# drift. Ticks overrun by a whole interval are skipped and counted, not replayed.
+# A SelfMonitor, if given, is told the lateness of every tick.
+class TickScheduler:
+    def __init__(self, interval, callback, name='scheduler', late_threshold=None, monitor=None):
+        self.interval = interval
+        self.callback = callback
+        self.name = name
+        # A tick firing later than this after its deadline counts as late
+        self.late_threshold = late_threshold if late_threshold is not None else interval * 0.1
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.late_ticks = 0
+        self.max_lateness = 0.0
+        self.last_lateness = 0.0
+        self.monitor = monitor
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self._stop.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def run(self):
+        start = time.monotonic()
+        tick = 0
+
+        while not self._stop.is_set():
+            deadline = start + tick * self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+
+            lateness = time.monotonic() - deadline
+            skipped = 0
+            if lateness >= self.interval:
+                skipped = int(lateness // self.interval)
+                self.missed_ticks += skipped
+                tick += skipped
+                lateness -= skipped * self.interval
+                print(f"{self.name}: missed {skipped} tick(s), collection is slower than the interval")
+
+            late = lateness > self.late_threshold
+            if late:
+                self.late_ticks += 1
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            if self.monitor:
+                self.monitor.tick(lateness, skipped, late)
+
+            try:
+                self.callback(time.time())
+            except Exception as e:
+                print(f"{self.name}: error in tick callback: {e}")
+
+            self.ticks += 1
+            tick += 1
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'missed_ticks': self.missed_ticks,
+            'late_ticks': self.late_ticks,
+            'max_lateness_ms': self.max_lateness * 1000
+        }
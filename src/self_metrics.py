@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import threading
+import time
+
+import psutil
+
+from src.sinks import open_sink
+
+# The collector's own cost, one row per window: CPU of the collector process
+# and of the children it waited for (jstack, jstat), memory, threads and open
+# descriptors, bytes its tables have written, and how its ticks kept time
+COLLECTOR_COLUMNS = ['timestamp', 'window_s', 'cpu_percent', 'children_cpu_percent', 'rss', 'threads', 'open_fds',
+                     'bytes_written', 'ticks', 'missed_ticks', 'late_ticks', 'lateness_p50_ms', 'lateness_p99_ms',
+                     'lateness_max_ms']
+
+# Latency of each sampling step in the window, one row per source
+LATENCY_COLUMNS = ['timestamp', 'source', 'count', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+
+# Histogram buckets are log-spaced, BUCKETS_PER_DOUBLING per power of two from
+# HISTOGRAM_MIN seconds up to about 4.5 minutes, so a percentile read from
+# the buckets is within 9% of the exact value
+HISTOGRAM_MIN = 1e-6
+BUCKETS_PER_DOUBLING = 4
+HISTOGRAM_BUCKETS = 28 * BUCKETS_PER_DOUBLING + 1
+
+
+def self_metrics_params(config):
+    # SelfMonitor keyword arguments from the self_metrics section, None when off
+    self_config = dict(config.get('self_metrics') or {})
+    if not self_config.pop('enabled', True):
+        return None
+    return self_config
+
+
+# Fixed-size latency histogram: record() is a log2 and an increment, so it
+# can sit on the sampling path; percentiles are only read once per window.
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds > HISTOGRAM_MIN:
+            index = min(int(math.log2(seconds / HISTOGRAM_MIN) * BUCKETS_PER_DOUBLING) + 1, HISTOGRAM_BUCKETS - 1)
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        # Geometric middle of the bucket holding the q-th percentile
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == 0:
+                    return min(HISTOGRAM_MIN, self.max)
+                return min(HISTOGRAM_MIN * 2 ** ((index - 0.5) / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+# Hot-path instrumentation of a collector. The sampling code reports how long
+# each step took (record), failed steps (error) and how late each tick fired
+# (tick); every `interval` seconds poll() turns the window into one
+# COLLECTOR_COLUMNS row and one LATENCY_COLUMNS row per source, written to
+# <table>_metrics and <table>_latency next to the collected tables. With
+# process=False only latencies are written (collectors sharing a process,
+# as under java_fanout). Safe to call from several sampling threads.
+class SelfMonitor:
+    def __init__(self, output_dir, output_config=None, table='collector', interval=10, process=True, writers=None):
+        self.interval = interval
+        # Returns the collector's sinks, whose bytes_written are summed
+        self.writers = writers
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.lateness = LatencyHistogram()
+        self.ticks = self.missed_ticks = self.late_ticks = 0
+        self.window_start = time.monotonic()
+
+        self.process = psutil.Process() if process else None
+        self.cpu = self._cpu_times() if process else None
+        self.sink = open_sink(f'{output_dir}/{table}_metrics', COLLECTOR_COLUMNS, output_config) if process else None
+        self.latency_sink = open_sink(f'{output_dir}/{table}_latency', LATENCY_COLUMNS, output_config)
+        # Whole-run totals for the summary printed on close
+        self.peak_rss = 0
+        self.cpu_seconds = 0.0
+        self.started = self.window_start
+
+    def record(self, source, seconds):
+        with self.lock:
+            histogram = self.latencies.get(source)
+            if histogram is None:
+                histogram = self.latencies[source] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def error(self, source):
+        with self.lock:
+            self.errors[source] = self.errors.get(source, 0) + 1
+            self.latencies.setdefault(source, LatencyHistogram())
+
+    def tick(self, lateness, missed=0, late=False):
+        # lateness in seconds past the tick's deadline, missed ticks skipped before it
+        with self.lock:
+            self.ticks += 1
+            self.missed_ticks += missed
+            self.late_ticks += late
+            self.lateness.record(max(lateness, 0.0))
+
+    def poll(self):
+        # Writes the window once it is `interval` seconds old
+        if time.monotonic() - self.window_start >= self.interval:
+            self.write_window(self.interval)
+
+    def _cpu_times(self):
+        times = self.process.cpu_times()
+        return times.user + times.system, times.children_user + times.children_system
+
+    def write_window(self, min_elapsed=0):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.window_start
+            if elapsed <= 0 or elapsed < min_elapsed:
+                # Another thread has just written it
+                return
+            latencies, self.latencies = self.latencies, {}
+            errors, self.errors = self.errors, {}
+            lateness, self.lateness = self.lateness, LatencyHistogram()
+            ticks, missed, late = self.ticks, self.missed_ticks, self.late_ticks
+            self.ticks = self.missed_ticks = self.late_ticks = 0
+            self.window_start = now
+        timestamp = time.time()
+
+        for source, histogram in sorted(latencies.items()):
+            self.latency_sink.write([timestamp, source, histogram.count, errors.get(source, 0),
+                                     round(histogram.mean() * 1000, 3), round(histogram.percentile(50) * 1000, 3),
+                                     round(histogram.percentile(95) * 1000, 3),
+                                     round(histogram.percentile(99) * 1000, 3), round(histogram.max * 1000, 3)])
+
+        if self.process:
+            try:
+                cpu = self._cpu_times()
+                with self.process.oneshot():
+                    rss = self.process.memory_info().rss
+                    threads = self.process.num_threads()
+                    fds = self.process.num_fds() if hasattr(self.process, 'num_fds') else 0
+            except psutil.Error as e:
+                print(f"Error reading collector process stats: {e}")
+                return
+            own, children = cpu[0] - self.cpu[0], cpu[1] - self.cpu[1]
+            self.cpu = cpu
+            self.cpu_seconds += own + children
+            self.peak_rss = max(self.peak_rss, rss)
+            written = sum(getattr(writer, 'bytes_written', 0) for writer in self.writers()) if self.writers else 0
+            self.sink.write([timestamp, round(elapsed, 3), round(own / elapsed * 100, 2),
+                             round(children / elapsed * 100, 2), rss, threads, fds, written, ticks, missed, late,
+                             round(lateness.percentile(50) * 1000, 3), round(lateness.percentile(99) * 1000, 3),
+                             round(lateness.max * 1000, 3)])
+
+    def flush(self, durable=False):
+        for sink in (self.sink, self.latency_sink):
+            if sink:
+                sink.flush(durable)
+
+    def close(self):
+        self.write_window()
+        if self.process:
+            elapsed = time.monotonic() - self.started
+            print(f"Collector overhead: {self.cpu_seconds / elapsed * 100:.2f}% CPU, "
+                  f"peak RSS {self.peak_rss / 1024 / 1024:.0f} MiB")
+        for sink in (self.sink, self.latency_sink):
+            if sink:
+                sink.close()
+
+
+def main():
+    from src.plot_system_metrices import MetricsAnalyzer
+    from src.wallclock_profiler import parse_time
+
+    parser = argparse.ArgumentParser(description="Summarize a collector's own overhead and sampling latency")
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--table', default='collector', help="collector (system) or java_collector")
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    args = parser.parse_args()
+
+    analyzer = MetricsAnalyzer(args.data_dir)
+    start, end = parse_time(args.start), parse_time(args.end)
+    metrics = analyzer.load_table(f'{args.table}_metrics', start, end)
+    latency = analyzer.load_table(f'{args.table}_latency', start, end)
+    if metrics is not None and not metrics.empty:
+        span = metrics['window_s'].sum()
+        print(f"{len(metrics)} windows, {span:.0f} s")
+        print(f"CPU {(metrics['cpu_percent'] * metrics['window_s']).sum() / span:.2f}% mean, "
+              f"{metrics['cpu_percent'].max():.2f}% max; children "
+              f"{(metrics['children_cpu_percent'] * metrics['window_s']).sum() / span:.2f}% mean")
+        print(f"RSS {metrics['rss'].iloc[-1] / 1024 / 1024:.0f} MiB last, {metrics['rss'].max() / 1024 / 1024:.0f} "
+              f"MiB max; {metrics['threads'].max()} threads, {metrics['open_fds'].max()} fds max")
+        print(f"{metrics['ticks'].sum()} ticks, {metrics['missed_ticks'].sum()} missed, "
+              f"{metrics['late_ticks'].sum()} late, lateness p99 up to {metrics['lateness_p99_ms'].max():.2f} ms, "
+              f"max {metrics['lateness_max_ms'].max():.2f} ms")
+        if len(metrics) > 1:
+            rate = (metrics['bytes_written'].iloc[-1] - metrics['bytes_written'].iloc[0]) / \
+                metrics['window_s'].iloc[1:].sum()
+            print(f"Writing {rate / 1024:.1f} KiB/s")
+    if latency is not None and not latency.empty:
+        # Window percentiles combined weighted by samples; max is exact
+        latency['weighted_mean'] = latency['mean_ms'] * latency['count']
+        latency['weighted_p99'] = latency['p99_ms'] * latency['count']
+        summary = latency.groupby('source').agg(count=('count', 'sum'), errors=('errors', 'sum'),
+                                                mean=('weighted_mean', 'sum'), p99=('weighted_p99', 'sum'),
+                                                max_ms=('max_ms', 'max'))
+        summary['mean_ms'] = summary['mean'] / summary['count'].clip(lower=1)
+        summary['p99_ms (avg of windows)'] = summary['p99'] / summary['count'].clip(lower=1)
+        print(summary[['count', 'errors', 'mean_ms', 'p99_ms (avg of windows)', 'max_ms']]
+              .to_string(float_format=lambda v: f'{v:.3f}'))
+    if metrics is None and latency is None:
+        print(f"No {args.table}_metrics or {args.table}_latency in {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+
+import csv
+import gzip
+import json
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+BINARY_MAGIC = b'SMB1'
+
+# struct codes usable in binary records and their numpy equivalents
+BINARY_DTYPES = {
+    'd': '<f8',
+    'f': '<f4',
+    'q': '<i8',
+    'Q': '<u8',
+    'i': '<i4',
+    'I': '<u4'
+}
+
+
+# Rows are buffered in memory and written out in one batch once flush_rows rows
+# are pending or the oldest pending row is flush_interval seconds old. Every row
+# starts with the sample timestamp; the human readable datetime column is only
+# formatted at flush time, off the sampling hot path.
+#
+# before_flush(durable) is called ahead of writing rows out, for tables whose
+# rows refer to ids in dictionaries that must reach disk first.
+class CsvSink:
+    def __init__(self, path, columns, flush_rows=100, flush_interval=5.0, datetime_column=True, before_flush=None):
+        self.path = path
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.datetime_column = datetime_column
+        self.before_flush = before_flush
+        self.rows = []
+        self.bytes_written = 0
+        self.first_pending = None
+        self.lock = threading.Lock()
+
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if os.path.getsize(path) == 0:
+            header = self.columns[:1] + ['datetime'] + self.columns[1:] if datetime_column else self.columns
+            self.writer.writerow(header)
+            self.file.flush()
+
+    def write(self, row):
+        with self.lock:
+            if not self.rows:
+                self.first_pending = time.monotonic()
+            self.rows.append(row)
+            if len(self.rows) >= self.flush_rows or time.monotonic() - self.first_pending >= self.flush_interval:
+                self._flush()
+
+    def write_many(self, rows):
+        with self.lock:
+            if not self.rows:
+                self.first_pending = time.monotonic()
+            self.rows.extend(rows)
+            if len(self.rows) >= self.flush_rows or time.monotonic() - self.first_pending >= self.flush_interval:
+                self._flush()
+
+    def _format(self, rows):
+        if not self.datetime_column:
+            return rows
+        formatted = []
+        last_second, last_str = None, None
+        for row in rows:
+            second = int(row[0])
+            if second != last_second:
+                last_second = second
+                last_str = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+            formatted.append([row[0], last_str] + list(row[1:]))
+        return formatted
+
+    def _flush(self, durable=False):
+        if self.before_flush and (self.rows or durable):
+            self.before_flush(durable)
+        if self.rows:
+            position = self.file.tell()
+            self.writer.writerows(self._format(self.rows))
+            self.bytes_written += self.file.tell() - position
+            self.rows = []
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+
+    def flush(self, durable=False):
+        with self.lock:
+            if not self.file.closed:
+                self._flush(durable)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._flush(durable=True)
+                self.file.close()
+
+
+# Fixed-width little-endian records, one struct code per column (see
+# BINARY_DTYPES). The file starts with a small JSON header describing the
+# columns so it can be mapped straight into a numpy structured array.
+class BinarySink:
+    def __init__(self, path, columns, types=None, flush_rows=100, flush_interval=5.0, before_flush=None):
+        self.path = path
+        self.columns = list(columns)
+        self.types = types or 'd' * len(self.columns)
+        if len(self.types) != len(self.columns):
+            raise ValueError(f"{path}: {len(self.columns)} columns but {len(self.types)} types")
+        self.record = struct.Struct('<' + self.types)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.before_flush = before_flush
+        self.buffer = bytearray()
+        self.pending = 0
+        self.bytes_written = 0
+        self.first_pending = None
+        self.lock = threading.Lock()
+
+        self.file = open(path, 'ab')
+        if os.path.getsize(path) == 0:
+            self.file.write(encode_binary_header(self.columns, self.types))
+            self.file.flush()
+        else:
+            columns, types, _ = read_binary_header(path)
+            if columns != self.columns or types != self.types:
+                self.file.close()
+                raise ValueError(f"{path} was written with a different record layout")
+
+    def write(self, row):
+        with self.lock:
+            if not self.pending:
+                self.first_pending = time.monotonic()
+            self.buffer += self.record.pack(*row)
+            self.pending += 1
+            if self.pending >= self.flush_rows or time.monotonic() - self.first_pending >= self.flush_interval:
+                self._flush()
+
+    def write_many(self, rows):
+        with self.lock:
+            if not self.pending:
+                self.first_pending = time.monotonic()
+            pack = self.record.pack
+            size = len(self.buffer)
+            self.buffer += b''.join([pack(*row) for row in rows])
+            self.pending += (len(self.buffer) - size) // self.record.size
+            if self.pending >= self.flush_rows or time.monotonic() - self.first_pending >= self.flush_interval:
+                self._flush()
+
+    def _flush(self, durable=False):
+        if self.before_flush and (self.buffer or durable):
+            self.before_flush(durable)
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.bytes_written += len(self.buffer)
+            self.buffer = bytearray()
+            self.pending = 0
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+
+    def flush(self, durable=False):
+        with self.lock:
+            if not self.file.closed:
+                self._flush(durable)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._flush(durable=True)
+                self.file.close()
+
+
+def encode_binary_header(columns, types):
+    meta = json.dumps({'columns': columns, 'types': types}).encode()
+    # Pad so records start on an 8 byte boundary
+    meta += b' ' * (-(len(BINARY_MAGIC) + 4 + len(meta)) % 8)
+    return BINARY_MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_binary_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary metrics file")
+        meta_len, = struct.unpack('<I', f.read(4))
+        meta = json.loads(f.read(meta_len))
+    return meta['columns'], meta['types'], len(BINARY_MAGIC) + 4 + meta_len
+
+
+def binary_dtype(columns, types):
+    return np.dtype([(name, BINARY_DTYPES[code]) for name, code in zip(columns, types)])
+
+
+def read_binary(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return read_binary_bytes(f.read(), path)
+    columns, types, offset = read_binary_header(path)
+    dtype = binary_dtype(columns, types)
+    # Ignore a trailing partial record from a writer that is still running
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+
+def read_binary_bytes(data, name='<bytes>'):
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError(f"{name} is not a binary metrics file")
+    meta_len, = struct.unpack_from('<I', data, len(BINARY_MAGIC))
+    offset = len(BINARY_MAGIC) + 4 + meta_len
+    meta = json.loads(data[len(BINARY_MAGIC) + 4:offset])
+    dtype = binary_dtype(meta['columns'], meta['types'])
+    count = (len(data) - offset) // dtype.itemsize
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+
+# <first timestamp in ms>[-<n>].<ext>[.gz]; -n tells apart segments opened in
+# the same millisecond, e.g. a reopened profile bucket or a quick restart
+SEGMENT_NAME = re.compile(r'^(\d+)(?:-(\d+))?\.(csv|bin)(\.gz)?$')
+INDEX_COLUMNS = ['segment', 'start', 'end', 'rows']
+
+
+# Splits a table into segments under path_base/, named after the first
+# timestamp they hold (in ms). A segment is closed when the sample time
+# crosses the next multiple of rotate_interval seconds or once rotate_bytes
+# have been written to it. Closed segments are gzipped on a background thread
+# and then recorded in path_base/index.csv as (segment, start, end, rows), so
+# a time range is read by opening only the segments that overlap it. Segments
+# left open or uncompressed by a crash are finished when the sink reopens.
+class SegmentedSink:
+    def __init__(self, base_dir, extension, open_segment, rotate_interval=None, rotate_bytes=None,
+                 compress=True):
+        self.base_dir = base_dir
+        self.extension = extension
+        self.open_segment = open_segment
+        self.rotate_interval = rotate_interval
+        self.rotate_bytes = rotate_bytes
+        self.compress = compress
+        self.sink = None
+        self.segment_path = None
+        self.segment_end = None
+        self.first = None
+        self.last = None
+        self.rows = 0
+        # Bytes written to segments closed so far
+        self.closed_bytes = 0
+        self.finishers = []
+        # Segment names recorded in index.csv
+        self.indexed = set()
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+        self._recover()
+
+    @property
+    def bytes_written(self):
+        return self.closed_bytes + (self.sink.bytes_written if self.sink else 0)
+
+    def write(self, row):
+        timestamp = row[0]
+        with self.lock:
+            if (self.sink is None or timestamp >= self.segment_end
+                    or (self.rotate_bytes and self.sink.bytes_written >= self.rotate_bytes)):
+                self._rotate(timestamp)
+            self.sink.write(row)
+            if self.first is None:
+                self.first = timestamp
+            self.last = timestamp
+            self.rows += 1
+
+    def write_many(self, rows):
+        # Rows go to the open segment in runs, rotating between runs as write() would
+        with self.lock:
+            run = []
+            for row in rows:
+                timestamp = row[0]
+                if self.sink is None or timestamp >= self.segment_end or (
+                        not run and self.rotate_bytes and self.sink.bytes_written >= self.rotate_bytes):
+                    self._write_run(run)
+                    run = []
+                    self._rotate(timestamp)
+                run.append(row)
+            self._write_run(run)
+
+    def _write_run(self, run):
+        if not run:
+            return
+        self.sink.write_many(run)
+        if self.first is None:
+            self.first = run[0][0]
+        self.last = run[-1][0]
+        self.rows += len(run)
+
+    def _rotate(self, timestamp):
+        self._close_segment()
+        name = str(int(timestamp * 1000))
+        suffix = 0
+        with self.index_lock:
+            while (f'{name}{self.extension}' in self.indexed or f'{name}{self.extension}.gz' in self.indexed
+                   or os.path.exists(f'{self.base_dir}/{name}{self.extension}')
+                   or os.path.exists(f'{self.base_dir}/{name}{self.extension}.gz')):
+                suffix += 1
+                name = f'{int(timestamp * 1000)}-{suffix}'
+        self.segment_path = f'{self.base_dir}/{name}{self.extension}'
+        self.sink = self.open_segment(self.segment_path)
+        if self.rotate_interval:
+            self.segment_end = (timestamp // self.rotate_interval + 1) * self.rotate_interval
+        else:
+            self.segment_end = float('inf')
+
+    def _close_segment(self):
+        if self.sink is None:
+            return
+        self.sink.close()
+        self.closed_bytes += self.sink.bytes_written
+        finisher = threading.Thread(target=self._finish, name='segment-finish',
+                                    args=(self.segment_path, self.first, self.last, self.rows))
+        finisher.start()
+        self.finishers = [f for f in self.finishers if f.is_alive()] + [finisher]
+        self.sink = None
+        self.first = self.last = None
+        self.rows = 0
+
+    def _finish(self, path, first, last, rows, compress=None):
+        try:
+            if self.compress if compress is None else compress:
+                with open(path, 'rb') as src, gzip.open(f'{path}.gz.tmp', 'wb', compresslevel=6) as dst:
+                    while True:
+                        block = src.read(1 << 20)
+                        if not block:
+                            break
+                        dst.write(block)
+                os.replace(f'{path}.gz.tmp', f'{path}.gz')
+                os.remove(path)
+                path = f'{path}.gz'
+            with self.index_lock:
+                with open(f'{self.base_dir}/index.csv', 'a', newline='') as f:
+                    writer = csv.writer(f)
+                    if f.tell() == 0:
+                        writer.writerow(INDEX_COLUMNS)
+                    writer.writerow([os.path.basename(path), first, last, rows])
+                self.indexed.add(os.path.basename(path))
+        except OSError as e:
+            print(f"Error finishing segment {path}: {e}")
+
+    def _recover(self):
+        indexed = self.indexed = {entry[0] for entry in read_index(self.base_dir)}
+        for name in sorted(os.listdir(self.base_dir)):
+            path = f'{self.base_dir}/{name}'
+            match = SEGMENT_NAME.match(name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            if not match or name in indexed or not os.path.exists(path):
+                continue
+            if not match.group(4) and os.path.exists(f'{path}.gz'):
+                # Crashed after compressing, before removing the original
+                os.remove(f'{path}.gz')
+            timestamps = segment_timestamps(path)
+            if not len(timestamps):
+                os.remove(path)
+                continue
+            self._finish(path, float(timestamps[0]), float(timestamps[-1]), len(timestamps),
+                         self.compress and not match.group(4))
+
+    def flush(self, durable=False):
+        with self.lock:
+            if self.sink:
+                self.sink.flush(durable)
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+        for finisher in self.finishers:
+            finisher.join()
+
+
+def read_index(base_dir):
+    # (segment, start, end, rows) of every closed segment
+    path = f'{base_dir}/index.csv'
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [(row[0], float(row[1]), float(row[2]), int(row[3])) for row in reader if len(row) == 4]
+
+
+def segment_timestamps(path):
+    if '.bin' in path:
+        return read_binary(path)['timestamp']
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return np.array([float(row[0]) for row in reader if row])
+
+
+def newest_timestamp(sink):
+    # Timestamp of the last row a sink's table already held when it was opened,
+    # read from the index or the end of the file rather than the whole table
+    if isinstance(sink, SegmentedSink):
+        return max((last for _, _, last, _ in read_index(sink.base_dir)), default=None)
+    if isinstance(sink, BinarySink):
+        _, _, offset = read_binary_header(sink.path)
+        count = (os.path.getsize(sink.path) - offset) // sink.record.size
+        if not count:
+            return None
+        with open(sink.path, 'rb') as f:
+            f.seek(offset + (count - 1) * sink.record.size)
+            return sink.record.unpack(f.read(sink.record.size))[0]
+    with open(sink.path, 'rb') as f:
+        f.seek(max(os.path.getsize(sink.path) - 65536, 0))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        try:
+            return float(line.split(b',', 1)[0])
+        except ValueError:
+            continue
+    return None
+
+
+def find_segments(base_dir, start=None, end=None):
+    # Paths of the segments holding rows in [start, end), oldest first. Closed
+    # segments are selected from the index alone; segments not indexed yet
+    # (the open one, or one still being compressed) are assumed to run from
+    # the time in their name to now.
+    start = float('-inf') if start is None else start
+    end = float('inf') if end is None else end
+    entries = read_index(base_dir)
+    indexed = {entry[0] for entry in entries}
+    segments = {}
+    for name, first, last, _ in entries:
+        if first < end and last >= start:
+            segments[name] = first
+    names = set(os.listdir(base_dir))
+    for name in names:
+        match = SEGMENT_NAME.match(name)
+        if not match or name in indexed or f'{name}.gz' in indexed:
+            continue
+        if match.group(4) and name[:-3] in names:
+            # Compressed copy of a segment whose original is not removed yet
+            continue
+        first = int(match.group(1)) / 1000
+        if first < end:
+            segments[name] = first
+    ordered = sorted(segments, key=lambda name: (segments[name], segment_order(name)))
+    return [f'{base_dir}/{name}' for name in ordered if os.path.exists(f'{base_dir}/{name}')]
+
+
+def segment_order(name):
+    # Sort key of a segment name: opening time, then the -n suffix
+    match = SEGMENT_NAME.match(name)
+    return int(match.group(1)), int(match.group(2) or 0)
+
+
+def open_sink(path_base, columns, output_config=None, types=None, datetime_column=True, before_flush=None):
+    output_config = output_config or {}
+    fmt = output_config.get('format', 'csv')
+    flush_rows = output_config.get('flush_rows', 100)
+    flush_interval = output_config.get('flush_interval', 5.0)
+    rotate_interval = output_config.get('rotate_interval')
+    rotate_bytes = output_config.get('rotate_bytes')
+
+    if fmt not in ('csv', 'binary'):
+        raise ValueError(f"Unknown output format: {fmt}")
+    if fmt == 'binary' and types is not None:
+        extension = '.bin'
+        open_segment = lambda path: BinarySink(path, columns, types, flush_rows, flush_interval, before_flush)
+    else:
+        extension = '.csv'
+        open_segment = lambda path: CsvSink(path, columns, flush_rows, flush_interval, datetime_column, before_flush)
+
+    if rotate_interval or rotate_bytes:
+        return SegmentedSink(path_base, extension, open_segment, rotate_interval, rotate_bytes,
+                             output_config.get('compress', True))
+    return open_segment(f'{path_base}{extension}')
+
+
+# Per-device vectors (one value per CPU, disk or NIC for every field) stored
+# column-wise: each field is an append-only file of fixed-width values, one
+# row of len(devices) values per tick, so a field loads as a (ticks, devices)
+# matrix with a single np.fromfile. A new segment directory is started
+# whenever the device list changes (hotplug, container veths) and, when
+# rotate_interval is set, at every multiple of it so time ranges can skip
+# whole segments. Segments stay uncompressed to keep them mappable. Like
+# SegmentedSink's, a segment directory is named after its first timestamp in
+# ms, with a -n suffix rather than reusing the directory of an earlier one.
+class DeviceSink:
+    def __init__(self, base_dir, fields, types, flush_rows=100, flush_interval=5.0, rotate_interval=None):
+        self.base_dir = base_dir
+        self.fields = list(fields)
+        self.types = types
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_interval = rotate_interval
+        self.segment_end = float('inf')
+        self.devices = None
+        self.files = {}
+        self.buffers = {}
+        self.pending = 0
+        self.bytes_written = 0
+        self.first_pending = None
+        self.lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _start_segment(self, timestamp, devices):
+        self._close_files()
+        self.devices = list(devices)
+        if self.rotate_interval:
+            self.segment_end = (timestamp // self.rotate_interval + 1) * self.rotate_interval
+        name = str(int(timestamp * 1000))
+        suffix = 0
+        while os.path.exists(f'{self.base_dir}/{name}'):
+            suffix += 1
+            name = f'{int(timestamp * 1000)}-{suffix}'
+        segment_dir = f'{self.base_dir}/{name}'
+        os.makedirs(segment_dir)
+        with open(f'{segment_dir}/meta.json', 'w') as f:
+            json.dump({'devices': self.devices, 'fields': self.fields, 'types': self.types}, f)
+
+        self.files = {'timestamp': open(f'{segment_dir}/timestamp.bin', 'ab')}
+        self.buffers = {'timestamp': array('d')}
+        for field, code in zip(self.fields, self.types):
+            self.files[field] = open(f'{segment_dir}/{field}.bin', 'ab')
+            self.buffers[field] = array(code)
+
+    def write(self, timestamp, devices, rows):
+        with self.lock:
+            if devices != self.devices or timestamp >= self.segment_end:
+                self._start_segment(timestamp, devices)
+            if not self.pending:
+                self.first_pending = time.monotonic()
+
+            self.buffers['timestamp'].append(timestamp)
+            for i, field in enumerate(self.fields):
+                self.buffers[field].extend([row[i] for row in rows])
+            self.pending += 1
+
+            if self.pending >= self.flush_rows or time.monotonic() - self.first_pending >= self.flush_interval:
+                self._flush()
+
+    def _flush(self, durable=False):
+        for name, buffer in self.buffers.items():
+            if buffer:
+                buffer.tofile(self.files[name])
+                self.bytes_written += len(buffer) * buffer.itemsize
+                del buffer[:]
+            self.files[name].flush()
+            if durable:
+                os.fsync(self.files[name].fileno())
+        self.pending = 0
+
+    def _close_files(self):
+        self._flush(durable=True)
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def flush(self, durable=False):
+        with self.lock:
+            self._flush(durable)
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+
+
+DEVICE_SEGMENT_NAME = re.compile(r'^\d+(?:-\d+)?$')
+
+
+def read_device_segments(base_dir, fields=None, start=None, end=None):
+    # Segments overlapping [start, end); a segment runs until the next one
+    # starts, or within the same ms when that one has a -n suffix
+    start = float('-inf') if start is None else start
+    end = float('inf') if end is None else end
+    names = sorted((n for n in os.listdir(base_dir)
+                    if DEVICE_SEGMENT_NAME.match(n) and os.path.isfile(f'{base_dir}/{n}/meta.json')),
+                   key=lambda n: tuple(int(part) for part in n.split('-')))
+    bounds = [int(n.split('-')[0]) / 1000 for n in names] + [float('inf')]
+
+    segments = []
+    for i, name in enumerate(names):
+        if bounds[i] >= end or bounds[i + 1] + 0.001 <= start:
+            continue
+        segment_dir = f'{base_dir}/{name}'
+        with open(f'{segment_dir}/meta.json') as f:
+            meta = json.load(f)
+        wanted = [fl for fl in meta['fields'] if fields is None or fl in fields]
+        n_devices = len(meta['devices'])
+
+        timestamps = np.fromfile(f'{segment_dir}/timestamp.bin', dtype='<f8')
+        columns = {}
+        for field in wanted:
+            code = meta['types'][meta['fields'].index(field)]
+            columns[field] = np.fromfile(f'{segment_dir}/{field}.bin', dtype=BINARY_DTYPES[code])
+        # A crash mid-flush can leave columns of different lengths
+        ticks = min([len(timestamps)] + [len(c) // max(n_devices, 1) for c in columns.values()])
+        columns = {f: c[:ticks * n_devices].reshape(ticks, n_devices) for f, c in columns.items()}
+        timestamps = timestamps[:ticks]
+        keep = (timestamps >= start) & (timestamps < end)
+        if not keep.all():
+            timestamps = timestamps[keep]
+            columns = {f: c[keep] for f, c in columns.items()}
+        segments.append((timestamps, meta['devices'], columns))
+    return segments
+
+
+def read_device_series(base_dir, fields=None, start=None, end=None):
+    segments = read_device_segments(base_dir, fields, start, end)
+    if not segments:
+        return np.empty(0), [], {}
+    if len(segments) == 1:
+        return segments[0]
+
+    # Align segments on the union of devices, NaN where a device was absent
+    devices = []
+    for _, segment_devices, _ in segments:
+        devices.extend(d for d in segment_devices if d not in devices)
+    index = {d: i for i, d in enumerate(devices)}
+
+    timestamps = np.concatenate([s[0] for s in segments])
+    columns = {}
+    for field in segments[0][2]:
+        matrix = np.full((len(timestamps), len(devices)), np.nan)
+        row = 0
+        for segment_timestamps, segment_devices, segment_columns in segments:
+            ticks = len(segment_timestamps)
+            matrix[row:row + ticks, [index[d] for d in segment_devices]] = segment_columns[field]
+            row += ticks
+        columns[field] = matrix
+    return timestamps, devices, columns
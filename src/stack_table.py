@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import csv
+import fcntl
+import hashlib
+import io
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from src.sinks import CsvSink
+
+
+# Maps distinct values to small integer ids. New entries are appended to a
+# CSV dictionary file (id, columns...) the first time they are seen, and the
+# file is reloaded on start so ids stay stable across collector restarts.
+# The first key_columns columns identify an entry, the rest are payload.
+# Several processes may intern into one file (the JFR reader next to a
+# running collector): ids are assigned under an flock on the file, after
+# reading what the others appended, and written through before it is
+# released. Keys are compared as the strings the file holds.
+class InternTable:
+    def __init__(self, path, columns, key_columns=None):
+        self.path = path
+        self.key_columns = key_columns or len(columns)
+        self.ids = {}
+        self.next_id = 0
+        # Bytes of the file read into ids so far
+        self.loaded = 0
+        self.lock = threading.Lock()
+        self.file = open(path, 'a+b')
+
+        with self.locked():
+            # Dictionary rows are flushed explicitly once per sample, see flush()
+            self.sink = CsvSink(path, ['id'] + list(columns), flush_rows=10000,
+                                flush_interval=float('inf'), datetime_column=False)
+            self.file.seek(0)
+            header = next(csv.reader([self.file.readline().decode()]), [])
+            if header != ['id'] + list(columns):
+                self.sink.close()
+                self.file.close()
+                raise ValueError(f"{path} has columns {header}, expected {['id'] + list(columns)}")
+            self.reload()
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+
+    def reload(self):
+        # Entries appended since the last read, by this process or another
+        self.file.seek(self.loaded)
+        data = self.file.read()
+        data = data[:data.rfind(b'\n') + 1]
+        reader = csv.reader(io.StringIO(data.decode()))
+        if not self.loaded:
+            next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            entry_id = int(row[0])
+            if entry_id < self.next_id:
+                raise ValueError(f"{self.path}: id {entry_id} is assigned twice")
+            self.ids.setdefault(tuple(row[1:1 + self.key_columns]), entry_id)
+            self.next_id = entry_id + 1
+        self.loaded += len(data)
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def add(self, key, payload=()):
+        key = tuple(str(value) for value in key)
+        with self.locked():
+            self.reload()
+            entry_id = self.ids.get(key)
+            if entry_id is None:
+                entry_id = self.ids[key] = self.next_id
+                self.next_id += 1
+                self.sink.write([entry_id, *key, *payload])
+                self.sink.flush()
+                self.loaded = os.fstat(self.file.fileno()).st_size
+        return entry_id
+
+    def intern(self, *key):
+        entry_id = self.ids.get(key)
+        if entry_id is None:
+            entry_id = self.add(key)
+        return entry_id
+
+    def flush(self, durable=False):
+        self.sink.flush(durable)
+
+    def close(self):
+        self.sink.close()
+        self.file.close()
+
+
+# Line number at the end of a frame as printed by jstack and JMX
+# (Foo.java:42, module@1.0/Foo.java:42) or by the JFR reader (line 42)
+FRAME_LINE = re.compile(r'(?::|line )(\d+)\)$')
+
+
+def frame_key(frame):
+    # Class.method:line, the same for one frame whichever tool printed it.
+    # JMX prefixes the class with its loader and module (app//com.Foo.run,
+    # java.base/java.lang.Thread.run) and jstack puts the module inside the
+    # parentheses; hidden classes keep their own slash (Foo$$Lambda/0x...).
+    method = frame.partition('(')[0]
+    segments = method.split('/')
+    while len(segments) > 1 and '$' not in segments[0]:
+        segments.pop(0)
+    match = FRAME_LINE.search(frame)
+    return '/'.join(segments) + (f':{match.group(1)}' if match else '')
+
+
+# Each distinct stack is stored once, keyed by a content hash of its frames.
+# Frames are interned separately, so a stack row is just its hash and the
+# space separated frame ids, outermost call last as printed by jstack.
+# Frames are compared by frame_key, so the same stack sampled through jstack,
+# JMX or JFR gets one id; the frame text kept is whichever was seen first.
+class StackTable:
+    def __init__(self, frames_path, stacks_path):
+        self.frames = InternTable(frames_path, ['frame'])
+        self.stacks = InternTable(stacks_path, ['hash', 'frame_ids'], key_columns=1)
+        self.keys = {}
+        self.frame_ids = {}
+        for (frame,), frame_id in self.frames.ids.items():
+            self.frame_ids.setdefault(self.key(frame), frame_id)
+
+    def key(self, frame):
+        key = self.keys.get(frame)
+        if key is None:
+            key = self.keys[frame] = frame_key(frame)
+        return key
+
+    def intern(self, frames):
+        keys = [self.key(frame) for frame in frames]
+        digest = hashlib.blake2b('\n'.join(keys).encode(), digest_size=8).hexdigest()
+        stack_id = self.stacks.get((digest,))
+        if stack_id is None:
+            frame_ids = []
+            for frame, key in zip(frames, keys):
+                frame_id = self.frame_ids.get(key)
+                if frame_id is None:
+                    frame_id = self.frame_ids[key] = self.frames.intern(frame)
+                frame_ids.append(str(frame_id))
+            stack_id = self.stacks.add((digest,), (' '.join(frame_ids),))
+        return stack_id
+
+    def flush(self, durable=False):
+        # Frames first, so a stack never references a frame that is not on disk
+        self.frames.flush(durable)
+        self.stacks.flush(durable)
+
+    def close(self):
+        self.frames.close()
+        self.stacks.close()
+
+
+# Dictionaries written by the Java collector next to its per-sample tables
+class JavaTables:
+    def __init__(self, output_dir):
+        # Names repeat (pools, restarted workers): a thread is its name and its
+        # thread id ('#12', see parse_thread_dump)
+        self.threads = InternTable(f'{output_dir}/java_thread_names.csv', ['thread_name', 'thread_id'])
+        self.states = InternTable(f'{output_dir}/java_states.csv', ['state'])
+        self.locks = InternTable(f'{output_dir}/java_lock_ids.csv', ['lock_id', 'lock_class'])
+        self.stacks = StackTable(f'{output_dir}/java_frames.csv', f'{output_dir}/java_stacks.csv')
+
+    def thread(self, name, thread_id=None):
+        if name is None:
+            return -1
+        return self.threads.intern(name, thread_id if thread_id is not None else name)
+
+    def flush(self, durable=False):
+        self.stacks.flush(durable)
+        for table in (self.threads, self.states, self.locks):
+            table.flush(durable)
+
+    def close(self):
+        self.stacks.close()
+        for table in (self.threads, self.states, self.locks):
+            table.close()
+
+
+def load_table(path):
+    # id -> list of column values
+    table = {}
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            entry_id = int(row[0])
+            if entry_id in table:
+                raise ValueError(f"{path}: id {entry_id} is assigned twice")
+            table[entry_id] = row[1:]
+    return table
+
+
+def load_stacks(data_dir):
+    # stack id -> list of frames (innermost first)
+    frames = {i: values[0] for i, values in load_table(f'{data_dir}/java_frames.csv').items()}
+    stacks = {}
+    for stack_id, (_, frame_ids) in load_table(f'{data_dir}/java_stacks.csv').items():
+        stacks[stack_id] = [frames[int(i)] for i in frame_ids.split()]
+    return stacks
+
+
+def load_names(data_dir, table):
+    # First payload column of a dictionary, e.g. load_names(dir, 'java_thread_names')
+    return {i: values[0] for i, values in load_table(f'{data_dir}/{table}.csv').items()}
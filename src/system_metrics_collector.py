@@ -3,15 +3,22 @@
 import yaml
 from pathlib import Path
 import time
-import csv
 import os
 import psutil
 import argparse
-from datetime import datetime
-import threading
 import signal
 import sys
 
+from src.scheduler import TickScheduler
+from src.sinks import open_sink, DeviceSink
+from src.downsample import RollupWriter
+from src.alerts import AlertEngine, build_rules
+from src.anomaly import AnomalyMonitor, SYSTEM_SERIES, anomaly_params
+from src.procfs import ProcfsBackend, raise_open_file_limit
+from src.process_metrics import ProcessTracker, PROCESS_COLUMNS
+from src.exporter import MetricsExporter
+from src.push import PushClient, parse_address
+from src.self_metrics import SelfMonitor, self_metrics_params
 
 
 # Load configuration
@@ -21,152 +28,314 @@ def load_config():
         return yaml.safe_load(f)
 
 
+COLUMNS = {
+    'cpu': ['timestamp', 'cpu_percent', 'user', 'system', 'iowait'],
+    'memory': ['timestamp', 'total', 'available', 'used', 'free', 'cached', 'buffers'],
+    'io': ['timestamp', 'read_bytes', 'write_bytes', 'read_count', 'write_count', 'read_time', 'write_time'],
+    'network': ['timestamp', 'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 'errin', 'errout']
+}
+
+# Record layout of each metric when writing the binary format
+BINARY_TYPES = {
+    'cpu': 'dffff',
+    'memory': 'dQQQQQQ',
+    'io': 'dQQQQQQ',
+    'network': 'dQQQQQQ'
+}
+
+
+# Per-device breakdowns, written column-wise by DeviceSink
+DEVICE_COLUMNS = {
+    'percpu': ['cpu_percent', 'user', 'system', 'iowait'],
+    'perdisk': COLUMNS['io'][1:],
+    'pernic': COLUMNS['network'][1:]
+}
+
+DEVICE_TYPES = {
+    'percpu': 'ffff',
+    'perdisk': 'QQQQQQ',
+    'pernic': 'QQQQQQ'
+}
+
+
+class PsutilBackend:
+    name = 'psutil'
+
+    def cpu(self):
+        cpu_times = psutil.cpu_times_percent()
+        cpu_percent = psutil.cpu_percent()
+
+        return [
+            cpu_percent,
+            cpu_times.user,
+            cpu_times.system,
+            cpu_times.iowait
+        ]
+
+    def memory(self):
+        mem = psutil.virtual_memory()
+
+        return [
+            mem.total,
+            mem.available,
+            mem.used,
+            mem.free,
+            mem.cached,
+            mem.buffers if hasattr(mem, 'buffers') else 0
+        ]
+
+    def io(self):
+        io = psutil.disk_io_counters()
+
+        return [
+            io.read_bytes,
+            io.write_bytes,
+            io.read_count,
+            io.write_count,
+            io.read_time,
+            io.write_time
+        ]
+
+    def network(self):
+        net = psutil.net_io_counters()
+
+        return [
+            net.bytes_sent,
+            net.bytes_recv,
+            net.packets_sent,
+            net.packets_recv,
+            net.errin,
+            net.errout
+        ]
+
+    def percpu(self):
+        times = psutil.cpu_times_percent(percpu=True)
+        percents = psutil.cpu_percent(percpu=True)
+
+        return [f'cpu{i}' for i in range(len(times))], [
+            [percent, t.user, t.system, t.iowait]
+            for percent, t in zip(percents, times)
+        ]
+
+    def perdisk(self):
+        disks = psutil.disk_io_counters(perdisk=True)
+
+        return list(disks), [
+            [io.read_bytes, io.write_bytes, io.read_count, io.write_count, io.read_time, io.write_time]
+            for io in disks.values()
+        ]
+
+    def pernic(self):
+        nics = psutil.net_io_counters(pernic=True)
+
+        return list(nics), [
+            [net.bytes_sent, net.bytes_recv, net.packets_sent, net.packets_recv, net.errin, net.errout]
+            for net in nics.values()
+        ]
+
+    def close(self):
+        pass
+
+
+def create_backend(name):
+    if name == 'psutil':
+        return PsutilBackend()
+    if name == 'procfs':
+        return ProcfsBackend()
+    raise ValueError(f"Unknown collection backend: {name}")
+
+
 class MetricsCollector:
-    def __init__(self, output_dir, interval=1):
+    def __init__(self, output_dir, interval=1, metrics=None, output_config=None, backend='psutil',
+                 alert_rules=None, anomaly_params=None, process_top=10, exporter=None,
+                 pusher=None, self_metrics=None, process_max_open=1024):
         self.output_dir = output_dir
         self.interval = interval
         self.running = True
+        self.backend = create_backend(backend)
         os.makedirs(output_dir, exist_ok=True)
 
-        # Initialize file handlers with fixed names
-        self.files = {
-            'cpu': open(f'{output_dir}/cpu_metrics.csv', 'a'),
-            'memory': open(f'{output_dir}/memory_metrics.csv', 'a'),
-            'io': open(f'{output_dir}/io_metrics.csv', 'a'),
-            'network': open(f'{output_dir}/network_metrics.csv', 'a')
+        # Sample functions for each source, in output order
+        self.sources = {
+            'cpu': self.collect_cpu_stats,
+            'memory': self.collect_memory_stats,
+            'io': self.collect_io_stats,
+            'network': self.collect_network_stats
         }
-
-        # Initialize CSV writers
-        self.writers = {
-            'cpu': csv.writer(self.files['cpu']),
-            'memory': csv.writer(self.files['memory']),
-            'io': csv.writer(self.files['io']),
-            'network': csv.writer(self.files['network'])
+        self.device_sources = {
+            'percpu': self.collect_percpu_stats,
+            'perdisk': self.collect_perdisk_stats,
+            'pernic': self.collect_pernic_stats
         }
+        metrics = metrics or list(self.sources)
+        self.metrics = [m for m in metrics if m in self.sources]
+        self.device_metrics = [m for m in metrics if m in self.device_sources]
+
+        # Top processes by CPU, memory, I/O, context switches and threads
+        self.processes = ProcessTracker(process_top, max_open=process_max_open) if 'process' in metrics else None
+
+        # Initialize sinks with fixed names
+        self.sinks = {
+            metric: open_sink(f'{output_dir}/{metric}_metrics', COLUMNS[metric],
+                              output_config, BINARY_TYPES[metric])
+            for metric in self.metrics
+        }
+        output_config = output_config or {}
+        self.device_sinks = {
+            metric: DeviceSink(f'{output_dir}/{metric}_metrics', DEVICE_COLUMNS[metric], DEVICE_TYPES[metric],
+                               output_config.get('flush_rows', 100), output_config.get('flush_interval', 5.0),
+                               output_config.get('rotate_interval'))
+            for metric in self.device_metrics
+        }
+        self.process_sink = open_sink(f'{output_dir}/process_metrics', PROCESS_COLUMNS,
+                                      output_config) if self.processes else None
 
-        # Write headers only if files are empty
-        self._write_headers_if_empty()
+        # 1 min / 10 min / 1 h aggregates maintained as samples arrive, for long-range plots
+        rollup_tiers = output_config.get('rollups')
+        self.rollups = {
+            metric: RollupWriter(f'{output_dir}/{metric}', COLUMNS[metric][1:], rollup_tiers, output_config)
+            for metric in self.metrics
+        } if rollup_tiers else {}
 
-    def _write_headers_if_empty(self):
-        headers = {
-            'cpu': ['timestamp', 'datetime', 'cpu_percent', 'user', 'system', 'iowait'],
-            'memory': ['timestamp', 'datetime', 'total', 'available', 'used', 'free', 'cached', 'buffers'],
-            'io': ['timestamp', 'datetime', 'read_bytes', 'write_bytes', 'read_count', 'write_count', 'read_time', 'write_time'],
-            'network': ['timestamp', 'datetime', 'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 'errin', 'errout']
-        }
+        # Threshold rules checked against every sample as it is taken
+        self.alerts = AlertEngine(alert_rules or [], COLUMNS, output_dir, output_config)
 
-        for metric_type, header in headers.items():
-            if os.path.getsize(f'{self.output_dir}/{metric_type}_metrics.csv') == 0:
-                self.writers[metric_type].writerow(header)
+        # Spikes and level shifts found without configured thresholds
+        self.anomalies = None
+        if anomaly_params is not None:
+            self.anomalies = AnomalyMonitor(SYSTEM_SERIES, {m: COLUMNS[m] for m in self.metrics}, output_dir,
+                                            output_config, params=anomaly_params)
+
+        # Latest samples served over HTTP (MetricsExporter), fed once per tick
+        self.exporter = exporter
+
+        # Batches pushed to a central aggregator (PushClient), fed once per tick
+        self.pusher = pusher
+
+        # The collector's own CPU, memory, per-source latency and tick lateness
+        self.monitor = None
+        if self_metrics is not None:
+            self.monitor = SelfMonitor(output_dir, output_config, 'collector', writers=self.writers, **self_metrics)
+
+        self.scheduler = TickScheduler(self.interval, self.sample, name='system-sampler', monitor=self.monitor)
 
     def collect_cpu_stats(self):
-        while self.running:
-            try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                cpu_times = psutil.cpu_times_percent()
-                cpu_percent = psutil.cpu_percent()
-
-                self.writers['cpu'].writerow([
-                    timestamp,
-                    datetime_str,
-                    cpu_percent,
-                    cpu_times.user,
-                    cpu_times.system,
-                    cpu_times.iowait
-                ])
-                self.files['cpu'].flush()
-                time.sleep(self.interval)
-            except Exception as e:
-                print(f"Error collecting CPU stats: {e}")
+        return self.backend.cpu()
 
     def collect_memory_stats(self):
-        while self.running:
-            try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                mem = psutil.virtual_memory()
-
-                self.writers['memory'].writerow([
-                    timestamp,
-                    datetime_str,
-                    mem.total,
-                    mem.available,
-                    mem.used,
-                    mem.free,
-                    mem.cached,
-                    mem.buffers if hasattr(mem, 'buffers') else 0
-                ])
-                self.files['memory'].flush()
-                time.sleep(self.interval)
-            except Exception as e:
-                print(f"Error collecting memory stats: {e}")
+        return self.backend.memory()
 
     def collect_io_stats(self):
-        while self.running:
-            try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                io = psutil.disk_io_counters()
-
-                self.writers['io'].writerow([
-                    timestamp,
-                    datetime_str,
-                    io.read_bytes,
-                    io.write_bytes,
-                    io.read_count,
-                    io.write_count,
-                    io.read_time,
-                    io.write_time
-                ])
-                self.files['io'].flush()
-                time.sleep(self.interval)
-            except Exception as e:
-                print(f"Error collecting I/O stats: {e}")
+        return self.backend.io()
 
     def collect_network_stats(self):
-        while self.running:
+        return self.backend.network()
+
+    def collect_percpu_stats(self):
+        return self.backend.percpu()
+
+    def collect_perdisk_stats(self):
+        return self.backend.perdisk()
+
+    def collect_pernic_stats(self):
+        return self.backend.pernic()
+
+    def measure(self, source, start):
+        if self.monitor:
+            self.monitor.record(source, time.perf_counter() - start)
+
+    def failed(self, source, e):
+        print(f"Error collecting {source} stats: {e}")
+        if self.monitor:
+            self.monitor.error(source)
+
+    def sample(self, timestamp):
+        # One shared timestamp for every source so the series line up
+        tick_start = time.perf_counter()
+        published = {}
+        for metric in self.metrics:
+            start = time.perf_counter()
+            try:
+                row = self.sources[metric]()
+            except Exception as e:
+                self.failed(metric, e)
+                continue
+            self.measure(metric, start)
+            self.sinks[metric].write([timestamp] + row)
+            published[metric] = [timestamp] + row
+            if metric in self.rollups:
+                self.rollups[metric].add([timestamp] + row)
+            self.alerts.observe(metric, [timestamp] + row)
+            if self.anomalies:
+                self.anomalies.observe(metric, [timestamp] + row)
+
+        for metric in self.device_metrics:
+            start = time.perf_counter()
             try:
-                timestamp = time.time()
-                datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                net = psutil.net_io_counters()
-
-                self.writers['network'].writerow([
-                    timestamp,
-                    datetime_str,
-                    net.bytes_sent,
-                    net.bytes_recv,
-                    net.packets_sent,
-                    net.packets_recv,
-                    net.errin,
-                    net.errout
-                ])
-                self.files['network'].flush()
-                time.sleep(self.interval)
+                devices, rows = self.device_sources[metric]()
             except Exception as e:
-                print(f"Error collecting network stats: {e}")
+                self.failed(metric, e)
+                continue
+            self.measure(metric, start)
+            self.device_sinks[metric].write(timestamp, devices, rows)
+
+        process_rows = None
+        if self.processes:
+            start = time.perf_counter()
+            try:
+                process_rows = self.processes.sample(timestamp)
+                for row in process_rows:
+                    self.process_sink.write(row)
+                self.measure('process', start)
+            except Exception as e:
+                self.failed('process', e)
 
-    def start_collection(self):
-        self.threads = [
-            threading.Thread(target=self.collect_cpu_stats, name="cpu"),
-            threading.Thread(target=self.collect_memory_stats, name="memory"),
-            threading.Thread(target=self.collect_io_stats, name="io"),
-            threading.Thread(target=self.collect_network_stats, name="network")
-        ]
+        if self.exporter:
+            self.exporter.publish(timestamp, published, process_rows)
+        if self.pusher:
+            self.pusher.publish(timestamp, published)
+
+        if self.monitor:
+            # Everything above, including writes, rollups, alerts and anomalies
+            self.measure('tick', tick_start)
+            self.monitor.poll()
 
-        for thread in self.threads:
-            thread.daemon = True
-            thread.start()
+    def writers(self):
+        # Everything that buffers output and must be flushed and closed
+        return (list(self.sinks.values()) + list(self.device_sinks.values()) + list(self.rollups.values())
+                + [self.alerts] + ([self.anomalies] if self.anomalies else [])
+                + ([self.process_sink] if self.process_sink else [])
+                + ([self.monitor] if self.monitor else []))
 
+    def flush(self, durable=True):
+        for sink in self.writers():
+            sink.flush(durable)
+
+    def start_collection(self):
+        self.threads = [self.scheduler.start()]
         return self.threads
 
     def stop_collection(self):
         print("\nStopping metrics collection...")
         self.running = False
-        for thread in self.threads:
-            thread.join()
-        for file in self.files.values():
-            file.close()
+        self.scheduler.stop()
+        if self.exporter:
+            self.exporter.stop()
+        if self.pusher:
+            self.pusher.stop()
+        for sink in self.writers():
+            sink.close()
+        self.backend.close()
+        if self.processes:
+            self.processes.close()
+
+        stats = self.scheduler.stats()
+        print(f"Collected {stats['ticks']} ticks ({stats['missed_ticks']} missed, "
+              f"{stats['late_ticks']} late, max lateness {stats['max_lateness_ms']:.1f} ms)")
+
+def flush_handler(signum, frame):
+    if collector:
+        collector.flush()
 
 def signal_handler(signum, frame):
     print(f"\nReceived signal {signum}")
@@ -181,14 +350,44 @@ def main():
     parser.add_argument('--duration', default=10, type=int)
     parser.add_argument('--interval', type=float,
                         default=config['collection']['system']['interval'])
+    parser.add_argument('--backend', choices=['psutil', 'procfs'],
+                        default=config['collection']['system'].get('backend', 'psutil'))
+    exporter_config = config.get('exporter') or {}
+    parser.add_argument('--exporter-port', type=int,
+                        default=exporter_config.get('port', 9105) if exporter_config.get('enabled') else None,
+                        help='Serve the latest samples over HTTP on this port')
+    push_config = config.get('push') or {}
+    parser.add_argument('--push', metavar='HOST:PORT',
+                        default=push_config.get('address') if push_config.get('enabled') else None,
+                        help='Also send samples to an aggregator (src.aggregator) at this address')
     args = parser.parse_args()
 
+    exporter = None
+    if args.exporter_port is not None:
+        exporter = MetricsExporter(COLUMNS, exporter_config.get('host', '127.0.0.1'), args.exporter_port,
+                                   exporter_config.get('history', 600), args.interval, PROCESS_COLUMNS)
+        exporter.start()
+
+    pusher = None
+    if args.push:
+        pusher = PushClient(parse_address(args.push), COLUMNS, BINARY_TYPES, push_config.get('host'),
+                            push_config.get('spool_dir') or f'{args.output_dir}/push_spool',
+                            push_config.get('spool_bytes', 64 * 1024 * 1024), push_config.get('batch_interval', 5))
+        pusher.start()
+
     global collector
-    collector = MetricsCollector(args.output_dir, args.interval)
+    system_config = config['collection']['system']
+    if system_config.get('raise_open_files'):
+        raise_open_file_limit()
+    collector = MetricsCollector(args.output_dir, args.interval, system_config['metrics'],
+                                 config.get('output'), args.backend, build_rules(config),
+                                 anomaly_params(config), system_config.get('process_top', 10), exporter, pusher,
+                                 self_metrics_params(config), system_config.get('process_max_open', 1024))
 
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGUSR1, flush_handler)
 
     print(f"Starting metrics collection. Data will be saved in {args.output_dir}/")
     print("Press Ctrl+C to stop collection")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import gzip
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.sinks import read_binary, read_binary_header, binary_dtype
+
+# pandas dtypes for the struct codes used in BINARY_TYPES
+STRUCT_DTYPES = {
+    'd': 'float64',
+    'f': 'float32',
+    'q': 'int64',
+    'Q': 'uint64',
+    'i': 'int32',
+    'I': 'uint32'
+}
+
+CACHE_VERSION = 2
+
+
+def table_dtypes(columns, types):
+    return {column: STRUCT_DTYPES[code] for column, code in zip(columns, types)}
+
+
+# Parsed columns of one file, valid up to byte `offset`. Rows parsed by
+# successive loads are kept as separate parts and only concatenated when the
+# frame is asked for; `files` are the parts' (name, rows) in the disk cache.
+class CachedFrame:
+    def __init__(self, identity, head, offset, parts, files=None):
+        self.identity = identity
+        self.head = head
+        self.offset = offset
+        self.parts = parts
+        self.files = files or []
+
+    @property
+    def frame(self):
+        if len(self.parts) > 1:
+            self.parts = [pd.concat(self.parts, ignore_index=True)]
+        return self.parts[0]
+
+
+# Reads metric files into DataFrames, parsing each byte only once. For every
+# (file, column set) it remembers the parsed frame and the byte offset parsed
+# up to, in memory and pickled under cache_dir, so loading a file that has
+# grown only parses the rows appended since. A file is parsed again from the
+# start if it was replaced (different inode or first line) or truncated.
+# Compressed segments never change and are parsed once.
+#
+# On disk each entry is a directory with meta.json and the rows as .npy parts
+# (no pickles: the cache sits in the data directory). A load appends one part
+# with its new rows; a part is merged with the one before it once it is as
+# large, so parts stay few and every row is rewritten only O(log n) times.
+#
+# CSV files are read with explicit dtypes and only the requested columns (the
+# datetime string column is never parsed), new bytes are handled in chunks of
+# chunk_bytes so a large backlog does not have to fit in memory as text.
+class TableLoader:
+    def __init__(self, cache_dir=None, chunk_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.chunk_bytes = chunk_bytes
+        self.memory = {}
+        self.parsed_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def read(self, path, columns=None, dtypes=None):
+        columns = list(columns) if columns else None
+        key = f'{os.path.abspath(path)}|{",".join(columns or [])}'
+        stat = os.stat(path)
+        identity = (stat.st_dev, stat.st_ino)
+
+        cached = self.memory.get(key) or self._load_cached(key)
+        if cached and (cached.identity != identity or stat.st_size < cached.offset
+                       or cached.head != self._head(path)):
+            cached = None
+        if cached and path.endswith('.gz'):
+            return cached.frame
+
+        if path.endswith('.gz'):
+            frame = self._read_compressed(path, columns, dtypes)
+            cached = CachedFrame(identity, self._head(path), stat.st_size, [frame])
+            self._store(key, cached, frame)
+            return frame
+
+        offset = cached.offset if cached else 0
+        if stat.st_size > offset:
+            if path.endswith('.bin'):
+                new_frame, offset = self._read_binary_from(path, offset, stat.st_size, columns)
+            else:
+                new_frame, offset = self._read_csv_from(path, offset, stat.st_size, columns, dtypes)
+            if cached is None:
+                cached = CachedFrame(identity, self._head(path), offset, [new_frame])
+                self._store(key, cached, new_frame)
+            else:
+                if len(new_frame):
+                    cached.parts.append(new_frame)
+                cached.offset = offset
+                self._store(key, cached, new_frame if len(new_frame) else None)
+        elif cached is None:
+            cached = CachedFrame(identity, self._head(path), 0, [pd.DataFrame(columns=columns or [])])
+        return cached.frame
+
+    def _head(self, path):
+        # First bytes of the (compressed) file, identifying it beyond its inode
+        with open(path, 'rb') as f:
+            return f.read(64)
+
+    def _header(self, path):
+        with open(path, 'rb') as f:
+            line = f.readline()
+        return line.decode().rstrip('\r\n').split(','), len(line)
+
+    def _read_csv_from(self, path, offset, size, columns, dtypes):
+        names, header_bytes = self._header(path)
+        offset = max(offset, header_bytes)
+        usecols = columns or [name for name in names if name != 'datetime']
+        dtype = {c: t for c, t in (dtypes or {}).items() if c in usecols}
+
+        chunks = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                data = f.read(min(self.chunk_bytes, size - offset))
+                if not data:
+                    break
+                # Only whole lines; a row still being written is read next time
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    if len(data) < self.chunk_bytes:
+                        break
+                    # A single line longer than a chunk: read on to its end
+                    data += f.readline()
+                    end = len(data) if data.endswith(b'\n') else 0
+                    if end == 0:
+                        break
+                f.seek(offset + end)
+                self.parsed_bytes += end
+                chunks.append(pd.read_csv(io.BytesIO(data[:end]), header=None, names=names,
+                                          usecols=usecols, dtype=dtype))
+                offset += end
+
+        frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=usecols)
+        return frame[usecols], offset
+
+    def _read_binary_from(self, path, offset, size, columns):
+        names, types, header_bytes = read_binary_header(path)
+        dtype = binary_dtype(names, types)
+        offset = max(offset, header_bytes)
+        count = (size - offset) // dtype.itemsize
+        records = np.fromfile(path, dtype=dtype, count=count, offset=offset)
+        self.parsed_bytes += count * dtype.itemsize
+        frame = pd.DataFrame(records[columns] if columns else records)
+        return frame, offset + count * dtype.itemsize
+
+    def _read_compressed(self, path, columns, dtypes):
+        if '.bin' in path:
+            records = read_binary(path)
+            return pd.DataFrame(records[columns] if columns else records)
+        names, _ = self._compressed_header(path)
+        usecols = columns or [name for name in names if name != 'datetime']
+        dtype = {c: t for c, t in (dtypes or {}).items() if c in usecols}
+        self.parsed_bytes += os.path.getsize(path)
+        return pd.read_csv(path, usecols=usecols, dtype=dtype)[usecols]
+
+    def _compressed_header(self, path):
+        with gzip.open(path, 'rb') as f:
+            line = f.readline()
+        return line.decode().rstrip('\r\n').split(','), len(line)
+
+    def _cache_path(self, key):
+        return f'{self.cache_dir}/{hashlib.sha1(key.encode()).hexdigest()}'
+
+    def _load_cached(self, key):
+        if not self.cache_dir:
+            return None
+        cache_path = self._cache_path(key)
+        try:
+            with open(f'{cache_path}/meta.json') as f:
+                meta = json.load(f)
+            if meta['version'] != CACHE_VERSION:
+                return None
+            parts = [read_part(f'{cache_path}/{name}', meta['columns']) for name, _ in meta['files']]
+        except (OSError, ValueError, KeyError):
+            return None
+        cached = CachedFrame(tuple(meta['identity']), bytes.fromhex(meta['head']), meta['offset'],
+                             parts or [pd.DataFrame(columns=meta['columns'])], [tuple(f) for f in meta['files']])
+        self.memory[key] = cached
+        return cached
+
+    def _store(self, key, cached, new_frame):
+        # Writes new_frame as a part after the cached ones (all of them when
+        # the entry is new), merges parts, then commits by replacing meta.json
+        self.memory[key] = cached
+        if not self.cache_dir:
+            return
+        cache_path = self._cache_path(key)
+        stale = []
+        if not cached.files:
+            if os.path.isdir(cache_path):
+                stale = [name for name in os.listdir(cache_path) if name.endswith('.npy')]
+            os.makedirs(cache_path, exist_ok=True)
+        # Part names are never reused, so meta.json never points at a part
+        # that was overwritten after it was written
+        names = [name for name, _ in cached.files] + stale
+        counter = [max((int(name.split('.')[0]) for name in names), default=-1) + 1]
+
+        def write(frame):
+            name = f'{counter[0]:06d}.npy'
+            counter[0] += 1
+            write_part(f'{cache_path}/{name}', frame)
+            return name, len(frame)
+
+        if new_frame is not None:
+            cached.files.append(write(new_frame))
+            while len(cached.files) > 1 and cached.files[-1][1] >= cached.files[-2][1]:
+                merged = [read_part(f'{cache_path}/{name}', list(new_frame.columns)) for name, _ in cached.files[-2:]]
+                stale += [name for name, _ in cached.files[-2:]]
+                cached.files[-2:] = [write(pd.concat(merged, ignore_index=True))]
+
+        columns = list(cached.parts[0].columns) if cached.parts else []
+        meta = {'version': CACHE_VERSION, 'identity': list(cached.identity), 'head': cached.head.hex(),
+                'offset': cached.offset, 'columns': columns, 'files': cached.files}
+        with open(f'{cache_path}/meta.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(f'{cache_path}/meta.json.tmp', f'{cache_path}/meta.json')
+        for name in stale:
+            os.remove(f'{cache_path}/{name}')
+
+
+def write_part(path, frame):
+    # One structured .npy per part; text columns as unicode plus a null mask,
+    # so reading never needs pickle
+    arrays = []
+    names = []
+    for column in frame.columns:
+        values = frame[column].to_numpy()
+        if values.dtype == object:
+            nulls = pd.isna(values)
+            arrays.append(nulls)
+            names.append(f'{column}.null')
+            values = np.where(nulls, '', values).astype(str)
+        arrays.append(values)
+        names.append(column)
+    records = np.empty(len(frame), dtype=[(name, values.dtype) for name, values in zip(names, arrays)])
+    for name, values in zip(names, arrays):
+        records[name] = values
+    with open(f'{path}.tmp', 'wb') as f:
+        np.save(f, records, allow_pickle=False)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_part(path, columns):
+    records = np.load(path, allow_pickle=False)
+    data = {}
+    for column in columns:
+        values = records[column]
+        if f'{column}.null' in records.dtype.names:
+            # Same dtype as read_csv gives text (object, or str on pandas 3)
+            values = pd.Series(values).mask(records[f'{column}.null'])
+        data[column] = values
+    return pd.DataFrame(data, columns=columns)
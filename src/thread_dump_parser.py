@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import re
+
+# "name" #12 daemon prio=5 os_prio=0 cpu=1.2ms elapsed=3.4s tid=0x... nid=0x... waiting for monitor entry  [0x...]
+# JDK 19+ adds the OS thread id after the thread number and prints nid in decimal:
+# "name" #12 [4711] daemon prio=5 os_prio=0 ... nid=4711 waiting for monitor entry  [0x...]
+# and virtual thread headers say "virtual" where platform ones may say "daemon".
+# VM internal threads have no "#n" and no prio, e.g. "VM Thread" os_prio=0 ... nid=0x... runnable
+THREAD_HEADER = re.compile(r'"(.*)"(?: #(\d+))?(?: \[\d+\])?(?: daemon| virtual)* (?:prio|os_prio|cpu|tid)=')
+NID = re.compile(r' nid=(\S+)')
+
+#	- waiting to lock <0x000000071ab0e2a8> (a java.lang.Object)
+# and, under "Locked ownable synchronizers:", just "- <0x...> (a ...)"
+LOCK_LINE = re.compile(r'- ([a-z() -]*?) *<(0x[0-9a-f]+)> \(a ([^)]+)\)')
+
+STATE_PREFIX = 'java.lang.Thread.State: '
+SYNCHRONIZERS_HEADER = 'Locked ownable synchronizers:'
+DEADLOCK_SECTION = 'Found '
+
+# Lock lines that mean the thread cannot run until the lock owner releases it
+BLOCKING_KINDS = {'waiting to lock', 'waiting to re-lock in wait()', 'parking to wait for'}
+WAITING_KINDS = BLOCKING_KINDS | {'waiting on'}
+
+
+# Parses `jstack -l` output line by line, so it can consume the tool's stdout
+# directly without holding the whole dump in memory. Only lines that can
+# carry information are run through a (precompiled) pattern; the first
+# character of the stripped line decides which one.
+#
+# Thread names are not unique (pools, user-set names), so threads are told
+# apart by thread_id: the Java thread number ('#12'), or the native id
+# ('nid=0x1a2b') for VM threads that have none. Lock owners and waiters carry
+# both the id and the name.
+def parse_thread_dump(lines):
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    threads_info = []
+    lock_info = []
+    owners = {}
+    current_thread = None
+    waiting_on = None
+    in_synchronizers = False
+
+    for line in lines:
+        if line.startswith('"'):
+            match = THREAD_HEADER.match(line) if 'nid=' in line else None
+            if match:
+                number = match.group(2)
+                if number:
+                    thread_id = f'#{number}'
+                else:
+                    nid = NID.search(line)
+                    thread_id = f'nid={nid.group(1)}' if nid else match.group(1)
+                current_thread = {
+                    'thread_id': thread_id,
+                    'name': match.group(1),
+                    'state': 'RUNNABLE' if line.rstrip().endswith('runnable') else 'UNKNOWN',
+                    'waited_count': 0,
+                    'blocked_count': 0,
+                    'blocked_time': 0,
+                    'stack': []
+                }
+                threads_info.append(current_thread)
+                waiting_on = None
+                in_synchronizers = False
+            continue
+
+        if current_thread is None:
+            continue
+        if line.startswith('\tat '):
+            current_thread['stack'].append(line[4:].rstrip())
+            continue
+
+        stripped = line.strip()
+        if not stripped:
+            continue
+        first = stripped[0]
+
+        if first == '-':
+            match = LOCK_LINE.match(stripped)
+            if not match:
+                continue
+            kind, lock_id, lock_class = match.groups()
+            if in_synchronizers or kind == 'locked':
+                # Object.wait() frames also print "- locked" for the monitor the
+                # thread released while waiting; that thread is not the owner
+                if lock_id != waiting_on:
+                    owners[lock_id] = current_thread
+            elif kind in WAITING_KINDS:
+                if kind in ('waiting on', 'waiting to re-lock in wait()'):
+                    waiting_on = lock_id
+                lock_info.append({
+                    'thread_id': current_thread['thread_id'],
+                    'thread_name': current_thread['name'],
+                    'lock_id': lock_id,
+                    'lock_class': lock_class,
+                    'owner_id': None,
+                    'owner_thread': None,
+                    'blocking': kind in BLOCKING_KINDS
+                })
+        elif first == 'j' and stripped.startswith(STATE_PREFIX):
+            current_thread['state'] = stripped[len(STATE_PREFIX):].split(' ', 1)[0]
+        elif first == 'L' and stripped == SYNCHRONIZERS_HEADER:
+            in_synchronizers = True
+        elif first == 'F' and stripped.startswith(DEADLOCK_SECTION):
+            # jstack's own deadlock report; we compute ours from the graph
+            break
+
+    for lock in lock_info:
+        owner = owners.get(lock['lock_id'])
+        if owner is not None:
+            lock['owner_id'] = owner['thread_id']
+            lock['owner_thread'] = owner['name']
+
+    return threads_info, lock_info
+
+
+def _label(name, thread_id):
+    return name if name == thread_id else f'{name} {thread_id}'
+
+
+def summarize_locks(lock_info):
+    # One entry per lock id that has waiters: class, owner and waiter count
+    summary = {}
+    for lock in lock_info:
+        entry = summary.get(lock['lock_id'])
+        if entry is None:
+            entry = summary[lock['lock_id']] = {
+                'lock_id': lock['lock_id'],
+                'lock_class': lock['lock_class'],
+                'owner_id': lock.get('owner_id'),
+                'owner_thread': lock['owner_thread'],
+                'waiters': 0
+            }
+        entry['waiters'] += 1
+    return list(summary.values())
+
+
+def find_deadlocks(lock_info):
+    # Waits-for graph: blocked thread -> owner of the lock it is blocked on,
+    # by thread id. Each thread waits on at most one lock, so every node has at
+    # most one outgoing edge and a deadlock is simply a cycle reached by
+    # following them. Cycles are reported as 'name #id' labels.
+    waits_for = {}
+    names = {}
+    for lock in lock_info:
+        thread = lock.get('thread_id') or lock['thread_name']
+        owner = lock.get('owner_id') or lock['owner_thread']
+        names[thread] = lock['thread_name']
+        if lock.get('blocking', True) and owner and owner != thread:
+            waits_for[thread] = owner
+            names.setdefault(owner, lock['owner_thread'])
+
+    deadlocks = []
+    visited = set()
+    for start in waits_for:
+        if start in visited:
+            continue
+        path = {}
+        thread = start
+        while thread in waits_for and thread not in visited and thread not in path:
+            path[thread] = len(path)
+            thread = waits_for[thread]
+        if thread in path:
+            # Rotate so the same cycle is always reported the same way
+            cycle = list(path)[path[thread]:]
+            first = cycle.index(min(cycle))
+            deadlocks.append([_label(names[t], t) for t in cycle[first:] + cycle[:first]])
+        visited.update(path)
+
+    return deadlocks
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import gzip
+import hashlib
+import html
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from src.sinks import read_binary, find_segments
+from src.stack_table import load_stacks, load_names
+
+# Stack id standing for all stacks pruned from a bucket
+PRUNED_STACK = -1
+PRUNED_FRAME = '[pruned rare stacks]'
+
+PROFILE_COLUMNS = ['bucket', 'state_id', 'stack_id', 'count']
+
+
+# Folds every thread of every dump into a (state, stack) -> count map for the
+# current time bucket. When a sample lands in a new bucket the previous one is
+# written to the sink and dropped, so memory is bounded by one bucket. Within
+# a bucket at most max_stacks distinct entries are kept; the rarest ones are
+# merged into a per-state PRUNED_STACK entry so totals stay exact.
+class WallClockProfiler:
+    def __init__(self, sink, bucket_seconds=60, max_stacks=5000):
+        self.sink = sink
+        self.bucket_seconds = bucket_seconds
+        self.max_stacks = max_stacks
+        self.bucket = None
+        self.counts = defaultdict(int)
+
+    def add(self, timestamp, state_id, stack_id):
+        bucket = int(timestamp // self.bucket_seconds) * self.bucket_seconds
+        if bucket != self.bucket:
+            self.flush_bucket()
+            self.bucket = bucket
+        self.counts[(state_id, stack_id)] += 1
+
+    def end_sample(self):
+        # Prune lazily, once the bucket is well past its budget
+        if len(self.counts) > 2 * self.max_stacks:
+            self.prune()
+
+    def prune(self):
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        self.counts = defaultdict(int, ranked[:self.max_stacks])
+        for (state_id, _), count in ranked[self.max_stacks:]:
+            self.counts[(state_id, PRUNED_STACK)] += count
+
+    def flush_bucket(self):
+        if self.bucket is None:
+            return
+        if len(self.counts) > self.max_stacks:
+            self.prune()
+        for (state_id, stack_id), count in self.counts.items():
+            self.sink.write([self.bucket, state_id, stack_id, count])
+        self.counts = defaultdict(int)
+        self.bucket = None
+
+    def close(self):
+        self.flush_bucket()
+
+
+def load_profile(data_dir, start=None, end=None, states=None):
+    # Sum the stored buckets in [start, end) into (state, stack) -> count
+    state_names = load_names(data_dir, 'java_states')
+    counts = defaultdict(int)
+    for bucket, state_id, stack_id, count in _profile_rows(data_dir, start, end):
+        bucket = float(bucket)
+        if (start is not None and bucket < start) or (end is not None and bucket >= end):
+            continue
+        state = state_names[int(state_id)]
+        if states and state not in states:
+            continue
+        counts[(state, int(stack_id))] += int(count)
+    return counts
+
+
+def _profile_rows(data_dir, start=None, end=None):
+    if os.path.isdir(f'{data_dir}/java_profile'):
+        paths = find_segments(f'{data_dir}/java_profile', start, end)
+    elif os.path.exists(f'{data_dir}/java_profile.bin'):
+        paths = [f'{data_dir}/java_profile.bin']
+    else:
+        paths = [f'{data_dir}/java_profile.csv']
+
+    for path in paths:
+        if '.bin' in path:
+            yield from read_binary(path).tolist()
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            yield from reader
+
+
+def _frame_name(frame):
+    # "com.example.Foo.bar(Foo.java:12)" -> "com.example.Foo.bar"
+    name = frame.split('(', 1)[0]
+    return name.replace(';', ':')
+
+
+def collapse(counts, stacks):
+    # Brendan Gregg's collapsed format: "state;root;...;leaf count", root first
+    collapsed = defaultdict(int)
+    for (state, stack_id), count in counts.items():
+        if stack_id == PRUNED_STACK:
+            frames = [PRUNED_FRAME]
+        else:
+            frames = [_frame_name(frame) for frame in reversed(stacks.get(stack_id, []))]
+        collapsed[';'.join([state] + frames)] += count
+    return collapsed
+
+
+def write_collapsed(collapsed, path):
+    with open(path, 'w') as f:
+        for stack, count in sorted(collapsed.items()):
+            f.write(f'{stack} {count}\n')
+
+
+def _flame_layout(collapsed):
+    # Nested call tree -> list of (depth, x, width, name), x/width in samples
+    root = {'count': 0, 'children': {}}
+    for stack, count in collapsed.items():
+        root['count'] += count
+        node = root
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'count': 0, 'children': {}})
+            node['count'] += count
+
+    # Depth first with an explicit stack, as Java stacks can be deeper than
+    # Python's recursion limit; children are pushed in reverse so they come
+    # out in name order
+    boxes = []
+    pending = [(None, root, -1, 0)]
+    while pending:
+        name, node, depth, x = pending.pop()
+        if name is not None:
+            boxes.append((depth, x, node['count'], name))
+        children = []
+        for child_name in sorted(node['children']):
+            child = node['children'][child_name]
+            children.append((child_name, child, depth + 1, x))
+            x += child['count']
+        pending.extend(reversed(children))
+    return root['count'], boxes
+
+
+def _color(name):
+    # Stable warm palette keyed by frame name, like flamegraph.pl
+    value = hashlib.md5(name.encode()).digest()
+    return (205 + value[0] % 50, value[1] % 230, value[2] % 55)
+
+
+def write_svg(collapsed, path, title='Wall-clock profile', width=1200, frame_height=16):
+    total, boxes = _flame_layout(collapsed)
+    depth = max((b[0] for b in boxes), default=0) + 1
+    height = (depth + 2) * frame_height
+    scale = width / max(total, 1)
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="Verdana" font-size="11">',
+        f'<text x="{width / 2}" y="{frame_height}" text-anchor="middle" font-size="14">{html.escape(title)}</text>'
+    ]
+    for level, x, count, name in boxes:
+        box_width = count * scale
+        if box_width < 0.5:
+            continue
+        y = height - (level + 1) * frame_height
+        r, g, b = _color(name)
+        label = html.escape(name)
+        parts.append(f'<g><title>{label} ({count} samples, {count / total * 100:.2f}%)</title>'
+                     f'<rect x="{x * scale:.2f}" y="{y}" width="{box_width:.2f}" height="{frame_height - 1}" '
+                     f'fill="rgb({r},{g},{b})"/>')
+        # Roughly 7px per character at this font size
+        chars = int(box_width / 7)
+        if chars >= 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            parts.append(f'<text x="{x * scale + 3:.2f}" y="{y + frame_height - 4}">{html.escape(text)}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(parts))
+
+
+def write_png(collapsed, path, title='Wall-clock profile', dpi=100):
+    # Imported here so the collector does not pay for matplotlib
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+
+    total, boxes = _flame_layout(collapsed)
+    depth = max((b[0] for b in boxes), default=0) + 1
+    fig, ax = plt.subplots(figsize=(15, max(3, depth * 0.25)))
+    for level, x, count, name in boxes:
+        r, g, b = _color(name)
+        ax.add_patch(Rectangle((x, level), count, 0.95, facecolor=(r / 255, g / 255, b / 255)))
+        if count / max(total, 1) > 0.02:
+            ax.text(x + total * 0.002, level + 0.45, name, fontsize=6, va='center', clip_on=True)
+    ax.set_xlim(0, max(total, 1))
+    ax.set_ylim(0, depth)
+    ax.set_yticks([])
+    ax.set_xlabel('Samples')
+    ax.set_title(title)
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flame graphs from the Java collector\'s sampled thread dumps')
+    parser.add_argument('--data-dir', default='metrics_data')
+    parser.add_argument('--start', help='Window start, epoch seconds or ISO datetime')
+    parser.add_argument('--end', help='Window end (exclusive), epoch seconds or ISO datetime')
+    parser.add_argument('--state', action='append', help='Only include threads in this state (repeatable)')
+    parser.add_argument('--collapsed', help='Write collapsed stacks to this file')
+    parser.add_argument('--svg', help='Write an SVG flame graph to this file')
+    parser.add_argument('--png', help='Write a PNG flame graph to this file')
+    args = parser.parse_args()
+
+    counts = load_profile(args.data_dir, parse_time(args.start), parse_time(args.end), args.state)
+    collapsed = collapse(counts, load_stacks(args.data_dir))
+    print(f"{sum(collapsed.values())} samples, {len(collapsed)} distinct stacks")
+
+    if args.collapsed:
+        write_collapsed(collapsed, args.collapsed)
+    if args.svg:
+        write_svg(collapsed, args.svg)
+    if args.png:
+        write_png(collapsed, args.png)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Records the lock contention fixtures from a real JVM: two threads contend on
+# a Hashtable monitor and a ReentrantLock while JFR records monitor enters and
+# parks (lock_contention.jfr), jstack takes a dump while one waits on the
+# other (lock_contention_jstack.txt), and the JDK's own `jfr print` output is
+# kept as the expected events (lock_contention_jfr.json). Needs jpype and a
+# JDK or runtime with jdk.jfr and jstack, e.g. `pip install jpype1 jdk4py`:
+#
+#   python3 tests/fixtures/record_lock_fixtures.py
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import jdk4py
+import jpype
+import jpype.imports
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+
+SETTINGS = '''<?xml version="1.0" encoding="UTF-8"?>
+<configuration version="2.0" label="Locks" description="Contended monitor enters and parks">
+  <event name="jdk.JavaMonitorEnter">
+    <setting name="enabled">true</setting>
+    <setting name="stackTrace">true</setting>
+    <setting name="threshold">10 ms</setting>
+  </event>
+  <event name="jdk.ThreadPark">
+    <setting name="enabled">true</setting>
+    <setting name="stackTrace">true</setting>
+    <setting name="threshold">10 ms</setting>
+  </event>
+</configuration>
+'''
+
+ROUNDS = 20
+
+
+def tool(name):
+    return os.path.join(jdk4py.JAVA_HOME, 'bin', name)
+
+
+def main():
+    libjvm = next(os.path.join(root, f) for root, _, files in os.walk(jdk4py.JAVA_HOME)
+                  for f in files if f == 'libjvm.so')
+    jpype.startJVM(libjvm, '-Xmx64m', '--enable-native-access=ALL-UNNAMED')
+    from java.nio.file import Files, Path
+    from java.util import Hashtable
+    from java.util.concurrent.locks import ReentrantLock
+    from java.util.function import Function
+    from jdk.jfr import Configuration, Recording
+
+    settings = Files.createTempFile('locks', '.jfc')
+    Files.writeString(settings, SETTINGS)
+    recording = Recording(Configuration.create(settings))
+    recording.start()
+
+    table = Hashtable()
+    lock = ReentrantLock()
+    held = threading.Event()
+    done = threading.Event()
+    dump = []
+
+    @jpype.JImplements(Function)
+    class Slow:
+        # Runs inside the synchronized Hashtable.computeIfAbsent, holding its monitor
+        def __init__(self, seconds):
+            self.seconds = seconds
+
+        @jpype.JOverride
+        def apply(self, key):
+            held.set()
+            time.sleep(self.seconds)
+            return key
+
+    def holder():
+        for i in range(ROUNDS):
+            table.computeIfAbsent(f'k{i}', Slow(1.5 if i == 0 else 0.03))
+            lock.lock()
+            held.set()
+            time.sleep(0.03)
+            lock.unlock()
+            done.wait()
+            done.clear()
+
+    def waiter():
+        for i in range(ROUNDS):
+            held.wait()
+            held.clear()
+            time.sleep(0.005)
+            if i == 0:
+                # Dump once the put below has blocked on the holder's monitor
+                threading.Timer(0.3, lambda: dump.append(subprocess.run(
+                    [tool('jstack'), '-l', str(os.getpid())], capture_output=True, text=True).stdout)).start()
+            table.put(f'w{i}', i)
+            held.wait()
+            held.clear()
+            time.sleep(0.005)
+            lock.lock()
+            lock.unlock()
+            done.set()
+
+    threads = [threading.Thread(target=holder), threading.Thread(target=waiter)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    path = os.path.join(FIXTURES, 'lock_contention.jfr')
+    recording.stop()
+    recording.dump(Path.of(path))
+    recording.close()
+    jpype.shutdownJVM()
+
+    with open(os.path.join(FIXTURES, 'lock_contention_jstack.txt'), 'w') as f:
+        f.write(dump[0])
+    events = print_events(path)
+    print(f"{len(events)} lock events, jstack dump of {len(dump[0])} bytes")
+
+
+def print_events(path):
+    # The recording's lock events as the JDK's own parser sees them
+    printed = json.loads(subprocess.run([tool('jfr'), 'print', '--json', '--stack-depth', '64', '--events',
+                                         'jdk.JavaMonitorEnter,jdk.ThreadPark', path],
+                                        capture_output=True, text=True, check=True).stdout)
+    events = []
+    for event in printed['recording']['events']:
+        values = event['values']
+        owner = values.get('previousOwner')
+        events.append({
+            'event': event['type'],
+            'duration': values['duration'],
+            'thread': values['eventThread']['javaName'],
+            'lock_class': (values.get('monitorClass') or values.get('parkedClass'))['name'],
+            'address': values['address'],
+            'owner': owner['javaName'] if owner else None,
+            'frames': [f"{frame['method']['type']['name']}.{frame['method']['name']}:{frame['lineNumber']}"
+                       for frame in values['stackTrace']['frames']]
+        })
+    with open(os.path.join(FIXTURES, 'lock_contention_jfr.json'), 'w') as f:
+        json.dump(events, f, indent=1)
+    return events
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import csv
+import socket
+import time
+import zlib
+
+import pytest
+
+from src.aggregator import Aggregator
+from src.push import HELLO, MAX_FRAME, PushClient, decode_frame, encode_frame, encode_hello
+from src.system_metrics_collector import BINARY_TYPES, COLUMNS
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def cpu_row(timestamp):
+    return {'cpu': [timestamp, 10.0, 5.0, 4.0, 1.0]}
+
+
+def test_spooled_batches_reach_restarted_aggregator_once(tmp_path):
+    output = tmp_path / 'fleet'
+    aggregator = Aggregator(str(output), '127.0.0.1', 0)
+    aggregator.start()
+    client = PushClient(('127.0.0.1', aggregator.port), COLUMNS, BINARY_TYPES, host='web-1',
+                        spool_dir=str(tmp_path / 'spool'), batch_interval=0.05, max_backoff=1, timeout=2)
+    client.start()
+    for t in range(1, 6):
+        client.publish(1700000000 + t, cpu_row(1700000000 + t))
+    wait_for(lambda: aggregator.partitions and aggregator.partitions['web-1'].rows == 5)
+    port = aggregator.port
+    aggregator.stop()
+
+    # 4 and 5 again, as a resend of batches the old aggregator already wrote
+    for t in range(4, 11):
+        client.publish(1700000000 + t, cpu_row(1700000000 + t))
+        time.sleep(0.1)
+    wait_for(lambda: len(client.spool) or client.pending)
+
+    aggregator = Aggregator(str(output), '127.0.0.1', port)
+    aggregator.start()
+    wait_for(lambda: aggregator.partitions and aggregator.partitions['web-1'].rows == 5)
+    client.stop()
+    aggregator.stop()
+
+    assert not len(client.spool)
+    assert aggregator.partitions['web-1'].duplicates >= 2
+    with open(output / 'host-web-1' / 'cpu_metrics.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['timestamp', 'datetime', 'cpu_percent', 'user', 'system', 'iowait']
+    assert [float(row[0]) for row in rows[1:]] == [1700000000 + t for t in range(1, 11)]
+
+
+@pytest.mark.parametrize('columns, types', [
+    ({'../../../pwn': ['timestamp']}, {'../../../pwn': 'd'}),
+    ({'cpu': ['timestamp', 'cpu_percent']}, {'cpu': 'dd'}),
+    ({'cpu': COLUMNS['cpu']}, {'cpu': 'ddddd'}),
+])
+def test_hello_with_unknown_layout_is_rejected(tmp_path, columns, types):
+    aggregator = Aggregator(str(tmp_path / 'fleet'), '127.0.0.1', 0)
+    aggregator.start()
+    with socket.create_connection(('127.0.0.1', aggregator.port), timeout=5) as sock:
+        sock.sendall(encode_hello('evil', columns, types))
+        assert sock.recv(4) == b''
+    aggregator.stop()
+    assert not aggregator.partitions
+    assert not list(tmp_path.rglob('*_metrics*'))
+
+
+def test_frame_inflating_past_limit_is_rejected():
+    frame = encode_frame(HELLO, b' ' * (1 << 20))[4:]
+    assert decode_frame(frame)[0] == HELLO
+    with pytest.raises(ValueError):
+        decode_frame(frame, max_size=1 << 16)
+    with pytest.raises(ValueError):
+        decode_frame(zlib.compress(b'B' + bytes(MAX_FRAME)))
+    with pytest.raises(ValueError):
+        decode_frame(frame[:len(frame) // 2])
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+# The collectors run on every monitored host: they must start without the
+# analysis stack, which only the offline tools import
+@pytest.mark.parametrize('module', ['src.system_metrics_collector', 'src.java_lock_metrics_collector'])
+@pytest.mark.parametrize('heavy', ['pandas', 'matplotlib'])
+def test_collector_does_not_import(module, heavy):
+    code = f'import sys, {module}; sys.exit({heavy!r} in sys.modules)'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', code], cwd=root).returncode == 0
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+from src.alerts import AlertEngine
+from src.java_lock_metrics_collector import CONTENTION_COLUMNS, COLUMNS, JavaLockMetricsCollector
+from src.jvm_connection import JstatStream
+from src.stack_table import JavaTables, load_table
+from src.thread_dump_parser import parse_thread_dump
+from src.wallclock_profiler import WallClockProfiler
+
+
+class ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def bare_collector(**attributes):
+    # A collector without a JVM: __init__ checks the pid is a running java
+    collector = JavaLockMetricsCollector.__new__(JavaLockMetricsCollector)
+    collector.jmx = None
+    collector.jstat = None
+    collector.last_gc_time = None
+    collector.anomalies = None
+    collector.monitor = None
+    collector.__dict__.update(attributes)
+    return collector
+
+
+def test_sample_gc_from_jstat_lines(tmp_path, monkeypatch):
+    # A jstat on PATH printing the JDK 17 `jstat -gc` header and two samples,
+    # the second once the test asks for it
+    jstat = tmp_path / 'jstat'
+    jstat.write_text(f"""#!/bin/sh
+echo "    S0C         S1C         S0U         S1U          EC           EU           OC           OU          \\
+MC         MU       CCSC      CCSU     YGC     YGCT     FGC    FGCT     CGC    CGCT       GCT   "
+echo "     0.0     4096.0        0.0     4096.0    51200.0     8192.0    77824.0    30720.0    \\
+46080.0    45500.1    6144.0    5800.3      7     0.042     0     0.000     -        -     0.100"
+while [ ! -e {tmp_path}/next ]; do sleep 0.02; done
+echo "     0.0     4096.0        0.0     4096.0    51200.0    16384.0    77824.0    31744.0    \\
+46080.0    45500.1    6144.0    5800.3      8     0.047     0     0.000     -        -     0.105"
+sleep 10
+""")
+    os.chmod(jstat, 0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    stream = JstatStream(os.getpid(), 1)
+    collector = bare_collector(jstat=stream, sinks={'gc': ListSink()})
+    try:
+        wait_for(lambda: stream.latest is not None)
+        collector.sample_gc()
+        (tmp_path / 'next').touch()
+        wait_for(lambda: stream.latest is not None)
+        collector.sample_gc()
+    finally:
+        stream.close()
+
+    first, second = collector.sinks['gc'].rows
+    assert first[1:] == ['All', 0, 8192.0, 30720.0]
+    assert second[1] == 'All'
+    assert second[2] == pytest.approx(5.0)
+    assert second[3:] == [16384.0, 31744.0]
+
+
+# Two pool threads with one name: #31 holds the lock #32 is blocked on
+SAME_NAME_DUMP = '''"worker" #31 [4031] prio=5 os_prio=0 cpu=1.00ms elapsed=1.00s tid=0x1f nid=4031 sleeping  [0x1f]
+   java.lang.Thread.State: TIMED_WAITING (sleeping)
+\tat com.example.Worker.run(Worker.java:20)
+\t- locked <0x000000071ab0e2a8> (a java.lang.Object)
+
+"worker" #32 [4032] prio=5 os_prio=0 cpu=1.00ms elapsed=1.00s tid=0x20 nid=4032 waiting for monitor entry  [0x20]
+   java.lang.Thread.State: BLOCKED (on object monitor)
+\tat com.example.Worker.run(Worker.java:10)
+\t- waiting to lock <0x000000071ab0e2a8> (a java.lang.Object)
+'''
+
+
+def test_threads_sharing_a_name_keep_their_own_ids(tmp_path):
+    collector = bare_collector(tables=JavaTables(tmp_path), sinks={metric: ListSink() for metric in COLUMNS},
+                               profiler=WallClockProfiler(ListSink()),
+                               alerts=AlertEngine([], {'contention': CONTENTION_COLUMNS}, str(tmp_path)))
+    threads, locks = parse_thread_dump(SAME_NAME_DUMP)
+    collector.record_thread_info(1700000000.0, threads, locks)
+    collector.tables.close()
+
+    assert load_table(tmp_path / 'java_thread_names.csv') == {0: ['worker', '#32'], 1: ['worker', '#31']}
+    assert [row[1] for row in collector.sinks['threads'].rows] == [1, 0]
+    lock_row, = collector.sinks['locks'].rows
+    assert (lock_row[1], lock_row[3]) == (0, 1)
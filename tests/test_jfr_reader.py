@@ -0,0 +1,104 @@
+import csv
+import json
+import os
+
+import pytest
+
+from benchmarks.generators import generate_jfr_recording
+from src.jfr_reader import (HEADER_SIZE, JfrInput, LOCK_EVENTS, LockWaitRecorder, iter_chunks, iter_lock_batches,
+                            iter_lock_events)
+from src.stack_table import StackTable, frame_key
+from src.thread_dump_parser import parse_thread_dump
+
+# Recorded from a JDK 25 JVM by tests/fixtures/record_lock_fixtures.py: 20
+# contended Hashtable monitor enters and 20 ReentrantLock parks, the JDK's own
+# `jfr print` of them, and a jstack dump taken during the first monitor wait
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+RECORDING = os.path.join(FIXTURES, 'lock_contention.jfr')
+
+
+def expected_events():
+    with open(os.path.join(FIXTURES, 'lock_contention_jfr.json')) as f:
+        return json.load(f)
+
+
+def seconds(duration):
+    # ISO 8601 duration as printed by `jfr print --json`, e.g. PT0.024657685S
+    return float(duration[2:-1])
+
+
+def printed_key(frame):
+    # java/util/Hashtable.put:-1 -> java.util.Hashtable.put, as frame_key has it
+    method, line = frame.rsplit(':', 1)
+    return method.replace('/', '.') + (f':{line}' if int(line) > 0 else '')
+
+
+def test_fixture_events_match_jfr_print():
+    events = sorted(iter_lock_events(RECORDING), key=lambda e: (e['event'], e['wait_time']))
+    expected = sorted(expected_events(), key=lambda e: (e['event'], seconds(e['duration'])))
+    assert len(events) == len(expected) == 40
+    for event, printed in zip(events, expected):
+        assert event['event'] == printed['event']
+        assert event['wait_time'] == pytest.approx(seconds(printed['duration']) * 1000, abs=1e-3)
+        assert event['thread_name'] == printed['thread']
+        assert event['owner_thread'] == printed['owner']
+        assert event['lock_class'] == printed['lock_class'].replace('/', '.')
+        assert event['lock_id'] == f"0x{printed['address']:016x}"
+        assert [frame_key(frame) for frame in event['stack']] == [printed_key(f) for f in printed['frames']]
+
+
+def test_fixture_monitor_stack_joins_jstack_stack(tmp_path):
+    with open(os.path.join(FIXTURES, 'lock_contention_jstack.txt')) as f:
+        threads, locks = parse_thread_dump(f)
+    waiting = next(lock for lock in locks if lock['lock_class'] == 'java.util.Hashtable' and lock['owner_thread'])
+    assert waiting['owner_thread'] == 'Thread-1'
+    waiter = next(thread for thread in threads if thread['thread_id'] == waiting['thread_id'])
+
+    monitor_enter = next(e for e in iter_lock_events(RECORDING) if e['event'] == 'jdk.JavaMonitorEnter')
+    assert monitor_enter['thread_name'] == waiter['name']
+    assert monitor_enter['thread_id'] == waiter['thread_id']
+    assert monitor_enter['owner_id'] == waiting['owner_id']
+
+    # jstack prints java.util.Hashtable.put(java.base@25.0.2/Unknown Source)
+    stacks = StackTable(tmp_path / 'frames.csv', tmp_path / 'stacks.csv')
+    assert stacks.intern(waiter['stack']) == stacks.intern(monitor_enter['stack'])
+    stacks.close()
+
+
+def test_recorder_writes_fixture_tables(tmp_path):
+    recorder = LockWaitRecorder(str(tmp_path))
+    for batch in iter_lock_batches(RECORDING):
+        recorder.add_batch(batch)
+    summary = {row[2]: row for row in recorder.summary()}
+    recorder.close()
+
+    assert recorder.events == 40
+    hashtable = summary['java.util.Hashtable']
+    assert hashtable[3] == 20
+    assert hashtable[10] == 'Thread-1'
+    with open(tmp_path / 'jfr_lock_waits.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['timestamp', 'thread_id', 'lock_id', 'wait_time', 'owner_thread_id', 'stack_id']
+    assert len(rows) == 41
+
+
+def test_column_decoding_matches_event_reader(tmp_path):
+    # The numpy decoding against the per-event field readers, on every field
+    path = tmp_path / 'generated.jfr'
+    path.write_bytes(generate_jfr_recording(3000, chunk_events=1000))
+    for chunk in iter_chunks(path):
+        data = chunk.buf[chunk.header.start:chunk.header.start + chunk.header.size]
+        for jfr_type, columns in chunk.event_columns(LOCK_EVENTS):
+            starts = []
+            inp = JfrInput(data, HEADER_SIZE)
+            while inp.pos < len(data):
+                position = inp.pos
+                size = inp.int()
+                if inp.pos < len(data) and JfrInput(data, inp.pos).long() == jfr_type.id:
+                    starts.append(inp.pos)
+                inp.pos = position + size
+            assert len(starts) == len(columns['startTime'])
+            read = chunk._read_columns(jfr_type, data, starts)
+            assert columns.keys() == read.keys()
+            for name in columns:
+                assert columns[name].tolist() == read[name].tolist()
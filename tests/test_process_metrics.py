@@ -0,0 +1,38 @@
+import os
+
+import psutil
+import pytest
+
+from src.process_metrics import ProcessHandle, ProcessTracker
+
+
+def test_reused_pid_is_not_read_as_the_old_process():
+    # Without a /proc stat file the handle compares start times: a process
+    # with the same pid but another start time is a different process
+    handle = ProcessHandle(os.getpid())
+    handle.update(1.0)
+    handle.key = (handle.pid, handle.key[1] - 100)
+    with pytest.raises(psutil.NoSuchProcess):
+        handle.update(2.0)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='needs /proc')
+def test_tracker_keeps_at_most_max_open_stat_files():
+    tracker = ProcessTracker(max_open=2)
+    tracker.sample(1.0)
+    rows = tracker.sample(2.0)
+    assert rows
+    assert len(tracker.open_stats) == 2
+    assert sum(1 for handle in tracker.handles.values() if handle.stat) == 2
+    tracker.close()
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='needs /proc')
+def test_stat_read_of_a_reused_pid_is_another_process():
+    # Not kept open, the stat file is opened per read; its start time tells
+    # a new process with the same pid apart
+    handle = ProcessHandle(os.getpid(), f'/proc/{os.getpid()}/stat')
+    handle.update(1.0)
+    handle.start_ticks = b'1'
+    with pytest.raises(psutil.NoSuchProcess):
+        handle.update(2.0)
@@ -0,0 +1,48 @@
+import gzip
+import os
+
+from src.sinks import DeviceSink, find_segments, open_sink, read_device_segments, read_index
+from src.stack_table import JavaTables, load_names
+
+
+def test_dictionary_entries_reach_disk_before_rows(tmp_path):
+    tables = JavaTables(tmp_path)
+    sink = open_sink(f'{tmp_path}/java_locks', ['timestamp', 'thread_id'], {'flush_rows': 2},
+                     datetime_column=False, before_flush=tables.flush)
+    for i in range(3):
+        sink.write([1700000000 + i, tables.thread(f'worker-{i}')])
+        # Whatever rows were flushed, their ids are in the dictionary file
+        with open(f'{tmp_path}/java_locks.csv') as f:
+            written = [int(line.split(',')[1]) for line in f.read().splitlines()[1:]]
+        assert set(written) <= set(load_names(tmp_path, 'java_thread_names'))
+    assert written == [0, 1]
+    sink.close()
+    tables.close()
+
+
+def test_reopened_segment_time_gets_a_new_name(tmp_path):
+    config = {'rotate_interval': 60, 'flush_rows': 1}
+    for value in (1, 2):
+        # Same opening timestamp twice, as after a restart or a reopened bucket
+        sink = open_sink(f'{tmp_path}/cpu', ['timestamp', 'value'], config, datetime_column=False)
+        sink.write([1700000000.0, value])
+        sink.close()
+    names = sorted(entry[0] for entry in read_index(f'{tmp_path}/cpu'))
+    assert names == ['1700000000000-1.csv.gz', '1700000000000.csv.gz']
+    values = []
+    for path in find_segments(f'{tmp_path}/cpu'):
+        with gzip.open(path, 'rt') as f:
+            values.append(f.read().splitlines()[1])
+    assert values == ['1700000000.0,1', '1700000000.0,2']
+
+
+def test_device_segment_time_is_not_reused(tmp_path):
+    # A restart in the same millisecond, with a NIC gone in between
+    for devices in (['eth0', 'eth1'], ['eth0']):
+        sink = DeviceSink(f'{tmp_path}/pernic', ['bytes_sent'], 'Q', flush_rows=1)
+        sink.write(1700000000.0, devices, [[7] for _ in devices])
+        sink.close()
+    assert sorted(os.listdir(f'{tmp_path}/pernic')) == ['1700000000000', '1700000000000-1']
+    segments = read_device_segments(f'{tmp_path}/pernic', start=1700000000.0)
+    assert [(devices, columns['bytes_sent'].tolist()) for _, devices, columns in segments] == [
+        (['eth0', 'eth1'], [[7, 7]]), (['eth0'], [[7]])]
@@ -0,0 +1,30 @@
+import pytest
+
+from src.stack_table import InternTable, load_table
+
+
+def test_processes_sharing_a_dictionary_get_distinct_ids(tmp_path):
+    # Two tables on one file stand for the collector and the JFR reader
+    path = tmp_path / 'java_thread_names.csv'
+    collector = InternTable(path, ['thread_name'])
+    reader = InternTable(path, ['thread_name'])
+    assert collector.intern('main') == 0
+    assert reader.intern('worker-1') == 1
+    assert reader.intern('main') == 0
+    assert collector.intern('worker-1') == 1
+    collector.close()
+    reader.close()
+    assert load_table(path) == {0: ['main'], 1: ['worker-1']}
+
+    reopened = InternTable(path, ['thread_name'])
+    assert reopened.intern('worker-2') == 2
+    reopened.close()
+
+
+def test_duplicate_ids_are_an_error(tmp_path):
+    path = tmp_path / 'java_thread_names.csv'
+    path.write_text('id,thread_name\n0,main\n0,worker-1\n')
+    with pytest.raises(ValueError, match='id 0'):
+        load_table(path)
+    with pytest.raises(ValueError, match='id 0'):
+        InternTable(path, ['thread_name'])
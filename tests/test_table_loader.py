@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+
+from src.table_loader import TableLoader
+
+
+def append(path, rows):
+    with open(path, 'a') as f:
+        f.writelines(f'{timestamp},{cause},{pause}\n' for timestamp, cause, pause in rows)
+
+
+def test_cache_appends_parts_and_matches_a_fresh_parse(tmp_path):
+    path = f'{tmp_path}/gc_events.csv'
+    with open(path, 'w') as f:
+        f.write('timestamp,cause,pause_ms\n')
+    cache_dir = f'{tmp_path}/.cache'
+    dtypes = {'timestamp': 'float64', 'pause_ms': 'float64'}
+
+    for load in range(20):
+        append(path, [(1700000000 + load * 10 + i, 'G1 Evacuation Pause' if i % 3 else '', i / 10)
+                      for i in range(10)])
+        # A new loader each time, as a new plotting process: rows come from the disk cache
+        loader = TableLoader(cache_dir)
+        cached = loader.read(path, dtypes=dtypes)
+        assert loader.parsed_bytes < 400
+        pd.testing.assert_frame_equal(cached, TableLoader().read(path, dtypes=dtypes))
+
+    entries = os.listdir(cache_dir)
+    assert len(entries) == 1
+    files = sorted(os.listdir(f'{cache_dir}/{entries[0]}'))
+    # 20 appends of 10 rows end up as parts of 160 and 40 rows
+    assert files[-1] == 'meta.json' and all(name.endswith('.npy') for name in files[:-1])
+    assert len(files) == 3
+
+
+def test_replaced_file_is_parsed_again(tmp_path):
+    path = f'{tmp_path}/gc_events.csv'
+    cache_dir = f'{tmp_path}/.cache'
+    for first in (1, 2):
+        os.replace(write_new(tmp_path, first), path)
+        frame = TableLoader(cache_dir).read(path)
+        assert frame['timestamp'].tolist() == [first]
+
+
+def write_new(tmp_path, timestamp):
+    path = f'{tmp_path}/new.csv'
+    with open(path, 'w') as f:
+        f.write(f'timestamp,cause,pause_ms\n{timestamp},Allocation Failure,1.5\n')
+    return path
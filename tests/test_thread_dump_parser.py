@@ -0,0 +1,110 @@
+import io
+
+from benchmarks.generators import generate_thread_dump
+from src.thread_dump_parser import parse_thread_dump, summarize_locks, find_deadlocks
+
+# Trimmed `jstack -l` output of a JDK 21 JVM: OS thread ids after the thread
+# number, decimal nids, a carrier thread running a virtual thread
+JDK21_DUMP = '''2024-05-02 10:11:12
+Full thread dump OpenJDK 64-Bit Server VM (21.0.2+13-58, mixed mode, sharing):
+
+"main" #1 [2339] prio=5 os_prio=0 cpu=44.41ms elapsed=10.58s tid=0x00007f1c8002a0a0 nid=2339 waiting for monitor entry  [0x00007f1c86ffe000]
+   java.lang.Thread.State: BLOCKED (on object monitor)
+\tat com.example.Inventory.reserve(Inventory.java:42)
+\t- waiting to lock <0x000000071ab0e2a8> (a java.lang.Object)
+\tat com.example.Main.main(Main.java:12)
+
+   Locked ownable synchronizers:
+\t- None
+
+"pool-1-thread-1" #21 [2360] prio=5 os_prio=0 cpu=12.02ms elapsed=10.40s tid=0x00007f1c801a5e40 nid=2360 waiting on condition  [0x00007f1c5a1fe000]
+   java.lang.Thread.State: TIMED_WAITING (sleeping)
+\tat java.lang.Thread.sleep0(java.base@21.0.2/Native Method)
+\tat com.example.Inventory.restock(Inventory.java:77)
+\t- locked <0x000000071ab0e2a8> (a java.lang.Object)
+
+   Locked ownable synchronizers:
+\t- <0x000000071ac01120> (a java.util.concurrent.locks.ReentrantLock$NonfairSync)
+
+"ForkJoinPool-1-worker-1" #23 [2365] daemon prio=5 os_prio=0 cpu=3.10ms elapsed=10.30s tid=0x00007f1c801b9010 nid=2365 waiting on condition  [0x00007f1c59ffe000]
+   java.lang.Thread.State: WAITING (parking)
+   Carrying virtual thread #22
+\tat jdk.internal.misc.Unsafe.park(java.base@21.0.2/Native Method)
+\t- parking to wait for  <0x000000071ac01120> (a java.util.concurrent.locks.ReentrantLock$NonfairSync)
+\tat com.example.Orders.submit(Orders.java:30)
+
+   Locked ownable synchronizers:
+\t- None
+
+"VM Thread" os_prio=0 cpu=2.01ms elapsed=10.60s tid=0x00007f1c800d6c30 nid=2346 runnable
+
+JNI global refs: 9, weak refs: 0
+'''
+
+
+def header(number, name, status):
+    return (f'"{name}" #{number} [{number + 1000}] prio=5 os_prio=0 cpu=1.00ms elapsed=1.00s '
+            f'tid=0x{number:016x} nid={number + 1000} {status}  [0x{number:016x}]')
+
+
+def blocked(number, name, waiting_for, holding):
+    lines = [header(number, name, 'waiting for monitor entry'),
+             '   java.lang.Thread.State: BLOCKED (on object monitor)',
+             '\tat com.example.Worker.run(Worker.java:10)']
+    if waiting_for:
+        lines.append(f'\t- waiting to lock <{waiting_for}> (a java.lang.Object)')
+    if holding:
+        lines.append(f'\t- locked <{holding}> (a java.lang.Object)')
+    return '\n'.join(lines) + '\n\n'
+
+
+def test_parses_jdk21_headers():
+    threads, locks = parse_thread_dump(io.StringIO(JDK21_DUMP))
+
+    assert [(t['thread_id'], t['name'], t['state']) for t in threads] == [
+        ('#1', 'main', 'BLOCKED'),
+        ('#21', 'pool-1-thread-1', 'TIMED_WAITING'),
+        ('#23', 'ForkJoinPool-1-worker-1', 'WAITING'),
+        ('nid=2346', 'VM Thread', 'RUNNABLE')
+    ]
+    assert threads[0]['stack'] == ['com.example.Inventory.reserve(Inventory.java:42)',
+                                   'com.example.Main.main(Main.java:12)']
+    assert [(l['thread_id'], l['lock_id'], l['owner_id'], l['owner_thread']) for l in locks] == [
+        ('#1', '0x000000071ab0e2a8', '#21', 'pool-1-thread-1'),
+        ('#23', '0x000000071ac01120', '#21', 'pool-1-thread-1')
+    ]
+    assert sorted((s['lock_id'], s['owner_id'], s['waiters']) for s in summarize_locks(locks)) == [
+        ('0x000000071ab0e2a8', '#21', 1), ('0x000000071ac01120', '#21', 1)
+    ]
+    assert find_deadlocks(locks) == []
+
+
+def test_virtual_thread_header():
+    dump = ('"" #40 virtual prio=5 os_prio=0 cpu=0.10ms elapsed=0.20s tid=0x00007f1c801c0000 nid=2400 '
+            'waiting on condition  [0x0]\n   java.lang.Thread.State: WAITING (parking)\n')
+    threads, _ = parse_thread_dump(dump)
+    assert [(t['thread_id'], t['name'], t['state']) for t in threads] == [('#40', '', 'WAITING')]
+
+
+def test_same_names_do_not_make_a_cycle():
+    # worker #30 waits for other #31, which waits for a different worker #32
+    dump = (blocked(30, 'worker', '0x1', None) + blocked(31, 'other', '0x2', '0x1')
+            + blocked(32, 'worker', None, '0x2'))
+    _, locks = parse_thread_dump(dump)
+    assert find_deadlocks(locks) == []
+
+
+def test_deadlock_between_threads_with_the_same_name():
+    dump = blocked(30, 'worker', '0x2', '0x1') + blocked(31, 'worker', '0x1', '0x2')
+    _, locks = parse_thread_dump(dump)
+    assert find_deadlocks(locks) == [['worker #30', 'worker #31']]
+
+
+def test_generated_dump():
+    dump = generate_thread_dump(threads=300, contended_locks=5, depth=5, deadlocks=2)
+    threads, locks = parse_thread_dump(io.StringIO(dump))
+    assert len(threads) == 301
+    assert len({t['thread_id'] for t in threads}) == 301
+    assert len(find_deadlocks(locks)) == 2
+    owned = [l for l in locks if l['blocking']]
+    assert owned and all(l['owner_id'] for l in owned)
@@ -0,0 +1,19 @@
+import sys
+
+from src.wallclock_profiler import _flame_layout, write_svg
+
+
+def test_flame_layout_places_children_in_name_order():
+    total, boxes = _flame_layout({'main;b': 2, 'main;a;x': 1, 'main;a': 3})
+    assert total == 6
+    assert boxes == [(0, 0, 6, 'main'), (1, 0, 4, 'a'), (2, 0, 1, 'x'), (1, 4, 2, 'b')]
+
+
+def test_stack_deeper_than_the_recursion_limit(tmp_path):
+    depth = sys.getrecursionlimit() + 500
+    stack = ';'.join(f'com.example.Recursive.call{i % 7}' for i in range(depth))
+    total, boxes = _flame_layout({stack: 3})
+    assert total == 3
+    assert len(boxes) == depth
+    assert boxes[-1] == (depth - 1, 0, 3, f'com.example.Recursive.call{(depth - 1) % 7}')
+    write_svg({stack: 3}, tmp_path / 'deep.svg')